@@ -68,7 +68,7 @@ def main(argv):
                                   re.M).search(data).group(1)
             arcname = "%s/%s" % (pkg_name.replace(".", "/"),
                                  os.path.basename(f))
-            srcjar.writestr(arcname, data)
+            build_utils.add_to_zip_hermetic(srcjar, arcname, src_path=f)
         pass
 
     if args.depfile:
@@ -200,10 +200,9 @@ def main(argv):
                     zipfile.ZipFile(tmp_apk, "w", zipfile.ZIP_DEFLATED) as out_apk:
                 def copy_resource(zipinfo):
                     compress = zipinfo.compress_type != zipfile.ZIP_STORED
-                    build_utils.add_to_zip_hermetic(out_apk, zipinfo.filename,
-                                                    data=resource_apk.read(
-                                                        zipinfo.filename),
-                                                    compress=compress)
+                    build_utils.add_zip_entry_hermetic(out_apk, zipinfo.filename,
+                                                       resource_apk, zipinfo,
+                                                       compress=compress)
 
                 resource_infos = resource_apk.infolist()
 
@@ -225,8 +224,8 @@ def main(argv):
                 if args.dex_file and args.dex_file.endswith(".zip"):
                     with zipfile.ZipFile(args.dex_file, mode="r") as dex_zip:
                         for dex in (d for d in dex_zip.namelist() if d.endswith(".dex")):
-                            build_utils.add_to_zip_hermetic(out_apk, dex,
-                                                            data=dex_zip.read(dex))
+                            build_utils.add_zip_entry_hermetic(out_apk, dex,
+                                                               dex_zip, dex)
                 elif args.dex_file:
                     build_utils.add_to_zip_hermetic(out_apk, "classes.dex",
                                                     src_path=args.dex_file)
@@ -265,8 +264,8 @@ def main(argv):
                             if apk_path_lower.endswith(".class"):
                                 continue
 
-                            build_utils.add_to_zip_hermetic(out_apk, apk_path,
-                                                            data=emma_device_jar.read(apk_path))
+                            build_utils.add_zip_entry_hermetic(out_apk, apk_path,
+                                                               emma_device_jar, apk_path)
 
                 # 7. srczip files.
                 if args.srczip_path:
@@ -280,8 +279,8 @@ def main(argv):
                             if apk_path_lower.endswith(".class"):
                                 continue
 
-                            build_utils.add_to_zip_hermetic(out_apk, apk_path,
-                                                            data=srczip_file.read(apk_path))
+                            build_utils.add_zip_entry_hermetic(out_apk, apk_path,
+                                                               srczip_file, apk_path)
                 pass
 
             shutil.move(tmp_apk, args.output_apk)
@@ -83,7 +83,7 @@ def remove_unwanted_files_from_zip(dex_path):
             zipfile.ZipFile(tmp_dex_path, "w", zipfile.ZIP_DEFLATED) as oz:
         for i in iz.namelist():
             if i.endswith(".dex"):
-                oz.writestr(i, iz.read(i))
+                build_utils.add_zip_entry_hermetic(oz, i, iz, i)
         pass
 
     os.remove(dex_path)
@@ -0,0 +1,87 @@
+# -*- encoding: utf-8 -*-
+
+"""比较.md5.stamp记录可以使用的摘要算法的吞吐量
+
+不指定文件的时候使用典型的资源文件和jar文件大小生成测试数据。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from util import build_utils
+from util import md5_check
+
+# (名称, 文件大小, 文件个数)
+_TYPICAL_INPUTS = (
+    ("resource", 4 * 1024, 2000),
+    ("small-jar", 256 * 1024, 64),
+    ("jar", 4 * 1024 * 1024, 16),
+    ("large-jar", 64 * 1024 * 1024, 2),
+)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog="digest_benchmark.py")
+    parser.add_argument("--algorithm", action="append", default=[],
+                        help="Digest algorithms to compare, defaults to all.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("paths", nargs="*",
+                        help="Files to hash instead of the generated inputs.")
+    return parser
+
+
+def _generate_inputs(base_dir):
+    groups = []
+    for name, size, count in _TYPICAL_INPUTS:
+        group_dir = os.path.join(base_dir, name)
+        build_utils.make_directory(group_dir)
+        paths = []
+        for i in range(count):
+            path = os.path.join(group_dir, "%d.bin" % i)
+            with open(path, mode="wb") as fp:
+                fp.write(os.urandom(size))
+            paths.append(path)
+        groups.append((name, paths))
+    return groups
+
+
+def _measure(paths, algorithm, repeat):
+    total_size = sum(os.path.getsize(path) for path in paths)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            md5_check._compute_digest_for_path(path, algorithm)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return total_size / max(best, 1e-9) / (1024 * 1024)
+
+
+def _report(groups, algorithms, repeat):
+    print("%-12s" % "" + "".join("%12s" % a for a in algorithms))
+    for name, paths in groups:
+        line = "%-12s" % name
+        for algorithm in algorithms:
+            line += "%7.1f MB/s" % _measure(paths, algorithm, repeat)
+        print(line)
+    pass
+
+
+def main(argv):
+    args = create_parser().parse_args(argv)
+    algorithms = args.algorithm or md5_check.digest_algorithms()
+
+    if args.paths:
+        _report([("inputs", args.paths)], algorithms, args.repeat)
+        return
+
+    with build_utils.temp_dir() as base_dir:
+        _report(_generate_inputs(base_dir), algorithms, args.repeat)
+    pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+    pass
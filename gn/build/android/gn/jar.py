@@ -1,35 +1,65 @@
 # -*- coding: utf-8 -*-
 
 import os
-import subprocess
+import zipfile
 
 from util import build_utils
 
+_MANIFEST_PATH = "META-INF/MANIFEST.MF"
+_DEFAULT_MANIFEST = b"Manifest-Version: 1.0\r\n\r\n"
+
+
+def _read_manifest(manifest_file):
+    if not manifest_file:
+        return _DEFAULT_MANIFEST
+    with open(manifest_file, mode="rb") as fp:
+        return fp.read()
+
+
+def jar_split(class_files, classes_dir, outputs, manifest_file=None):
+    """遍历一次class文件，分别打包到多个jar中
+    :param outputs: [(jar_path, predicate)]，每个文件写入第一个predicate满足的jar
+    """
+    manifest = _read_manifest(manifest_file)
+    entries = sorted((os.path.relpath(f, classes_dir).replace("\\", "/"), f)
+                     for f in class_files)
+
+    zip_files = []
+    try:
+        for jar_path, _ in outputs:
+            zip_file = zipfile.ZipFile(jar_path, mode="w")
+            zip_files.append(zip_file)
+            build_utils.add_to_zip_hermetic(zip_file, _MANIFEST_PATH,
+                                            data=manifest,
+                                            compress=False)
+
+        for zip_path, path in entries:
+            for zip_file, (_, predicate) in zip(zip_files, outputs):
+                if not predicate or predicate(path):
+                    build_utils.add_to_zip_hermetic(zip_file, zip_path,
+                                                    src_path=path,
+                                                    compress=False)
+                    break
+            pass
+    finally:
+        for zip_file in zip_files:
+            zip_file.close()
+    pass
+
 
 def jar(class_files, classes_dir, jar_path, manifest_file=None, predicate=None):
-    class_files_rel = [os.path.relpath(f, classes_dir) for f in class_files
-                       if not predicate or predicate(f)]
-
-    cmd = ["jar", "cf0",
-           os.path.relpath(jar_path, classes_dir)]
-    if manifest_file:
-        cmd[1] += "m"
-        cmd += [os.path.relpath(manifest_file, class_files)]
-
-    if not class_files_rel:
-        empty_file = os.path.join(classes_dir, ".empty")
-        build_utils.touch(empty_file)
-        class_files_rel.append(os.path.relpath(empty_file, classes_dir))
-    cmd += class_files_rel
-    subprocess.check_call(cmd, cwd=classes_dir)
+    jar_split(class_files, classes_dir, [(jar_path, predicate)],
+              manifest_file=manifest_file)
     pass
 
 
-def jar_directory(classes_dir, jar_path, manifest_file=None, predicate=None):
+def jar_directory_split(classes_dir, outputs, manifest_file=None):
     class_files = build_utils.find_in_directory(classes_dir, "*.class")
-    if predicate:
-        class_files = [f for f in class_files
-                       if predicate(f)]
-    jar(class_files, classes_dir, jar_path,
-        manifest_file=manifest_file, predicate=predicate)
+    jar_split(class_files, classes_dir, outputs, manifest_file=manifest_file)
+    pass
+
+
+def jar_directory(classes_dir, jar_path, manifest_file=None, predicate=None):
+    jar_directory_split(classes_dir, [(jar_path, predicate)],
+                        manifest_file=manifest_file)
     pass
@@ -2,11 +2,17 @@
 
 import argparse
 import os
+import re
 import subprocess
 import sys
 
 import jar
 from util import build_utils
+from util import class_deps
+
+
+# 接口的变化传递太多轮的时候全量编译
+_MAX_INCREMENTAL_ROUNDS = 8
 
 
 def normalize_paths(paths):
@@ -64,12 +70,47 @@ def _filter_java_files(paths, filters):
     return [p for p in paths if not filters or build_utils.matches_glob(p, filters)]
 
 
-def _on_stale_md5(args, javac_cmd, java_files):
+def _excluded_jar_path(args):
+    return args.jar_path.replace(".jar", ".excluded.jar")
+
+
+def _create_javac_cmd(args, classpath):
+    javac_cmd = ["javac"]
+    javac_cmd.extend([
+        "-g",
+        "-encoding", "utf-8",
+        "-classpath", build_utils.CLASSPATH_SEP.join(classpath),
+        "-sourcepath", "",
+        "-source", "1.8",
+        "-target", "1.8",
+    ])
+
+    if args.bootclasspath:
+        javac_cmd.extend([
+            "-bootclasspath",
+            build_utils.CLASSPATH_SEP.join(args.bootclasspath)
+        ])
+    return javac_cmd
+
+
+def _compile(javac_cmd, classes_dir, java_sources_file, java_files):
+    build_utils.write_sources_file(java_sources_file, [os.path.normpath(x)
+                                                       for x in java_files])
+    cmd = javac_cmd + ["-d", classes_dir, "@" + java_sources_file]
+
+    subprocess.check_call(cmd)
+    pass
+
+
+def _on_stale_md5(args, javac_cmd, java_files, changes=None):
     base_dir = args.base_dir
+    if changes and _on_stale_md5_incremental(args, java_files, changes):
+        _create_jars(args, os.path.join(base_dir, "classes"))
+        return
+
     build_utils.make_directory(base_dir)
     build_utils.remove_subtree(base_dir)
 
-    excluded_jar_path = args.jar_path.replace(".jar", ".excluded.jar")
     java_sources_file = os.path.join(base_dir, "sources.txt")
 
     classes_dir = os.path.join(base_dir, "classes")
@@ -88,13 +129,207 @@ def _on_stale_md5(args, javac_cmd, java_files):
         pass
 
     if java_files:
-        build_utils.write_sources_file(java_sources_file, [os.path.normpath(x)
-                                                           for x in java_files])
-        cmd = javac_cmd + ["-d", classes_dir, "@" + java_sources_file]
+        _compile(javac_cmd, classes_dir, java_sources_file, java_files)
+        pass
+
+    _create_class_deps(args, classes_dir, java_files)
+    _create_jars(args, classes_dir)
+    pass
+
+
+def _java_package_dir(path):
+    """从源文件中读取包名对应的路径
+    """
+    with open(path, mode="r", encoding="utf-8") as fp:
+        match = re.search(r"^\s*package\s+([\w.]+)\s*;", fp.read(), re.MULTILINE)
+    return match.group(1).replace(".", "/") if match else ""
+
+
+def _class_deps_path(args):
+    return os.path.join(args.base_dir, "class_deps.json")
 
-        subprocess.check_call(cmd)
+
+def _interface_jar_path(jar_path):
+    return jar_path[:-3] + "interface.jar"
+
+
+def _read_class_deps(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, mode="r", encoding="utf-8") as fp:
+        try:
+            return class_deps.ClassDependencyIndex.from_file(fp)
+        except (ValueError, KeyError):
+            return None
+
+
+def _write_class_deps(path, index):
+    with open(path, mode="w+", encoding="utf-8") as fp:
+        index.to_file(fp)
+    pass
+
+
+def _collect_class_infos(classes_dir, java_files):
+    """解析源文件编译出来的class文件
+    :return: {源文件: [ClassInfo]}
+    """
+    sources_by_key = {}
+    package_dirs = set()
+    for java_file in java_files:
+        package_dir = _java_package_dir(java_file)
+        key = "/".join(filter(None, (package_dir, os.path.basename(java_file))))
+        sources_by_key[key] = os.path.normpath(java_file)
+        package_dirs.add(package_dir)
+
+    ret = dict((source, []) for source in sources_by_key.values())
+    for package_dir in package_dirs:
+        class_dir = os.path.join(classes_dir, package_dir)
+        if not os.path.isdir(class_dir):
+            continue
+        for filename in os.listdir(class_dir):
+            if not filename.endswith(".class"):
+                continue
+            info = class_deps.parse_class_file(os.path.join(class_dir, filename))
+            key = "/".join(filter(None, (package_dir, info.source_file)))
+            if key in sources_by_key:
+                ret[sources_by_key[key]].append(info)
+    return ret
+
+
+def _create_class_deps(args, classes_dir, java_files):
+    """全量编译之后重新生成类的引用关系
+    """
+    index = class_deps.ClassDependencyIndex()
+    for source, infos in _collect_class_infos(classes_dir, java_files).items():
+        index.add_source(source, infos)
+    for jar_path in args.classpath:
+        interface_jar = _interface_jar_path(jar_path)
+        if os.path.exists(interface_jar):
+            index.set_classpath_entries(jar_path,
+                                        class_deps.interface_jar_entries(interface_jar))
+    _write_class_deps(_class_deps_path(args), index)
+    pass
+
+
+def _changed_interface_classes(index, jar_path):
+    """根据interface jar得到接口发生了变化的类，只修改了方法体的时候为空
+    :return: 不能确定的时候返回None
+    """
+    old_entries = index.classpath_entries(jar_path)
+    interface_jar = _interface_jar_path(jar_path)
+    if old_entries is None or not os.path.exists(interface_jar):
+        return None
+
+    new_entries = class_deps.interface_jar_entries(interface_jar)
+    changed = set()
+    for name in set(old_entries) | set(new_entries):
+        old_entry = old_entries.get(name)
+        new_entry = new_entries.get(name)
+        if old_entry == new_entry:
+            continue
+        if old_entry and new_entry and old_entry[1] != new_entry[1]:
+            # 常量会被内联，无法通过引用关系找到使用者
+            return None
+        changed.add(name)
+    index.set_classpath_entries(jar_path, new_entries)
+    return changed
+
+
+def _on_stale_md5_incremental(args, java_files, changes):
+    """只编译修改过的源文件，以及依赖的类公开接口发生了变化的源文件
+    :return: 不能增量编译的时候返回False
+    """
+    base_dir = args.base_dir
+    classes_dir = os.path.join(base_dir, "classes")
+    java_dir = os.path.join(base_dir, "java")
+    index = _read_class_deps(_class_deps_path(args))
+    if (index is None
+            or not os.path.isdir(classes_dir)
+            or not changes.added_or_modified_only()):
+        return False
+
+    srcjars = set(args.java_srcjars)
+    classpath = set(args.classpath)
+    changed_sources = []
+    changed_classes = set()
+    for path in list(changes.iter_modified_paths()) + list(changes.iter_added_paths()):
+        if path in srcjars:
+            subpaths = (list(changes.iter_modified_subpaths(path))
+                        + list(changes.iter_added_subpaths(path)))
+            for subpath in subpaths:
+                if not subpath.endswith(".java"):
+                    continue
+                build_utils.extract_all(path,
+                                        base_dir=java_dir,
+                                        no_clobber=False,
+                                        predicate=lambda name: name == subpath)
+                changed_sources.append(os.path.join(java_dir, subpath))
+        elif path.endswith(".java"):
+            changed_sources.append(path)
+        elif path in classpath:
+            changed = _changed_interface_classes(index, path)
+            if changed is None:
+                return False
+            changed_classes.update(changed)
+        else:
+            return False
+        pass
+
+    all_sources = list(java_files)
+    if os.path.isdir(java_dir):
+        all_sources.extend(build_utils.find_in_directory(java_dir, "*.java"))
+    all_sources = _filter_java_files(all_sources, args.javac_includes)
+    known_sources = set(os.path.normpath(p) for p in all_sources)
+
+    pending = set(os.path.normpath(p)
+                  for p in _filter_java_files(changed_sources, args.javac_includes))
+    pending.update(index.sources_depending_on(changed_classes))
+    pending.intersection_update(known_sources)
+
+    javac_cmd = _create_javac_cmd(args, [classes_dir] + args.classpath)
+    rounds = 0
+    while pending:
+        old_entries = {}
+        for source in pending:
+            for name, entry in index.remove_source(source).items():
+                old_entries[name] = entry
+                class_file = os.path.join(classes_dir, name + ".class")
+                if os.path.exists(class_file):
+                    os.remove(class_file)
+            pass
+
+        sources = sorted(pending)
+        _compile(javac_cmd, classes_dir, os.path.join(base_dir, "sources.txt"), sources)
+
+        # 删除的类也算作接口发生了变化
+        api_changed = set(old_entries)
+        for source, infos in _collect_class_infos(classes_dir, sources).items():
+            index.add_source(source, infos)
+            for info in infos:
+                old_entry = old_entries.get(info.name)
+                if old_entry and old_entry["constants"] != info.constants:
+                    # 常量会被内联，无法通过引用关系找到使用者
+                    return False
+                if old_entry and old_entry["api"] == info.api:
+                    api_changed.discard(info.name)
+                else:
+                    api_changed.add(info.name)
+            pass
+
+        # 之前几轮编译过的源文件也要重新编译，同一轮编译的源文件已经使用了新的接口
+        pending = set(index.sources_depending_on(api_changed))
+        pending.intersection_update(known_sources)
+        pending.difference_update(sources)
+        rounds += 1
+        if pending and rounds >= _MAX_INCREMENTAL_ROUNDS:
+            return False
         pass
 
+    _write_class_deps(_class_deps_path(args), index)
+    return True
+
+
+def _create_jars(args, classes_dir):
     glob = args.jar_excluded_classes
 
     def includes_jar_predicate(x):
@@ -103,10 +338,10 @@ def _on_stale_md5(args, javac_cmd, java_files):
     def excludes_jar_predicate(x):
         return build_utils.matches_glob(x, glob)
 
-    jar.jar_directory(classes_dir, args.jar_path,
-                      predicate=includes_jar_predicate)
-    jar.jar_directory(classes_dir, excluded_jar_path,
-                      predicate=excludes_jar_predicate)
+    jar.jar_directory_split(classes_dir, [
+        (args.jar_path, includes_jar_predicate),
+        (_excluded_jar_path(args), excludes_jar_predicate),
+    ])
     pass
 
 
@@ -122,25 +357,20 @@ def main(argv):
 
     java_files = _filter_java_files(java_files, args.javac_includes)
 
-    javac_cmd = ["javac"]
-    javac_cmd.extend([
-        "-g",
-        "-encoding", "utf-8",
-        "-classpath", build_utils.CLASSPATH_SEP.join(args.classpath),
-        "-sourcepath", "",
-        "-source", "1.8",
-        "-target", "1.8",
-    ])
+    javac_cmd = _create_javac_cmd(args, args.classpath)
 
-    if args.bootclasspath:
-        javac_cmd.extend([
-            "-bootclasspath",
-            build_utils.CLASSPATH_SEP.join(args.bootclasspath)
-        ])
+    input_paths = (java_files + args.java_srcjars
+                   + args.classpath + args.bootclasspath)
+    input_strings = javac_cmd + args.javac_includes + args.jar_excluded_classes
+    output_paths = [args.jar_path, _excluded_jar_path(args)]
 
-    _on_stale_md5(args, javac_cmd, java_files)
-    all_inputs = build_utils.get_python_dependencies()
-    build_utils.write_dep_file(args.depfile, all_inputs)
+    build_utils.call_and_write_dep_file_if_stale(
+        lambda changes: _on_stale_md5(args, javac_cmd, java_files, changes),
+        args,
+        input_paths=input_paths,
+        input_strings=input_strings,
+        output_paths=output_paths,
+        pass_changes=True)
     pass
 
 
@@ -0,0 +1,195 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from util import digest_cache
+
+# 测试不使用工作目录中的摘要缓存
+os.environ[digest_cache.DIGEST_CACHE_ENV] = ""
+
+import javac
+
+_HAS_JAVAC = shutil.which("javac") is not None
+
+# A使用B的方法，C使用B的常量，D和B没有关系
+_SOURCES = {
+    "a/A.java": "package a;\npublic class A {\n    public int use(B b) {\n        return b.g();\n    }\n}\n",
+    "a/B.java": ("package a;\npublic class B {\n    public static final int K = %(k)d;\n"
+                 "    public int g() {\n        return %(body)d;\n    }\n%(extra)s}\n"),
+    "a/C.java": "package a;\npublic class C {\n    public int k() {\n        return B.K;\n    }\n}\n",
+    "a/D.java": "package a;\npublic class D {\n    public int d() {\n        return 4;\n    }\n}\n",
+}
+
+# srcjar中的源文件，G使用H
+_SRCJAR_SOURCES = {
+    "gen/G.java": "package gen;\npublic class G {\n    public int g() {\n        return new H().h();\n    }\n}\n",
+    "gen/H.java": "package gen;\npublic class H {\n    public int h() {\n        return %(body)d;\n    }\n}\n",
+}
+
+# classpath中的库，U使用L，V和L没有关系
+_LIB_SOURCE = ("package lib;\npublic class L {\n    public static final int K = %(k)d;\n"
+               "    public int m() {\n        return %(body)d;\n    }\n%(extra)s}\n")
+_APP_SOURCES = {
+    "a/U.java": "package a;\npublic class U {\n    public int u(lib.L l) {\n        return l.m();\n    }\n}\n",
+    "a/V.java": "package a;\npublic class V {\n    public int v() {\n        return 5;\n    }\n}\n",
+}
+
+
+@unittest.skipUnless(_HAS_JAVAC, "javac is not available")
+class IncrementalJavacTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        self.src_dir = os.path.join(self.base_dir, "src")
+        self.jar_path = os.path.join(self.base_dir, "out", "app.jar")
+        os.makedirs(os.path.dirname(self.jar_path))
+        pass
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        pass
+
+    def _write(self, relpath, content):
+        path = os.path.join(self.src_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode="w", encoding="utf-8") as fp:
+            fp.write(content)
+        return path
+
+    def _write_sources(self, k=1, body=1, extra=""):
+        paths = []
+        for relpath, content in sorted(_SOURCES.items()):
+            if relpath == "a/B.java":
+                content = content % {"k": k, "body": body, "extra": extra}
+            paths.append(self._write(relpath, content))
+        return paths
+
+    def _run(self, java_files, extra_args=()):
+        """运行javac.py，返回这一次编译的源文件"""
+        compiled = []
+        compile_func = javac._compile
+
+        def record_compile(javac_cmd, classes_dir, java_sources_file, files):
+            compiled.extend(os.path.basename(x) for x in files)
+            compile_func(javac_cmd, classes_dir, java_sources_file, files)
+            pass
+
+        argv = ["--jar-path", self.jar_path,
+                "--base-dir", os.path.join(self.base_dir, "base"),
+                "--depfile", os.path.join(self.base_dir, "app.d")] + list(extra_args) + java_files
+        with mock.patch.object(javac, "_compile", side_effect=record_compile):
+            javac.main(argv)
+        return sorted(compiled)
+
+    def _jar_classes(self):
+        with zipfile.ZipFile(self.jar_path) as zip_file:
+            return sorted(x for x in zip_file.namelist() if x.endswith(".class"))
+
+    def test_method_body_change(self):
+        self.assertEqual(self._run(self._write_sources()), ["A.java", "B.java", "C.java", "D.java"])
+        self.assertEqual(self._run(self._write_sources(body=2)), ["B.java"])
+        self.assertEqual(self._jar_classes(), ["a/A.class", "a/B.class", "a/C.class", "a/D.class"])
+        pass
+
+    def test_public_api_change(self):
+        self._run(self._write_sources())
+        compiled = self._run(self._write_sources(extra="    public int other() {\n        return 0;\n    }\n"))
+        # A和C都引用了B
+        self.assertEqual(compiled, ["A.java", "B.java", "C.java"])
+        pass
+
+    def test_constant_change(self):
+        self._run(self._write_sources())
+        # 编译B之后发现常量变化，常量被内联到C中，只能全量编译
+        self.assertEqual(self._run(self._write_sources(k=2)), ["A.java", "B.java", "B.java", "C.java", "D.java"])
+        pass
+
+    def test_removed_class(self):
+        java_files = self._write_sources(extra="    public static class Inner {\n    }\n")
+        self._run(java_files)
+        self.assertIn("a/B$Inner.class", self._jar_classes())
+        self._run(self._write_sources())
+        self.assertNotIn("a/B$Inner.class", self._jar_classes())
+        pass
+
+    def test_round_limit(self):
+        self._run(self._write_sources())
+        with mock.patch.object(javac, "_MAX_INCREMENTAL_ROUNDS", 1):
+            compiled = self._run(self._write_sources(extra="    public int other() {\n        return 0;\n    }\n"))
+        # 第一轮编译了B，之后还有需要编译的源文件，改为全量编译
+        self.assertEqual(compiled, ["A.java", "B.java", "B.java", "C.java", "D.java"])
+        pass
+
+    def _write_srcjar(self, body):
+        srcjar = os.path.join(self.base_dir, "gen.srcjar")
+        with zipfile.ZipFile(srcjar, mode="w") as zip_file:
+            for name, content in sorted(_SRCJAR_SOURCES.items()):
+                zip_file.writestr(name, content % {"body": body} if "%(body)d" in content else content)
+        return srcjar
+
+    def test_srcjar_entry_change(self):
+        java_files = self._write_sources()
+        srcjar = self._write_srcjar(body=1)
+        self.assertEqual(self._run(java_files, ["--java-srcjars", srcjar]),
+                         ["A.java", "B.java", "C.java", "D.java", "G.java", "H.java"])
+        self._write_srcjar(body=2)
+        self.assertEqual(self._run(java_files, ["--java-srcjars", srcjar]), ["H.java"])
+        with open(os.path.join(self.base_dir, "base", "java", "gen", "H.java"), mode="r", encoding="utf-8") as fp:
+            self.assertIn("return 2;", fp.read())
+        self.assertIn("gen/G.class", self._jar_classes())
+        pass
+
+    def _build_lib(self, k=1, body=1, extra="", interface=True):
+        """编译classpath中的库，interface为False的时候保留原来的interface jar，模拟只修改了方法体"""
+        lib_dir = os.path.join(self.base_dir, "lib")
+        shutil.rmtree(lib_dir, ignore_errors=True)
+        classes_dir = os.path.join(lib_dir, "classes")
+        os.makedirs(classes_dir)
+        source = os.path.join(lib_dir, "L.java")
+        with open(source, mode="w", encoding="utf-8") as fp:
+            fp.write(_LIB_SOURCE % {"k": k, "body": body, "extra": extra})
+        subprocess.check_call(["javac", "-g", "-d", classes_dir, source])
+        lib_jar = os.path.join(self.base_dir, "lib.jar")
+        outputs = [lib_jar, javac._interface_jar_path(lib_jar)] if interface else [lib_jar]
+        for jar_path in outputs:
+            with zipfile.ZipFile(jar_path, mode="w") as zip_file:
+                zip_file.write(os.path.join(classes_dir, "lib", "L.class"), "lib/L.class")
+        return lib_jar
+
+    def _run_app(self, lib_jar):
+        java_files = [self._write(relpath, content) for relpath, content in sorted(_APP_SOURCES.items())]
+        return self._run(java_files, ["--classpath", lib_jar])
+
+    def test_classpath_interface_unchanged(self):
+        lib_jar = self._build_lib()
+        self.assertEqual(self._run_app(lib_jar), ["U.java", "V.java"])
+        self._build_lib(body=2, interface=False)
+        self.assertEqual(self._run_app(lib_jar), [])
+        pass
+
+    def test_classpath_interface_changed(self):
+        lib_jar = self._build_lib()
+        self._run_app(lib_jar)
+        self._build_lib(extra="    public int other() {\n        return 0;\n    }\n")
+        self.assertEqual(self._run_app(lib_jar), ["U.java"])
+        pass
+
+    def test_classpath_constant_changed(self):
+        lib_jar = self._build_lib()
+        self._run_app(lib_jar)
+        self._build_lib(k=2)
+        self.assertEqual(self._run_app(lib_jar), ["U.java", "V.java"])
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
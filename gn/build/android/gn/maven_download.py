@@ -3,21 +3,28 @@
 import argparse
 import hashlib
 import io
+import itertools
 import json
 import os
 import re
+import sys
+import threading
+import time
 import urllib.request
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 from urllib.error import HTTPError
-from urllib.request import OpenerDirector
 
-import xmltodict
 
+from util import artifact_store
 from util import build_utils
+from util import http_download
+from util import md5_check
+from util.http_pool import HttpConnectionPool
 from util.maven import MavenArtifact
 from util.maven import MavenM2
-from util.maven import MavenPomConfig
+from util.maven import PomModel
+from util.maven import parse_pom
 from util.maven import MavenPom
 from util.maven import MavenContext
 from maven_target import MavenTargetContext
@@ -30,6 +37,19 @@ USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTM
 
 LOG_STEP = "  "
 
+# 锁文件的格式版本以及构件文件的摘要算法
+LOCK_FILE_VERSION = 2
+LOCK_DIGEST_ALGORITHM = "sha256"
+# 共享仓库中记录下载地址的别名类型
+STORE_URL_ALIAS = "url"
+
+# 同时下载的构件数
+DEFAULT_JOBS = 8
+
+# 仓库位置缓存的文件名和默认有效期(秒)
+REPO_CACHE_NAME = "repository_cache.json"
+DEFAULT_REPO_CACHE_TTL = 7 * 24 * 3600
+
 
 def _update_md5_for_path(md5_obj, path):
     with open(path, mode="rb") as fp:
@@ -89,6 +109,8 @@ class MavenMetadata(object):
 
     @staticmethod
     def file_md5(path):
+        if not os.path.exists(path):
+            return None
         stat_obj = os.stat(path)
         return stat_obj.st_mtime_ns, stat_obj.st_size
 
@@ -105,21 +127,155 @@ class MavenMetadata(object):
         return False
 
 
+class MavenRepositoryCache:
+    """记录groupId由哪个仓库提供以及仓库提供的校验文件类型，避免每次都探测所有的仓库
+
+    positive: {groupId: {"repo": 仓库, "checksum": 校验类型, "time": 记录时间}}
+    negative: {构件: {仓库: 记录时间}}，仓库中没有这个构件
+    """
+
+    def __init__(self, ttl=DEFAULT_REPO_CACHE_TTL):
+        self._ttl = ttl
+        self._positive = {}
+        self._negative = {}
+        self._lock = threading.Lock()
+        self._modified = False
+        pass
+
+    @classmethod
+    def from_file(cls, fp, ttl=DEFAULT_REPO_CACHE_TTL):
+        ret = cls(ttl)
+        obj = json.load(fp)
+        ret._positive = {k: v for k, v in obj["positive"].items() if ret._fresh(v["time"])}
+        for key, repos in obj["negative"].items():
+            repos = {k: v for k, v in repos.items() if ret._fresh(v)}
+            if repos:
+                ret._negative[key] = repos
+        return ret
+
+    def to_file(self, fp):
+        obj = {"positive": self._positive, "negative": self._negative}
+        json.dump(obj, fp=fp, sort_keys=True, indent=2)
+        pass
+
+    @classmethod
+    def load(cls, path, ttl=DEFAULT_REPO_CACHE_TTL):
+        if ttl > 0 and os.path.exists(path):
+            with open(path, mode="r", encoding="utf-8") as fp:
+                try:
+                    return cls.from_file(fp, ttl)
+                except (ValueError, KeyError, TypeError):
+                    pass
+        return cls(ttl)
+
+    def save(self, path):
+        """有修改的时候写入文件，先写临时文件再替换，避免其他进程读到一半的内容
+        """
+        with self._lock:
+            if not self._modified or self._ttl <= 0:
+                return
+            build_utils.make_directory_for_file(path)
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp_path, mode="w", encoding="utf-8") as fp:
+                self.to_file(fp)
+            os.replace(tmp_path, path)
+            self._modified = False
+        pass
+
+    def _fresh(self, record_time):
+        return self._ttl > 0 and time.time() - record_time < self._ttl
+
+    def repository_of(self, group_id):
+        """缓存中提供groupId的仓库，没有的时候返回None
+        """
+        with self._lock:
+            entry = self._positive.get(group_id)
+            if entry and self._fresh(entry["time"]):
+                return entry["repo"]
+        return None
+
+    def candidate_repositories(self, artifact, maven_centers):
+        """需要探测的仓库，跳过已知没有这个构件的仓库，
+        提供最长groupId前缀的仓库排在最前面
+        """
+        with self._lock:
+            missing = self._negative.get(str(artifact), {})
+            candidates = [x for x in maven_centers if not self._fresh(missing.get(x, 0))]
+            parts = artifact.group_id.split(".")
+            for i in range(len(parts), 0, -1):
+                entry = self._positive.get(".".join(parts[:i]))
+                if entry and self._fresh(entry["time"]) and entry["repo"] in candidates:
+                    candidates.remove(entry["repo"])
+                    candidates.insert(0, entry["repo"])
+                    break
+        return candidates
+
+    def add_repository(self, group_id, repo):
+        with self._lock:
+            entry = self._positive.get(group_id)
+            if not entry or entry["repo"] != repo or not self._fresh(entry["time"]):
+                self._positive[group_id] = {"repo": repo, "checksum": None, "time": time.time()}
+                self._modified = True
+        pass
+
+    def remove_repository(self, group_id):
+        with self._lock:
+            if self._positive.pop(group_id, None):
+                self._modified = True
+        pass
+
+    def add_missing(self, artifact, repo):
+        with self._lock:
+            self._negative.setdefault(str(artifact), {})[repo] = time.time()
+            self._modified = True
+        pass
+
+    def checksum_of(self, group_id, repo):
+        with self._lock:
+            entry = self._positive.get(group_id)
+            if entry and entry["repo"] == repo and self._fresh(entry["time"]):
+                return entry["checksum"]
+        return None
+
+    def set_checksum(self, group_id, repo, checksum):
+        with self._lock:
+            entry = self._positive.get(group_id)
+            if entry and entry["repo"] == repo and entry["checksum"] != checksum:
+                entry["checksum"] = checksum
+                self._modified = True
+        pass
+
+    pass
+
+
 class MavenLoader:
-    def __init__(self, maven_centers, maven_m2: MavenM2, opener: OpenerDirector):
-        self.maven_centers = maven_centers
+    def __init__(self, maven_centers, maven_m2: MavenM2, opener: HttpConnectionPool,
+                 repo_cache: MavenRepositoryCache = None):
+        self.maven_centers = [x if x.endswith("/") else x + "/" for x in maven_centers]
         self.maven_m2 = maven_m2
         self.opener = opener
+        self.repo_cache = repo_cache or MavenRepositoryCache(ttl=0)
         pass
 
-    def get_opener(self) -> OpenerDirector:
+    def get_opener(self) -> HttpConnectionPool:
         return self.opener
 
-    def choose_maven_center(self, artifact, step):
-        for maven_center in self.maven_centers:
+    def choose_maven_center(self, artifact, step, use_cache=True):
+        if use_cache:
+            maven_center = self.repo_cache.repository_of(artifact.group_id)
+            if maven_center in self.maven_centers:
+                # 缓存中有记录的时候不再探测
+                return MavenArtifactLoader(artifact, self, maven_center, step, cached=True)
+            maven_centers = self.repo_cache.candidate_repositories(artifact, self.maven_centers)
+        else:
+            maven_centers = self.maven_centers
+
+        for maven_center in maven_centers:
             loader = MavenArtifactLoader(artifact, self, maven_center, step)
             if loader.check_maven_file_existed(loader.maven_server_path(ext=".pom")):
+                self.repo_cache.add_repository(artifact.group_id, maven_center)
                 return loader
+            self.repo_cache.add_missing(artifact, maven_center)
 
         return None
 
@@ -127,13 +283,15 @@ class MavenLoader:
 class MavenArtifactLoader:
     MAVEN_CHECKSUM_LIST = ("md5", "asc", "sha1", "sha256")
 
-    def __init__(self, artifact: MavenArtifact, loader: MavenLoader, maven_center, step):
+    def __init__(self, artifact: MavenArtifact, loader: MavenLoader, maven_center, step, cached=False):
         self._artifact = artifact
         self._loader = loader
         self._opener = loader.get_opener()
         if not maven_center.endswith("/"):
             maven_center += "/"
         self._maven_center = maven_center
+        # 仓库是从缓存中得到的，没有经过探测
+        self.cached = cached
         self._user_agent = USER_AGENT
         self.new_metadata = MavenMetadata()
         self.step = step
@@ -154,30 +312,33 @@ class MavenArtifactLoader:
         request.add_header("user-agent", self._user_agent)
         return request
 
-    def download_file(self, maven_url, client_path, force=True, text=False):
+    def download_file(self, maven_url, client_path, force=True, text=False, digest=None, verify=None):
+        """下载到client_path.part，完成之后重命名为client_path
+
+        中断的下载会保留.part文件，下次从中断的位置继续；同时下载同一个文件的进程等待.part文件的锁。
+        @param digest: 下载的同时计算的摘要算法
+        @param verify: verify(part_path, hexdigest)校验下载的文件，失败时抛出异常，.part文件会被删除
+        """
         build_utils.make_directory(os.path.dirname(client_path))
 
         print("%sDOWNLOAD file: %s" % (self.log_prefix, maven_url))
-        try:
-            request = self.create_maven_request(maven_url)
-            with self._opener.open(request) as response:
-                if response.code != 200:
-                    if force:
-                        raise Exception("can't download maven_url=%s" % maven_url)
-                    else:
-                        return False
-
-                with open(client_path, mode="wb") as fp:
-                    while True:
-                        data = response.read(io.DEFAULT_BUFFER_SIZE)
-                        if not data:
-                            break
-                        fp.write(data)
-                    pass
-        except HTTPError as e:
-            if force:
-                raise RuntimeError(e, "%s" % maven_url)
-            return False
+        with http_download.locked_part(client_path) as part_path:
+            try:
+                hexdigest = http_download.download(self._opener, maven_url, part_path,
+                                                   headers={"user-agent": self._user_agent},
+                                                   digest=digest)
+            except HTTPError as e:
+                if force:
+                    raise RuntimeError(e, "%s" % maven_url)
+                return False
+
+            if verify:
+                try:
+                    verify(part_path, hexdigest)
+                except Exception:
+                    http_download.remove_partial(part_path)
+                    raise
+            os.replace(part_path, client_path)
 
         if text:
             with open(client_path, mode="r", encoding="utf-8") as fp:
@@ -187,32 +348,98 @@ class MavenArtifactLoader:
     def download_maven_file(self, ext, force=True, checksum=True, add_metadata=True):
         server_path = self.maven_server_path(ext)
         client_path = self.maven_client_path(ext)
+        store = self._loader.maven_m2.store()
+
+        # 已经下载的校验值: (校验类型, 校验值)
+        known_checksum = None
+        if store and checksum:
+            # 发布版本的内容不会变化，同一个地址下载过的文件不再请求校验值
+            restored = (not self._artifact.is_snapshot()
+                        and self._restore_from_store(store, client_path, *self._url_alias(server_path)))
+            if not restored and force:
+                known_checksum = self._download_checksum(server_path, client_path)
+                restored = self._restore_from_store(store, client_path, *known_checksum)
+            if restored:
+                print("%sSTORE file: %s" % (self.log_prefix, client_path))
+                if add_metadata:
+                    self.new_metadata.add_output_file(client_path)
+                return True
+
+        verified = {}
+
+        def verify(tmp_path, src_md5):
+            md5_str, dst_md5 = known_checksum or self._download_checksum(server_path, client_path)
+            if md5_str != digest:
+                # 下载时计算的摘要类型不对，只能重新读取
+                src_md5 = md5_for_path(tmp_path, md5=md5_str)
+            if src_md5 != dst_md5:
+                raise Exception("Md5 error for '%s', src_md5=%s, dst_md5=%s" % (server_path, src_md5, dst_md5))
+            verified[md5_str] = dst_md5
+            pass
 
-        r = self.download_file(server_path, client_path, force=force)
+        digest = None
+        if checksum:
+            # 一般使用仓库提供的第一种校验类型
+            if known_checksum:
+                digest = known_checksum[0]
+            else:
+                digest = (self._loader.repo_cache.checksum_of(self._artifact.group_id, self._maven_center)
+                          or self.MAVEN_CHECKSUM_LIST[0])
+            if digest not in hashlib.algorithms_available:
+                digest = None
+        r = self.download_file(server_path, client_path, force=force,
+                               digest=digest, verify=verify if checksum else None)
         if not r:
             return False
 
+        if store:
+            if verified and not self._artifact.is_snapshot():
+                algorithm, url_digest = self._url_alias(server_path)
+                verified[algorithm] = url_digest
+            store.add_file(client_path, aliases=verified)
         if add_metadata:
             self.new_metadata.add_output_file(client_path)
-        if not checksum:
-            return True
+        return True
 
+    def _download_checksum(self, server_path, client_path):
+        """每次都重新下载仓库提供的校验值，没有的时候抛出异常
+        :return: (校验类型, 校验值)
+        """
         md5_str = self.check_maven_url_checksum(server_path)
-        md5_maven_url = server_path + "." + md5_str
-        md5_file_path = client_path + "." + md5_str
-        dst_md5 = self.download_file(md5_maven_url, md5_file_path, force=True, text=True)
-        if dst_md5:
-            dst_md5 = dst_md5.strip()
-
-        src_md5 = md5_for_path(client_path, md5=md5_str)
-        if src_md5 != dst_md5:
-            raise Exception("Md5 error for '%s', src_md5=%s, dst_md5=%s" % (server_path, src_md5, dst_md5))
-        return True
+        dst_md5 = self.download_file(server_path + "." + md5_str, client_path + "." + md5_str,
+                                     force=False, text=True)
+        if dst_md5 is False:
+            # 缓存的校验类型已经不可用，重新探测
+            md5_str = self.check_maven_url_checksum(server_path, use_cache=False)
+            dst_md5 = self.download_file(server_path + "." + md5_str, client_path + "." + md5_str,
+                                         force=True, text=True)
+        return md5_str, dst_md5.strip()
+
+    @staticmethod
+    def _url_alias(server_path):
+        """共享仓库中以下载地址作为别名: (算法, 摘要)
+        """
+        return STORE_URL_ALIAS, hashlib.sha256(server_path.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _restore_from_store(store, client_path, md5_str, dst_md5):
+        """通过仓库提供的校验值在共享仓库中查找文件，找到的时候不再下载
+        """
+        sha256 = store.lookup_alias(md5_str, dst_md5)
+        return bool(sha256) and store.materialize(sha256, client_path)
+
+    def check_maven_url_checksum(self, maven_url, *, force=True, checksum_list=MAVEN_CHECKSUM_LIST,
+                                 use_cache=True):
+        repo_cache = self._loader.repo_cache
+        if use_cache:
+            checksum = repo_cache.checksum_of(self._artifact.group_id, self._maven_center)
+            if checksum in checksum_list:
+                return checksum
 
-    def check_maven_url_checksum(self, maven_url, *, force=True, checksum_list=MAVEN_CHECKSUM_LIST):
         for checksum in checksum_list:
             url = maven_url + "." + checksum
             if self.check_maven_file_existed(url):
+                repo_cache.set_checksum(self._artifact.group_id, self._maven_center, checksum)
                 return checksum
         if force:
             raise Exception("check_maven_url_checksum: can't find checksum, maven_url=%s" % maven_url)
@@ -231,11 +458,6 @@ class MavenArtifactLoader:
             return False
 
 
-def read_pom_config(path):
-    with open(path, mode="rb") as fp:
-        return xmltodict.parse(fp)
-
-
 def _read_old_metadata(path):
     if os.path.exists(path):
         with open(path, mode="r") as fp:
@@ -268,6 +490,14 @@ class MavenDownload:
         pass
 
     def download(self, force=False):
+        # 同一个构件只能被一个线程下载
+        with self.context.artifact_lock(self.artifact):
+            if self.context.maven_pom(self.artifact):
+                return
+            self._download_locked(force)
+        pass
+
+    def _download_locked(self, force):
         print("%sDOWNLOAD: %s" % (self.log_prefix, self.artifact))
         md5_path = self.loader.maven_m2.maven_client_path(self.artifact, ext=".metadata")
         old_metadata = _read_old_metadata(md5_path)
@@ -284,112 +514,125 @@ class MavenDownload:
             self._initiate_impl()
             pass
 
-    def _fulfill_dep_item(self, dep_item, parent_pom: MavenPom, properties):
-        parent_dep_item = None
-        if parent_pom:
-            parent_dep_item = parent_pom.get_managed_depend(dep_item["groupId"], dep_item["artifactId"])
-
-        for name in ("version",):
-            last = dep_item.get(name)
-            curr = last
-            if curr is None and parent_dep_item:
-                curr = parent_dep_item.get(name)
-            if last != curr:
-                dep_item[name] = curr
-                # print("%s,%s : %s -> %s" % (dep_item["groupId"],
-                #                             dep_item["artifactId"], name, curr))
-            if "${" in curr:
-                last = curr
-                curr = substitute_maven_pom_variables(last, properties)
-                # print("%s:%s -> %s=%s to %s" % (dep_item["groupId"],
-                #                                 dep_item["artifactId"],
-                #                                 name, last, curr))
-                dep_item[name] = curr
-        pass
-
-    def _fulfill_effective_pom_config(self, pom_config, force=False):
-        """填充pom_config为完整的pom_config"""
-        config = pom_config["project"]
-
+    def _fulfill_dep_item(self, dep, managed_index, properties):
+        """使用dependencyManagement和properties填充版本号
+        :return: 版本号有变化的时候返回新的PomDependency
+        """
+        version = dep.version
+        if version is None:
+            managed_dep = managed_index.get((dep.group_id, dep.artifact_id))
+            if managed_dep:
+                version = managed_dep.version
+        if version and "${" in version:
+            version = substitute_maven_pom_variables(version, properties)
+        if version != dep.version:
+            return dep.replace(version=version)
+        return dep
+
+    def _import_bom(self, dep, properties, force):
+        """下载scope为import的BOM
+        :return: BOM提供的dependencyManagement，版本号使用BOM自己的properties填充
+        """
+        version = dep.version
+        if version and "${" in version:
+            version = substitute_maven_pom_variables(version, properties)
+        bom_artifact = MavenArtifact(dep.group_id, dep.artifact_id, version)
+        MavenDownload(self.context, self.loader, bom_artifact, self.step + 1).download(force)
+        bom_pom = self.context.maven_pom(bom_artifact, force=True)
+
+        if bom_pom.imported_index is None:
+            imported_index = {}
+            bom_properties = bom_pom.model.properties
+            for key, managed_dep in bom_pom.managed_index.items():
+                if managed_dep.version and "${" in managed_dep.version:
+                    try:
+                        managed_dep = managed_dep.replace(
+                            version=substitute_maven_pom_variables(managed_dep.version, bom_properties))
+                    except KeyError:
+                        pass
+                imported_index[key] = managed_dep
+            bom_pom.imported_index = imported_index
+        return bom_pom.imported_index
+
+    def _managed_index(self, model: PomModel, parent_pom: MavenPom, properties, force):
+        """合并dependencyManagement，优先级：当前pom中声明的 > parent继承的 > import的BOM，BOM之间先声明的优先
+        """
+        parent_index = parent_pom.managed_index if parent_pom else {}
+        if not model.managed_dependencies:
+            # 和parent共用一个索引
+            return parent_index
+
+        index = dict(parent_index)
+        bom_list = []
+        for dep in model.managed_dependencies:
+            if dep.scope == "import" and dep.type == "pom":
+                bom_list.append(dep)
+            else:
+                index[(dep.group_id, dep.artifact_id)] = dep
+        for dep in bom_list:
+            for key, managed_dep in self._import_bom(dep, properties, force).items():
+                index.setdefault(key, managed_dep)
+        return index
+
+    def _effective_pom_model(self, model: PomModel, force=False):
+        """填充model为完整的effective pom
+        :return: (effective pom, parent_pom, dependencyManagement索引)
+        """
         parent_pom = None
-        parent_artifact = self._get_parent_artifact_from_pom_config(pom_config)
-        if parent_artifact and not self.context.maven_pom(parent_artifact):
-            parent_download = MavenDownload(self.context, self.loader, parent_artifact, self.step + 1)
+        if model.parent:
+            parent_download = MavenDownload(self.context, self.loader, model.parent, self.step + 1)
             parent_download.download(force)
-            parent_pom = self.context.maven_pom(parent_artifact, force=True)
+            parent_pom = self.context.maven_pom(model.parent, force=True)
             pass
 
-        properties = {}
-        if "properties" in config:
-            properties = config["properties"]
-
-        if parent_pom and "properties" in parent_pom.pom_config["project"]:
-            parent_property = parent_pom.pom_config["project"]["properties"]
-            parent_property = deepcopy(parent_property)
-            parent_property.update(properties)
-            properties = parent_property
-
-        config["properties"] = properties
+        properties = model.properties
+        if parent_pom and parent_pom.model.properties:
+            properties = dict(parent_pom.model.properties)
+            properties.update(model.properties)
 
-        for dep_item in MavenPomConfig(config).get_list("dependencies.dependency"):
-            self._fulfill_dep_item(dep_item, parent_pom, properties)
-            pass
+        managed_index = self._managed_index(model, parent_pom, properties, force)
+        dependencies = [self._fulfill_dep_item(x, managed_index, properties) for x in model.dependencies]
+        return model.effective(properties, dependencies), parent_pom, managed_index
 
     def _initiate_impl(self):
         maven_m2 = self.loader.maven_m2
-        pom_config = build_utils.read_json(
-            maven_m2.maven_client_path(self.artifact, ext=".pom.json"))
-
-        pom_effective_config = deepcopy(pom_config)
-        self._fulfill_effective_pom_config(pom_effective_config)
+        model = PomModel.from_json(build_utils.read_json(
+            maven_m2.maven_client_path(self.artifact, ext=".pom.json")))
 
-        parent_artifact = self._get_parent_artifact_from_pom_config(pom_effective_config)
-        parent_pom = None
-        if parent_artifact:
-            parent_pom = self.context.maven_pom(parent_artifact, force=True)
-
-        maven_pom = MavenPom(self.artifact, pom_effective_config, parent_pom)
+        effective_model, parent_pom, managed_index = self._effective_pom_model(model)
+        maven_pom = MavenPom(self.artifact, effective_model, parent_pom, managed_index)
         self.context.add_maven_pom(maven_pom)
         pass
 
-    def _get_parent_artifact_from_pom_config(self, pom_config):
-        project_config = pom_config["project"]
-        if "parent" in project_config:
-            parent_config = project_config["parent"]
-            return MavenArtifact(parent_config["groupId"],
-                                 parent_config["artifactId"],
-                                 parent_config["version"])
-        return None
-
     def _download_impl(self, force=False):
         loader = self.loader.choose_maven_center(self.artifact, self.step)
         if not loader:
             raise Exception("Can't find maven center for {}".format(self.artifact))
 
-        loader.download_maven_file(ext=".pom", force=True, checksum=True)
-        pom_originals_config = read_pom_config(loader.maven_client_path(ext=".pom"))
+        if not loader.download_maven_file(ext=".pom", force=not loader.cached, checksum=True):
+            # 缓存的仓库中已经没有这个构件，重新探测
+            self.loader.repo_cache.remove_repository(self.artifact.group_id)
+            loader = self.loader.choose_maven_center(self.artifact, self.step, use_cache=False)
+            if not loader:
+                raise Exception("Can't find maven center for {}".format(self.artifact))
+            loader.download_maven_file(ext=".pom", force=True, checksum=True)
+        model = parse_pom(loader.maven_client_path(ext=".pom"))
         with open(loader.maven_client_path(".pom.json"), mode="w", encoding="utf-8") as fp:
-            json.dump(obj=pom_originals_config, fp=fp, indent=2)
+            json.dump(obj=model.to_json(), fp=fp, indent=2)
 
-        pom_effective_config = deepcopy(pom_originals_config)
-        self._fulfill_effective_pom_config(pom_effective_config, force)
+        effective_model, parent_pom, managed_index = self._effective_pom_model(model, force)
         with open(loader.maven_client_path(".pom.effective.json"), mode="w", encoding="utf-8") as fp:
-            json.dump(obj=pom_effective_config, fp=fp, indent=2)
-
-        self._download_maven_files(pom_effective_config, loader)
+            json.dump(obj=effective_model.to_json(), fp=fp, indent=2)
 
-        parent_pom = None
-        parent_artifact = self._get_parent_artifact_from_pom_config(pom_effective_config)
-        if parent_artifact:
-            parent_pom = self.context.maven_pom(parent_artifact, force=True)
+        self._download_maven_files(effective_model, loader)
 
-        maven_pom = MavenPom(self.artifact, pom_effective_config, parent_pom=parent_pom)
+        maven_pom = MavenPom(self.artifact, effective_model, parent_pom=parent_pom, managed_index=managed_index)
         self.context.add_maven_pom(maven_pom)
 
         return loader
 
-    def _download_maven_files(self, pom_config, loader):
-        packaging = pom_config["project"].get("packaging", "jar")
+    def _download_maven_files(self, model: PomModel, loader):
+        packaging = model.packaging
         if packaging == "jar":
             self._download_jar_maven(loader)
         elif packaging == "aar":
@@ -434,6 +677,25 @@ def create_parser():
     parser.add_argument("--output-json", required=True)
     parser.add_argument("--target-json", required=True)
     parser.add_argument("--artifact", action="append", default=[])
+    parser.add_argument("--maven-repo", action="append", default=[],
+                        help="Maven repository url, can be specified multiple times. "
+                             "Defaults to the builtin repository list.")
+    parser.add_argument("--repo-cache-ttl", type=int, default=DEFAULT_REPO_CACHE_TTL,
+                        help="Seconds a cached repository location stays valid, 0 disables the cache.")
+    parser.add_argument("--offline", action="store_true",
+                        help="Resolve only from the cached .pom.effective.json files, never access the network.")
+    parser.add_argument("--lock-file",
+                        help="Resolved dependency graph of the artifacts, "
+                             "defaults to the --output-json path with a .lock.json suffix.")
+    parser.add_argument("--ignore-lock", action="store_true",
+                        help="Always resolve the poms and rewrite the lock file.")
+    parser.add_argument("--store-dir",
+                        help="Content addressed artifact store shared by workspaces, defaults to $%s."
+                             % artifact_store.ARTIFACT_STORE_ENV)
+    parser.add_argument("--store-link-mode", choices=artifact_store.LINK_MODES, default="auto",
+                        help="How files in --m2-dir refer to the store blobs.")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help="Maximum number of artifacts resolved concurrently.")
     return parser
 
 
@@ -443,28 +705,92 @@ def parse_args():
     return args
 
 
-def download_maven(args, context, m2_home, root_artifacts):
-    maven_center_list = [GOOGLE_MAVEN_REPO,
-                         ALIYUN_MAVEN_REPO1,
-                         MAVEN2_REPO1]
-    pending_list = list(root_artifacts)
+def _maven_center_list(args):
+    return args.maven_repo or [GOOGLE_MAVEN_REPO,
+                               ALIYUN_MAVEN_REPO1,
+                               MAVEN2_REPO1]
 
+
+def download_maven(args, context, m2_home, root_artifacts):
+    maven_center_list = _maven_center_list(args)
+    pending_list = list(dict.fromkeys(root_artifacts))
+    scheduled = set(pending_list)
+
+    # 所有请求共享一个连接池，同一个仓库的连接可以复用
+    opener = HttpConnectionPool(max_idle_per_host=max(1, args.jobs))
+    repo_cache_path = os.path.join(m2_home.m2_home(), REPO_CACHE_NAME)
+    repo_cache = MavenRepositoryCache.load(repo_cache_path, ttl=args.repo_cache_ttl)
     loader = MavenLoader(maven_centers=maven_center_list,
                          maven_m2=m2_home,
-                         opener=urllib.request.build_opener())
+                         opener=opener,
+                         repo_cache=repo_cache)
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        while pending_list:
+            # 同一层的构件并发下载，按照原来的顺序处理结果，保证输出的顺序是确定的
+            futures = [executor.submit(MavenDownload(context, loader, artifact, 0).download)
+                       for artifact in pending_list]
+            next_list = []
+            for artifact, future in zip(pending_list, futures):
+                future.result()
+                maven_pom = context.maven_pom(artifact, force=True)
+                for dep in maven_pom.get_depends(wanted_list=("compile", "provided")):
+                    dep_artifact = MavenArtifact(dep.group_id, dep.artifact_id, dep.version)
+                    if dep_artifact in scheduled:
+                        continue
+                    scheduled.add(dep_artifact)
+                    next_list.append(dep_artifact)
+                pass
+            pending_list = next_list
+
+    request_count, connection_count = opener.stats()
+    print("HTTP requests: %d, connections: %d, reuse rate: %.1f%%" % (
+        request_count, connection_count, opener.reuse_rate() * 100))
+    opener.close()
+    repo_cache.save(repo_cache_path)
+
+
+# 不同packaging需要的构件文件
+_PACKAGING_FILE_EXT = {
+    "jar": ".jar",
+    "bundle": ".jar",
+    "aar": ".aar",
+    "pom": None,
+}
+
+
+def resolve_offline(context, m2_home: MavenM2, root_artifacts):
+    """只使用m2_files中已有的.pom.effective.json解析依赖，不访问网络
+
+    effective pom中的版本和属性已经填充完整，不需要再处理parent，缺少任何文件的时候直接失败。
+    """
+    pending_list = list(dict.fromkeys(root_artifacts))
+    scheduled = set(pending_list)
+    missing_list = []
     while pending_list:
-        artifact = pending_list.pop(0)
-        download_context = MavenDownload(context, loader, artifact, 0)
-        download_context.download(force=False)
-        maven_pom = context.maven_pom(artifact)
-        for dep_item in maven_pom.get_depends(wanted_list=("compile", "provided")):
-            artifact = MavenArtifact(dep_item["groupId"], dep_item["artifactId"], dep_item["version"])
-            if context.maven_pom(artifact):
-                continue
-            if artifact in pending_list:
-                continue
-            pending_list.append(artifact)
-            pass
+        artifact = pending_list.pop()
+        pom_path = m2_home.maven_client_path(artifact, ext=".pom.effective.json")
+        try:
+            model = PomModel.from_json(build_utils.read_json(pom_path))
+        except FileNotFoundError:
+            missing_list.append(pom_path)
+            continue
+
+        ext = _PACKAGING_FILE_EXT.get(model.packaging)
+        if ext and not os.path.exists(m2_home.maven_client_path(artifact, ext=ext)):
+            missing_list.append(m2_home.maven_client_path(artifact, ext=ext))
+
+        maven_pom = MavenPom(artifact, model)
+        context.add_maven_pom(maven_pom)
+        for dep in maven_pom.get_depends(wanted_list=("compile", "provided")):
+            dep_artifact = MavenArtifact(dep.group_id, dep.artifact_id, dep.version)
+            if dep_artifact not in scheduled:
+                scheduled.add(dep_artifact)
+                pending_list.append(dep_artifact)
+        pass
+
+    if missing_list:
+        raise Exception("Offline resolution failed, missing files:\n  %s" % "\n  ".join(sorted(missing_list)))
+    pass
 
 
 def write_build_config(target_configs, sorted_targets, m2_home: MavenM2, root_path, target_json_path):
@@ -505,12 +831,20 @@ def write_build_config(target_configs, sorted_targets, m2_home: MavenM2, root_pa
     pass
 
 
+def write_config(args, maven_m2, target_configs, sorted_targets):
+    build_utils.make_directory_for_file(args.output_json)
+    build_utils.write_json(target_configs, args.output_json)
+    write_build_config(target_configs, sorted_targets, maven_m2, args.src_root, args.target_json)
+    pass
+
+
 def generate_config(args, context, maven_m2, root_artifacts):
+    """解析依赖并写入--output-json以及--target-json
+    :return: (target_configs, sorted_targets)
+    """
     target_context = MavenTargetContext(context, maven_m2, root_artifacts=root_artifacts)
 
     target_configs = target_context.generate_dep_configs(root_artifacts)
-    build_utils.make_directory_for_file(args.output_json)
-    build_utils.write_json(target_configs, args.output_json)
 
     root_targets = [str(x) for x in root_artifacts]
 
@@ -521,20 +855,150 @@ def generate_config(args, context, maven_m2, root_artifacts):
     sorted_targets = build_utils.get_sorted_transitive_dependencies(root_targets, get_deps)
     print(sorted_targets)
 
-    write_build_config(target_configs, sorted_targets, maven_m2, args.src_root, args.target_json)
+    write_config(args, maven_m2, target_configs, sorted_targets)
+    return target_configs, sorted_targets
+
+
+class MavenLockFile:
+    """解析完成的依赖图以及每个构件文件的摘要
+
+    --artifact相同并且构件文件没有变化的时候直接使用，不再读取pom。
+    """
+
+    def __init__(self, key, artifacts, target_configs, sorted_targets, files):
+        # 锁文件的格式、解析的脚本以及选项的摘要
+        self.key = key
+        self.artifacts = artifacts
+        self.target_configs = target_configs
+        self.sorted_targets = sorted_targets
+        # {构件: {"path": 相对于m2_files的路径, "sha256": 摘要}}
+        self.files = files
+        pass
+
+    @classmethod
+    def from_file(cls, fp):
+        obj = json.load(fp)
+        if obj.get("version") != LOCK_FILE_VERSION:
+            raise ValueError("Unsupported lock file version: %s" % obj.get("version"))
+        return cls(obj["key"], obj["artifacts"], obj["target_configs"], obj["sorted_targets"], obj["files"])
+
+    def to_file(self, fp):
+        obj = {
+            "version": LOCK_FILE_VERSION,
+            "key": self.key,
+            "artifacts": self.artifacts,
+            "target_configs": self.target_configs,
+            "sorted_targets": self.sorted_targets,
+            "files": self.files,
+        }
+        # 保持target_configs原来的顺序，直接输出的结果和重新解析的一致
+        json.dump(obj, fp=fp, indent=2)
+        pass
+
+    @staticmethod
+    def lock_artifacts(artifacts):
+        return sorted(set(str(x) for x in artifacts))
+
+    @staticmethod
+    def lock_key(args):
+        """锁文件的格式、解析依赖的脚本以及--m2-dir、--maven-repo、--offline变化的时候锁文件失效
+        """
+        scripts = [__file__,
+                   sys.modules[MavenTargetContext.__module__].__file__,
+                   sys.modules[PomModel.__module__].__file__,
+                   build_utils.__file__,
+                   md5_check.__file__]
+        return md5_check.compute_inline_md5(itertools.chain(
+            [LOCK_FILE_VERSION, os.path.abspath(args.m2_dir), args.offline],
+            _maven_center_list(args),
+            (md5_check.digest_for_path(x, LOCK_DIGEST_ALGORITHM) for x in scripts)))
+
+    @classmethod
+    def create(cls, key, root_artifacts, target_configs, sorted_targets, m2_home: MavenM2):
+        files = {}
+        for dep_name in sorted_targets:
+            artifact = MavenArtifact.parse_maven_dep(dep_name)
+            ext = _PACKAGING_FILE_EXT.get(target_configs[artifact.maven_key()]["packaging"])
+            if not ext:
+                continue
+            path = m2_home.maven_client_path(artifact, ext=ext)
+            files[dep_name] = {
+                "path": os.path.relpath(path, m2_home.m2_files()).replace(os.sep, "/"),
+                LOCK_DIGEST_ALGORITHM: md5_check.digest_for_path(path, LOCK_DIGEST_ALGORITHM),
+            }
+        return cls(key, cls.lock_artifacts(root_artifacts), target_configs, sorted_targets, files)
+
+    def check(self, key, root_artifacts, m2_home: MavenM2):
+        """检查锁文件是否可以使用
+        :return: 不能使用的原因，可以使用的时候返回None
+        """
+        if self.key != key:
+            return "scripts or options changed"
+        if self.artifacts != self.lock_artifacts(root_artifacts):
+            return "artifacts changed"
+        store = m2_home.store()
+        for dep_name, item in sorted(self.files.items()):
+            path = os.path.join(m2_home.m2_files(), item["path"])
+            if os.path.exists(path):
+                if md5_check.digest_for_path(path, LOCK_DIGEST_ALGORITHM) == item[LOCK_DIGEST_ALGORITHM]:
+                    continue
+                reason = "content of %s changed" % path
+            else:
+                reason = "missing %s" % path
+            # 共享仓库中有相同内容的文件时直接使用
+            if not store or not store.materialize(item[LOCK_DIGEST_ALGORITHM], path):
+                return reason
+        return None
+
     pass
 
 
+def _lock_file_path(args):
+    if args.lock_file:
+        return args.lock_file
+    return os.path.splitext(args.output_json)[0] + ".lock.json"
+
+
+def _read_lock_file(path):
+    if os.path.exists(path):
+        with open(path, mode="r", encoding="utf-8") as fp:
+            try:
+                return MavenLockFile.from_file(fp)
+            except (ValueError, KeyError):
+                pass
+    return None
+
+
 def main():
     args = parse_args()
 
     root_targets = [MavenArtifact.parse_maven_dep(x) for x in args.artifact]
 
     context = MavenContext()
-    maven_m2 = MavenM2(args.m2_dir)
-
-    download_maven(args, context, maven_m2, root_targets)
-    generate_config(args, context, maven_m2, root_targets)
+    maven_m2 = MavenM2(args.m2_dir,
+                       store=artifact_store.default_store(args.store_dir, args.store_link_mode))
+
+    lock_path = _lock_file_path(args)
+    lock_key = MavenLockFile.lock_key(args)
+    lock_file = None if args.ignore_lock else _read_lock_file(lock_path)
+    if lock_file:
+        reason = lock_file.check(lock_key, root_targets, maven_m2)
+        if reason is None:
+            # 依赖图没有变化，直接输出
+            write_config(args, maven_m2, lock_file.target_configs, lock_file.sorted_targets)
+            return
+        print("Lock file %s is out of date: %s" % (lock_path, reason))
+
+    if args.offline:
+        resolve_offline(context, maven_m2, root_targets)
+    else:
+        download_maven(args, context, maven_m2, root_targets)
+    target_configs, sorted_targets = generate_config(args, context, maven_m2, root_targets)
+
+    lock_file = MavenLockFile.create(lock_key, root_targets, target_configs, sorted_targets, maven_m2)
+    build_utils.make_directory_for_file(lock_path)
+    with open(lock_path, mode="w", encoding="utf-8") as fp:
+        lock_file.to_file(fp)
     pass
 
 
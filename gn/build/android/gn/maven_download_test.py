@@ -0,0 +1,233 @@
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from util import artifact_store
+from util import build_utils
+from util import digest_cache
+from util import md5_check
+from util.http_test_server import HttpTestServer
+
+# 测试不使用工作目录中的摘要缓存以及环境变量中的共享仓库
+os.environ[digest_cache.DIGEST_CACHE_ENV] = ""
+os.environ.pop(artifact_store.ARTIFACT_STORE_ENV, None)
+
+import maven_download
+
+_POM_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+  %(parent)s
+  <groupId>org.test</groupId>
+  <artifactId>%(artifact_id)s</artifactId>
+  <version>%(version)s</version>
+  <packaging>%(packaging)s</packaging>
+  <properties>%(properties)s</properties>
+  <dependencies>%(dependencies)s</dependencies>
+</project>
+"""
+
+_DEPENDENCY_TEMPLATE = ("<dependency><groupId>org.test</groupId><artifactId>%s</artifactId>"
+                        "<version>%s</version></dependency>")
+
+
+def _pom(artifact_id, dependencies=(), packaging="jar", parent=None, properties=None):
+    return (_POM_TEMPLATE % {
+        "parent": ("<parent><groupId>org.test</groupId><artifactId>%s</artifactId>"
+                   "<version>1.0</version></parent>" % parent) if parent else "",
+        "artifact_id": artifact_id,
+        "version": "1.0",
+        "packaging": packaging,
+        "properties": "".join("<%s>%s</%s>" % (k, v, k) for k, v in (properties or {}).items()),
+        "dependencies": "".join(_DEPENDENCY_TEMPLATE % x for x in dependencies),
+    }).encode("utf-8")
+
+
+def _add_file(files, path, data):
+    files[path] = data
+    files[path + ".md5"] = hashlib.md5(data).hexdigest().encode("utf-8")
+    files[path + ".sha1"] = hashlib.sha1(data).hexdigest().encode("utf-8")
+    pass
+
+
+def _create_repository():
+    """app -> [b, c], b -> d, c -> d，d的版本号来自parent中的属性"""
+    files = {}
+    poms = {
+        "parent": _pom("parent", packaging="pom", properties={"d.version": "1.0"}),
+        "app": _pom("app", [("b", "1.0"), ("c", "1.0")]),
+        "b": _pom("b", [("d", "${d.version}")], parent="parent"),
+        "c": _pom("c", [("d", "${d.version}")], parent="parent"),
+        "d": _pom("d"),
+    }
+    for name, data in poms.items():
+        base = "/org/test/%s/1.0/%s-1.0" % (name, name)
+        _add_file(files, base + ".pom", data)
+        if name != "parent":
+            _add_file(files, base + ".jar", ("jar of %s" % name).encode("utf-8") * 100)
+    return files
+
+
+class MavenDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        self.server = HttpTestServer(_create_repository()).__enter__()
+
+        # 统计同时处理的请求数
+        self._lock = threading.Lock()
+        self._active = 0
+        self.max_active = 0
+        self.server.delay = self._delay
+        pass
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        self._temp_dir.cleanup()
+        pass
+
+    def _delay(self, path):
+        with self._lock:
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+        time.sleep(0.02)
+        with self._lock:
+            self._active -= 1
+        pass
+
+    def _run(self, name, jobs, extra_args=()):
+        out_dir = os.path.join(self.base_dir, name)
+        argv = ["maven_download.py",
+                "--m2-dir", os.path.join(out_dir, "m2"),
+                "--src-root", out_dir,
+                "--output-json", os.path.join(out_dir, "out.json"),
+                "--target-json", os.path.join(out_dir, "target.json"),
+                "--maven-repo", self.server.url("/"),
+                "--artifact", "org.test:app:1.0",
+                "--jobs", str(jobs)]
+        self.output = []
+        with mock.patch.object(sys, "argv", argv + list(extra_args)), \
+                mock.patch("builtins.print", side_effect=lambda *x: self.output.append(" ".join(map(str, x)))):
+            maven_download.main()
+        with open(os.path.join(out_dir, "target.json"), mode="r", encoding="utf-8") as fp:
+            target_json = json.load(fp)
+        with open(os.path.join(out_dir, "out.json"), mode="r", encoding="utf-8") as fp:
+            return target_json, json.load(fp)
+
+    def test_resolution_order(self):
+        target_json, _ = self._run("serial", jobs=1)
+        self.assertEqual([x["maven_depname"] for x in target_json["deps_info"]],
+                         ["org.test:d:1.0", "org.test:b:1.0", "org.test:c:1.0", "org.test:app:1.0"])
+        pass
+
+    def test_concurrent_matches_serial(self):
+        serial = self._run("serial", jobs=1)
+        self.server.requests.clear()
+        self.max_active = 0
+        concurrent = self._run("concurrent", jobs=4)
+        self.assertGreater(self.max_active, 1)
+        # 输出中的路径包含各自的文件夹名称
+        self.assertEqual(json.dumps(concurrent).replace("concurrent", "serial"), json.dumps(serial))
+        pass
+
+    def test_artifact_downloaded_once(self):
+        self._run("concurrent", jobs=4)
+        # b和c同时依赖d以及parent，每个构件只下载一次
+        for name in ("parent", "d"):
+            pom_path = "/org/test/%s/1.0/%s-1.0.pom" % (name, name)
+            self.assertEqual(len(self.server.requests_of(pom_path, "GET")), 1, pom_path)
+        self.assertEqual(len(self.server.requests_of("/org/test/d/1.0/d-1.0.jar", "GET")), 1)
+        pass
+
+    def test_cached_checksum_type_reprobed(self):
+        self._run("first", jobs=4)
+        # 仓库不再提供缓存中记录的md5，删除下载的文件但是保留仓库缓存
+        for path in [x for x in self.server.files if x.endswith(".md5")]:
+            del self.server.files[path]
+        m2_dir = os.path.join(self.base_dir, "first", "m2")
+        shutil.rmtree(os.path.join(m2_dir, "files"))
+        self._run("first", jobs=4)
+        jar_path = os.path.join(m2_dir, "files", "org/test/d/1.0/d-1.0.jar")
+        self.assertTrue(os.path.exists(jar_path + ".sha1"))
+        pass
+
+    def test_stale_checksum_file_ignored(self):
+        jar_path = os.path.join(self.base_dir, "stale", "m2", "files", "org/test/d/1.0/d-1.0.jar")
+        os.makedirs(os.path.dirname(jar_path))
+        with open(jar_path + ".md5", mode="w", encoding="utf-8") as fp:
+            fp.write("0" * 32)
+        self._run("stale", jobs=4)
+        with open(jar_path + ".md5", mode="r", encoding="utf-8") as fp:
+            self.assertEqual(fp.read(), hashlib.md5(self.server.files["/org/test/d/1.0/d-1.0.jar"]).hexdigest())
+        pass
+
+    def test_store_hit_skips_checksum(self):
+        store_args = ["--store-dir", os.path.join(self.base_dir, "store")]
+        self._run("first", jobs=4, extra_args=store_args)
+        self.server.requests.clear()
+        # 另一个工作区从共享仓库得到文件，不再请求校验值和文件内容
+        self._run("second", jobs=4, extra_args=store_args)
+        self.assertEqual([x for x in self.server.requests if x[1].endswith((".md5", ".sha1"))], [])
+        # 只剩下仓库中不存在的javadoc和sources
+        self.assertEqual([x for x in self.server.requests if x[0] == "GET" and x[1] in self.server.files], [])
+        jar_path = os.path.join(self.base_dir, "second", "m2", "files", "org/test/d/1.0/d-1.0.jar")
+        with open(jar_path, mode="rb") as fp:
+            self.assertEqual(fp.read(), self.server.files["/org/test/d/1.0/d-1.0.jar"])
+        pass
+
+    def _lock_messages(self):
+        return [x for x in self.output if x.startswith("Lock file")]
+
+    def test_lock_file_key(self):
+        self._run("lock", jobs=4)
+        self.server.requests.clear()
+        self._run("lock", jobs=4)
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(self._lock_messages(), [])
+
+        # 选项变化的时候锁文件失效
+        self._run("lock", jobs=4, extra_args=["--offline"])
+        self.assertEqual(len(self._lock_messages()), 1)
+        self.assertIn("scripts or options changed", self._lock_messages()[0])
+        self._run("lock", jobs=4, extra_args=["--offline"])
+        self.assertEqual(self._lock_messages(), [])
+
+        # 脚本变化的时候锁文件失效
+        with mock.patch.object(maven_download.md5_check, "digest_for_path", return_value="changed"):
+            self._run("lock", jobs=4, extra_args=["--offline"])
+        self.assertIn("scripts or options changed", self._lock_messages()[0])
+        pass
+
+    def test_lock_key_scripts(self):
+        paths = []
+        digest_for_path = md5_check.digest_for_path
+
+        def record_digest(path, *args, **kwargs):
+            paths.append(os.path.abspath(path))
+            return digest_for_path(path, *args, **kwargs)
+
+        args = maven_download.create_parser().parse_args(["--m2-dir", os.path.join(self.base_dir, "m2"),
+                                                          "--output-json", "out.json",
+                                                          "--target-json", "target.json"])
+        with mock.patch.object(maven_download.md5_check, "digest_for_path", side_effect=record_digest):
+            maven_download.MavenLockFile.lock_key(args)
+        # 解析依赖时使用的工具模块变化的时候锁文件也要失效
+        for module in (maven_download, build_utils, md5_check):
+            self.assertIn(os.path.abspath(module.__file__), paths)
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
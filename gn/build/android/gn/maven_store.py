@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+
+"""管理多个工作区共享的maven构件仓库
+
+gc删除没有被任何工作区文件引用的blob，按照最近使用时间从旧到新删除，直到仓库小于--max-size。
+"""
+
+import argparse
+import re
+import sys
+
+from util import artifact_store
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value):
+    """10G, 512M, 1024
+    """
+    match = re.fullmatch(r"(\d+)([KMGT]?)B?", value.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError("invalid size: %s" % value)
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2)]
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog="maven_store.py")
+    parser.add_argument("--store-dir",
+                        help="The artifact store, defaults to $%s." % artifact_store.ARTIFACT_STORE_ENV)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    gc_parser = subparsers.add_parser("gc", help="Evict unreferenced blobs, least recently used first.")
+    gc_parser.add_argument("--max-size", type=parse_size, default=0,
+                           help="Keep the store below this size, e.g. 20G. Defaults to evicting "
+                                "every unreferenced blob.")
+    gc_parser.add_argument("--dry-run", action="store_true")
+
+    subparsers.add_parser("stats", help="Print the number of blobs and their total size.")
+    return parser
+
+
+def main(argv):
+    args = create_parser().parse_args(argv)
+    store = artifact_store.default_store(args.store_dir)
+    if store is None:
+        raise Exception("--store-dir or $%s is required" % artifact_store.ARTIFACT_STORE_ENV)
+
+    if args.command == "gc":
+        count, size = store.gc(max_size=args.max_size, dry_run=args.dry_run)
+        print("%s %d blobs, %.1f MB" % ("Would evict" if args.dry_run else "Evicted",
+                                       count, size / (1024 * 1024)))
+    count, size = store.stats()
+    print("Store %s: %d blobs, %.1f MB" % (store.root(), count, size / (1024 * 1024)))
+    store.close()
+    pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+    pass
@@ -86,12 +86,11 @@ class MavenTargetContext:
 
         print("%s%s" % (log_prefix, artifact))
         maven_pom = self.context.maven_pom(artifact, force=True)
-        pom_config = maven_pom.pom_config["project"]
         config = {
             "groupId": artifact.group_id,
             "artifactId": artifact.artifact_id,
             "version": artifact.version,
-            "packaging": pom_config.get("packaging", "jar"),
+            "packaging": maven_pom.model.packaging,
             "step": step,
             "deps_list": [],
         }
@@ -102,26 +101,26 @@ class MavenTargetContext:
             exclusion = []
 
         dep_list = maven_pom.get_depends()
-        for dep_item in dep_list:
-            src_dep_artifact = MavenArtifact(dep_item["groupId"], dep_item["artifactId"], dep_item["version"])
+        for dep in dep_list:
+            src_dep_artifact = MavenArtifact(dep.group_id, dep.artifact_id, dep.version)
             if src_dep_artifact == artifact:
                 continue
             deps_config.append(str(src_dep_artifact))
             pass
 
         dep_count = len(dep_list)
-        for i, dep_item in enumerate(dep_list):
+        for i, dep in enumerate(dep_list):
             dep_log_prefix = "|  " + log_prefix.replace("\\", "+")
             if i == dep_count - 1:
                 dep_log_prefix = dep_log_prefix.replace("+", "\\")
                 pass
-            src_dep_artifact = MavenArtifact(dep_item["groupId"], dep_item["artifactId"], dep_item["version"])
+            src_dep_artifact = MavenArtifact(dep.group_id, dep.artifact_id, dep.version)
             if exclusion_contains(exclusion, src_dep_artifact):
                 print("%s%s - omitted for exclusion" % (dep_log_prefix, src_dep_artifact))
                 continue
 
             dep_exclusion = list(exclusion)
-            dep_exclusion.extend(MavenPomConfig(dep_item).get_list("exclusions.exclusion"))
+            dep_exclusion.extend(dep.exclusions)
             self.generate_dep_config_impl(step + 1, dep_log_prefix, src_dep_artifact, deps_configs, dep_exclusion)
             pass
         pass
@@ -14,6 +14,7 @@ import re
 import zipfile
 
 from util import build_utils
+from util import extract_cache
 
 DENSITY_SPLITS = {
     'hdpi': (
@@ -256,7 +257,7 @@ def _on_stale_md5(package_command, args):
             if os.path.exists(subdir):
                 raise Exception(
                     "Resource zip name conflict: " + os.path.basename(z))
-            build_utils.extract_all(z, base_dir=subdir)
+            extract_cache.extract_all(z, subdir)
             package_command += package_args_for_extracted_zips(subdir)
             pass
 
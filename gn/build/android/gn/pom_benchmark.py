@@ -0,0 +1,177 @@
+# -*- encoding: utf-8 -*-
+
+"""比较pom解析方式的速度：xmltodict + deepcopy、minidom以及parse_pom
+
+不指定pom的时候生成几百个包含license、developers、build插件等常见内容的pom。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from copy import deepcopy
+from xml.dom import minidom
+
+from util import build_utils
+from util.maven import parse_pom
+
+try:
+    import xmltodict
+except ImportError:
+    xmltodict = None
+
+_GENERATED_POM_COUNT = 400
+
+_POM_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0"
+         xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+         xsi:schemaLocation="http://maven.apache.org/POM/4.0.0 http://maven.apache.org/xsd/maven-4.0.0.xsd">
+  <modelVersion>4.0.0</modelVersion>
+  <parent>
+    <groupId>org.bench</groupId>
+    <artifactId>parent</artifactId>
+    <version>1.0</version>
+  </parent>
+  <groupId>org.bench</groupId>
+  <artifactId>lib{index}</artifactId>
+  <version>1.{index}</version>
+  <packaging>jar</packaging>
+  <name>Benchmark library {index}</name>
+  <description>Generated library used to measure pom parsing.</description>
+  <url>https://example.com/lib{index}</url>
+  <licenses>
+    <license>
+      <name>The Apache Software License, Version 2.0</name>
+      <url>http://www.apache.org/licenses/LICENSE-2.0.txt</url>
+      <distribution>repo</distribution>
+    </license>
+  </licenses>
+  <developers>{developers}</developers>
+  <scm>
+    <connection>scm:git:https://example.com/lib{index}.git</connection>
+    <url>https://example.com/lib{index}</url>
+  </scm>
+  <properties>{properties}</properties>
+  <dependencyManagement>
+    <dependencies>{managed}</dependencies>
+  </dependencyManagement>
+  <dependencies>{dependencies}</dependencies>
+  <build>
+    <plugins>{plugins}</plugins>
+  </build>
+</project>
+"""
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog="pom_benchmark.py")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("paths", nargs="*",
+                        help="Pom files or directories containing them, e.g. an m2 cache.")
+    return parser
+
+
+def _dependency(index, version=True):
+    return ("<dependency><groupId>org.dep%d</groupId><artifactId>dep%d</artifactId>%s"
+            "<scope>%s</scope><exclusions><exclusion><groupId>org.ex</groupId>"
+            "<artifactId>ex%d</artifactId></exclusion></exclusions></dependency>"
+            % (index % 7, index, "<version>${dep%d.version}</version>" % index if version else "",
+               ("compile", "runtime", "test")[index % 3], index))
+
+
+def _generate_pom(index):
+    return _POM_TEMPLATE.format(
+        index=index,
+        developers="".join("<developer><id>dev%d</id><name>Developer %d</name>"
+                           "<email>dev%d@example.com</email></developer>" % (i, i, i) for i in range(4)),
+        properties="".join("<dep%d.version>%d.0</dep%d.version>" % (i, i, i) for i in range(12)),
+        managed="".join(_dependency(i) for i in range(8)),
+        dependencies="".join(_dependency(i, version=i % 2 == 0) for i in range(12)),
+        plugins="".join("<plugin><artifactId>maven-plugin%d</artifactId><version>3.%d</version>"
+                        "<configuration><source>1.8</source><target>1.8</target></configuration>"
+                        "<dependencies>%s</dependencies></plugin>" % (i, i, _dependency(i)) for i in range(4)))
+
+
+def _generate_inputs(base_dir):
+    paths = []
+    for i in range(_GENERATED_POM_COUNT):
+        path = os.path.join(base_dir, "lib%d.pom" % i)
+        with open(path, mode="w", encoding="utf-8") as fp:
+            fp.write(_generate_pom(i))
+        paths.append(path)
+    return paths
+
+
+def _collect_poms(paths):
+    ret = []
+    for path in paths:
+        if os.path.isdir(path):
+            ret.extend(build_utils.find_in_directory(path, "*.pom"))
+        else:
+            ret.append(path)
+    return ret
+
+
+def _xmltodict_pipeline(path):
+    """原来的方式：解析、写入.pom.json，然后复制一份填充effective pom"""
+    with open(path, mode="rb") as fp:
+        config = xmltodict.parse(fp)
+    json.dumps(config, indent=2)
+    deepcopy(config)
+    pass
+
+
+def _minidom_pipeline(path):
+    minidom.parse(path)
+    pass
+
+
+def _parse_pom_pipeline(path):
+    model = parse_pom(path)
+    json.dumps(model.to_json(), indent=2)
+    model.effective(dict(model.properties), list(model.dependencies))
+    pass
+
+
+def _measure(paths, func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            func(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _report(paths, repeat):
+    pipelines = [("parse_pom", _parse_pom_pipeline), ("minidom", _minidom_pipeline)]
+    if xmltodict:
+        pipelines.append(("xmltodict", _xmltodict_pipeline))
+
+    total_size = sum(os.path.getsize(path) for path in paths)
+    print("%d poms, %.1f KB" % (len(paths), total_size / 1024))
+    baseline = None
+    for name, func in pipelines:
+        elapsed = _measure(paths, func, repeat)
+        if baseline is None:
+            baseline = elapsed
+        print("%-12s%9.1f ms%9.2fx" % (name, elapsed * 1000, elapsed / max(baseline, 1e-9)))
+    pass
+
+
+def main(argv):
+    args = create_parser().parse_args(argv)
+    if args.paths:
+        _report(_collect_poms(args.paths), args.repeat)
+        return
+
+    with build_utils.temp_dir() as base_dir:
+        _report(_generate_inputs(base_dir), args.repeat)
+    pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+    pass
@@ -5,20 +5,20 @@ import os
 import sys
 import shutil
 import codecs
+import io
 import re
-import collections
-from string import Template
-from jinja2 import Template
+from concurrent.futures import ThreadPoolExecutor
 
 from util import build_utils
-
-TextSymbolsEntry = collections.namedtuple(
-    "RTextEntry",
-    "java_type resource_type name value")
+from util import crunch_cache
+from util import extract_cache
+from util import job_server
+from util import md5_check
+from util import r_text
 
 
 def create_resources_zip(resource_dirs, output_zip):
-    """创建资源zip
+    """创建资源zip，只重新写入变化的文件，没有变化的时候不修改output_zip
     :param resource_dirs:
     :param output_zip:
     :return:
@@ -30,53 +30,28 @@ def create_resources_zip(resource_dirs, output_zip):
             for name in filenames:
                 archive_name = name
                 if parent_dir != ".":
-                    archive_name = os.path.join(parent_dir, name)
-                    archive_name.replace("\\", "/")
+                    archive_name = os.path.join(parent_dir, name).replace("\\", "/")
                 input_map[archive_name] = os.path.join(root, name)
-    build_utils.do_zip(input_map.items(), output_zip)
+    build_utils.update_zip(input_map.items(), output_zip)
     pass
 
 
-def _parse_text_symbols_file(r_text_file):
-    entries = []
-    with open(r_text_file, mode="r", encoding="utf-8") as file_obj:
-        for line in file_obj:
-            match = re.match("(int(?:\\[\\])?) (\\w+) (\\w+) (.*)$", line)
-            if not match:
-                raise Exception("parse R.txt exception -> %s: %s" %
-                                (r_text_file, line))
-            entries.append(TextSymbolsEntry(*match.groups()))
-    return entries
-
-
-def _create_extra_r_java_file(package, resources_by_type, shared_resources):
-    """Generates the contents of a R.java file."""
-    template = Template("""/* AUTO-GENERATED FILE.  DO NOT MODIFY. */
-
-package {{ package }};
-
-public final class R {
-    {% for resource_type in resources %}
-    public static final class {{ resource_type }} {
-        {% for e in resources[resource_type] %}
-        {% if shared_resources %}
-        public static {{ e.java_type }} {{ e.name }} = {{ e.value }};
-        {% else %}
-        public static final {{ e.java_type }} {{ e.name }} = {{ e.value }};
-        {% endif %}
-        {% endfor %}
-    }
-    {% endfor %}
-}
-""", trim_blocks=True, lstrip_blocks=True)
-
-    return template.render(package=package,
-                           resources=resources_by_type,
-                           shared_resources=shared_resources)
-
-
-def create_extra_r_java_files(r_dir, extra_packages, extra_r_text_files, include_all):
+def _resources_by_type(all_resources, table):
+    """按照资源类型分组table中的符号，值使用all_resources中最终的值
+    :return: [(资源类型, [(SymbolTable, 下标)])]
+    """
+    groups = {}
+    for i in range(len(table)):
+        resource_type = table.resource_type(i)
+        j = all_resources.find(resource_type, table.names[i])
+        entry = (all_resources, j) if j >= 0 else (table, i)
+        groups.setdefault(resource_type, []).append(entry)
+    return list(groups.items())
+
+
+def create_extra_r_java_files(r_dir, extra_packages, extra_r_text_files, include_all, all_resources=None):
     """创建其他的R.java文件
+    @param all_resources: r_dir中R.txt的SymbolTable，没有的时候读取R.txt
     """
     if include_all:
         r_java_files = build_utils.find_in_directory(r_dir, "R.java")
@@ -101,42 +76,47 @@ def create_extra_r_java_files(r_dir, extra_packages, extra_r_text_files, include
                 pass
         pass
     else:
-        if len(extra_packages) != len(extra_r_text_files):
-            raise Exception()
+        for path, data in extra_r_java_contents(r_dir, extra_packages, extra_r_text_files,
+                                                all_resources).items():
+            build_utils.make_directory(os.path.dirname(path))
+            with open(path, mode="wb") as file_obj:
+                file_obj.write(data)
+            pass
+    pass
 
-        r_text_file = os.path.join(r_dir, "R.txt")
-        if not os.path.exists(r_text_file):
-            return
 
-        all_resources = {}
-        for entry in _parse_text_symbols_file(r_text_file):
-            all_resources[(entry.resource_type, entry.name)] = entry
+def extra_r_java_contents(r_dir, extra_packages, extra_r_text_files, all_resources=None):
+    """生成其他package的R.java
+    @param all_resources: r_dir中R.txt的SymbolTable，没有的时候读取R.txt
+    :return: {R.java路径: 内容}
+    """
+    if len(extra_packages) != len(extra_r_text_files):
+        raise Exception()
 
-        resources_by_package = collections.defaultdict(
-            lambda: collections.defaultdict(list))
+    r_text_file = os.path.join(r_dir, "R.txt")
+    if not os.path.exists(r_text_file):
+        return {}
 
-        for package, r_text_file in zip(extra_packages, extra_r_text_files):
-            if not os.path.exists(r_text_file):
-                continue
-            if package in resources_by_package:
-                raise Exception()
-            resources_by_type = resources_by_package[package]
+    if all_resources is None:
+        all_resources = r_text.parse_r_text(r_text_file)
 
-            for entry in _parse_text_symbols_file(r_text_file):
-                resources_by_type[entry.resource_type].append(entry)
-            pass
+    resources_by_package = {}
+    for package, r_text_file in zip(extra_packages, extra_r_text_files):
+        if not os.path.exists(r_text_file):
+            continue
+        if package in resources_by_package:
+            raise Exception()
+        resources_by_package[package] = _resources_by_type(all_resources,
+                                                           r_text.load_symbol_table(r_text_file))
+        pass
 
-        for package in extra_packages:
-            extra_r_java_dir = os.path.join(r_dir, *package.split("."))
-            build_utils.make_directory(extra_r_java_dir)
-            extra_r_java_file = os.path.join(extra_r_java_dir, "R.java")
-            r_java_content = _create_extra_r_java_file(package,
-                                                       resources_by_package[package],
-                                                       False)
-            with open(extra_r_java_file, mode="w+", encoding="utf-8") as file_obj:
-                file_obj.write(r_java_content)
-            pass
-    pass
+    contents = {}
+    for package in extra_packages:
+        file_obj = io.StringIO()
+        r_text.write_r_java(file_obj, package, resources_by_package.get(package, []))
+        path = os.path.join(r_dir, *package.split("."), "R.java")
+        contents[path] = file_obj.getvalue().encode("utf-8")
+    return contents
 
 
 def create_parser():
@@ -190,6 +170,10 @@ def create_parser():
                         help="Path for output of all resources. This includes resources in "
                         "dependencies.")
     parser.add_argument("--base-dir", required=True)
+    parser.add_argument("--crunch-jobs", type=int,
+                        help="Maximum number of concurrent aapt crunch processes, defaults to $%s or 1. "
+                             "With a make jobserver in MAKEFLAGS its tokens limit the concurrency."
+                             % job_server.JOBS_ENV)
     return parser
 
 
@@ -223,9 +207,7 @@ def parse_args(argv):
     return args
 
 
-def crunch_directory(aapt, input_dir, output_dir):
-    """
-    """
+def _run_crunch(aapt, input_dir, output_dir):
     crunch_commands = [aapt,
                        "crunch",
                        "-C", output_dir,
@@ -236,14 +218,78 @@ def crunch_directory(aapt, input_dir, output_dir):
     pass
 
 
+def crunch_directory(aapt, input_dir, output_dir, cache=None, jobs=None):
+    """crunch input_dir中的png到output_dir
+    @param cache: CrunchCache，缓存中已经有结果的png不再crunch
+    @param jobs: JobServer，限制同时执行的aapt
+    """
+    jobs = jobs or job_server.JobServer(1)
+    aapt_path = aapt if os.path.exists(aapt) else shutil.which(aapt)
+    if cache is None or aapt_path is None:
+        with jobs.slot():
+            _run_crunch(aapt, input_dir, output_dir)
+        return
+
+    aapt_digest = md5_check.digest_for_path(aapt_path, "sha256")
+    missing_list = []
+    for path in build_utils.find_in_directory(input_dir, "*.png"):
+        relpath = os.path.relpath(path, input_dir)
+        key = cache.key(aapt_digest, path, relpath)
+        if not cache.materialize(key, os.path.join(output_dir, relpath)):
+            missing_list.append((path, relpath, key))
+    if not missing_list:
+        return
+
+    # 只把缓存中没有的png交给aapt
+    staging_dir = output_dir + ".staging"
+    staging_input_dir = os.path.join(staging_dir, "res")
+    staging_output_dir = os.path.join(staging_dir, "crunch")
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    for path, relpath, _ in missing_list:
+        staging_path = os.path.join(staging_input_dir, relpath)
+        build_utils.make_directory(os.path.dirname(staging_path))
+        shutil.copy2(path, staging_path)
+    build_utils.make_directory(staging_output_dir)
+    with jobs.slot():
+        _run_crunch(aapt, staging_input_dir, staging_output_dir)
+
+    for _, relpath, key in missing_list:
+        crunched_path = os.path.join(staging_output_dir, relpath)
+        if not os.path.exists(crunched_path):
+            # aapt忽略的文件
+            continue
+        cache.add(key, crunched_path)
+        output_path = os.path.join(output_dir, relpath)
+        build_utils.make_directory(os.path.dirname(output_path))
+        os.replace(crunched_path, output_path)
+    shutil.rmtree(staging_dir)
+    pass
+
+
+def crunch_directories(aapt, input_dirs, output_dirs, max_jobs=None):
+    """并发crunch多个资源文件夹，同时执行的aapt个数受jobserver限制
+    """
+    cache = crunch_cache.default_cache()
+    jobs = job_server.JobServer(max_jobs)
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs.max_jobs(), len(input_dirs)))) as executor:
+        futures = [executor.submit(crunch_directory, aapt, input_dir, output_dir, cache, jobs)
+                   for input_dir, output_dir in zip(input_dirs, output_dirs)]
+        for future in futures:
+            future.result()
+    pass
+
+
 def combine_zips(zip_files, output_path):
     """合并总的资源文件
     """
     def path_transform(name, src_zip):
         return "%d/%s" % (zip_files.index(src_zip), name)
+    # 资源zip只在构建内部使用，保留原来的压缩方式，不需要重新压缩
     build_utils.merge_zips(output_path,
                            zip_files,
-                           path_transform=path_transform)
+                           path_transform=path_transform,
+                           copy_raw=True)
 
 
 def _on_stale_md5(args):
@@ -269,7 +315,7 @@ def _on_stale_md5(args):
             raise Exception("%s already exists" % dep_subdir)
         build_utils.make_directory(dep_subdir)
         dep_subdirs.append(dep_subdir)
-        build_utils.extract_all(z, dep_subdir)
+        extract_cache.extract_all(z, dep_subdir)
         pass
 
     package_command = [
@@ -309,12 +355,14 @@ def _on_stale_md5(args):
 
     zip_resources_dirs = list(input_resource_dirs)
 
+    crunch_dirs = []
     for idx, input_resource_dir in enumerate(input_resource_dirs):
         crunch_dir = os.path.join(base_crunch_dir, str(idx))
         build_utils.make_directory(crunch_dir)
-        crunch_directory(aapt, input_resource_dir, crunch_dir)
-        zip_resources_dirs.append(crunch_dir)
+        crunch_dirs.append(crunch_dir)
         pass
+    crunch_directories(aapt, input_resource_dirs, crunch_dirs, args.crunch_jobs)
+    zip_resources_dirs.extend(crunch_dirs)
 
     create_resources_zip(zip_resources_dirs, args.resource_zip_out)
 
@@ -322,19 +370,32 @@ def _on_stale_md5(args):
         combine_zips([args.resource_zip_out] + dep_files,
                      args.all_resources_zip_out)
 
-    if args.extra_res_packages:
-        create_extra_r_java_files(gen_dir,
-                                  args.extra_res_packages,
-                                  args.extra_r_text_files,
-                                  False)
-        pass
+    all_resources = None
+    r_text_file = os.path.join(gen_dir, "R.txt")
+    if os.path.exists(r_text_file) and (args.srcjar_out or args.r_text_out):
+        all_resources = r_text.parse_r_text(r_text_file)
 
     if args.srcjar_out:
-        build_utils.zip_dir(args.srcjar_out, gen_dir)
+        srcjar_inputs = {}
+        for path in build_utils.find_in_directory(gen_dir, "*"):
+            with open(path, mode="rb") as fp:
+                srcjar_inputs[os.path.relpath(path, gen_dir)] = fp.read()
+        if args.extra_res_packages:
+            for path, data in extra_r_java_contents(gen_dir,
+                                                    args.extra_res_packages,
+                                                    args.extra_r_text_files,
+                                                    all_resources).items():
+                srcjar_inputs[os.path.relpath(path, gen_dir)] = data
+        # 只有内容变化的R.java会被重新写入，javac只会看到这些变化
+        build_utils.update_zip_hermetic(args.srcjar_out,
+                                        [(name.replace("\\", "/"), data)
+                                         for name, data in srcjar_inputs.items()])
         pass
 
     if args.r_text_out:
-        shutil.copyfile(os.path.join(gen_dir, "R.txt"), args.r_text_out)
+        shutil.copyfile(r_text_file, args.r_text_out)
+        # 依赖这个target的资源处理直接读取二进制符号表
+        r_text.write_symbol_table(args.r_text_out, all_resources)
         pass
     pass
 
@@ -0,0 +1,305 @@
+# -*- encoding: utf-8 -*-
+
+import contextlib
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import stat
+import threading
+import time
+
+from util import build_utils
+from util import digest_cache
+
+# 多个工作区共享的仓库路径
+ARTIFACT_STORE_ENV = "ANDROID_BUILD_MAVEN_STORE"
+
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+
+_DB_NAME = "store.db"
+_LOCK_NAME = "store.lock"
+_BUFFER_SIZE = 1024 * 1024
+_READ_ONLY_FILE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+# linux/fs.h: FICLONE
+_FICLONE = 0x40049409
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _sha256_for_path(path):
+    sha256 = hashlib.sha256()
+    with open(path, mode="rb") as fp:
+        while True:
+            data = fp.read(_BUFFER_SIZE)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflink is not supported")
+    with open(src, mode="rb") as src_fp, open(dst, mode="wb") as dst_fp:
+        try:
+            fcntl.ioctl(dst_fp.fileno(), _FICLONE, src_fp.fileno())
+        except OSError:
+            dst_fp.close()
+            os.remove(dst)
+            raise
+    pass
+
+
+class ArtifactStore:
+    """以sha256为键的共享构件仓库
+
+    blobs/ab/abcdef...保存文件内容，工作区中的文件通过reflink、硬链接或者复制得到；
+    blob是只读的，硬链接得到的工作区文件也是只读的，修改工作区中的文件不会破坏仓库。
+    store.db记录每个blob的大小和最近使用时间、其他摘要到sha256的映射，以及引用blob的工作区文件；
+    写入时持有共享锁，gc时持有排他锁。
+    """
+
+    def __init__(self, root, link_mode="auto"):
+        assert link_mode in LINK_MODES
+        self._root = os.path.abspath(root)
+        self._link_mode = link_mode
+        self._lock = threading.Lock()
+        self._conn = None
+        pass
+
+    def root(self):
+        return self._root
+
+    def blob_path(self, sha256):
+        return os.path.join(self._root, "blobs", sha256[:2], sha256)
+
+    def _connect(self):
+        with self._lock:
+            if self._conn is None:
+                os.makedirs(self._root, exist_ok=True)
+                conn = sqlite3.connect(os.path.join(self._root, _DB_NAME),
+                                       timeout=60,
+                                       isolation_level=None,
+                                       check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS blobs ("
+                             "sha256 TEXT PRIMARY KEY, "
+                             "size INTEGER NOT NULL, "
+                             "atime INTEGER NOT NULL)")
+                conn.execute("CREATE TABLE IF NOT EXISTS aliases ("
+                             "algorithm TEXT NOT NULL, "
+                             "digest TEXT NOT NULL, "
+                             "sha256 TEXT NOT NULL, "
+                             "PRIMARY KEY (algorithm, digest))")
+                conn.execute("CREATE TABLE IF NOT EXISTS refs ("
+                             "path TEXT PRIMARY KEY, "
+                             "sha256 TEXT NOT NULL, "
+                             "signature TEXT NOT NULL)")
+                self._conn = conn
+            return self._conn
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        with self._lock:
+            return conn.execute(sql, params).fetchall()
+
+    @contextlib.contextmanager
+    def _store_lock(self, exclusive=False):
+        """写入blob时持有共享锁，gc删除blob时持有排他锁
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self._root, exist_ok=True)
+        with open(os.path.join(self._root, _LOCK_NAME), mode="a") as fp:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+        pass
+
+    def _tmp_path(self, path):
+        return "%s.%d.%d.store.tmp" % (path, os.getpid(), threading.get_ident())
+
+    def _clone(self, src, dst):
+        """按照link_mode把src复制到dst
+        :return: 实际使用的方式
+        """
+        if self._link_mode != "auto":
+            modes = (self._link_mode,)
+        elif build_utils.CAN_LINK_READ_ONLY:
+            modes = ("reflink", "hardlink", "copy")
+        else:
+            modes = ("reflink", "copy")
+        for mode in modes:
+            try:
+                if mode == "reflink":
+                    _reflink(src, dst)
+                elif mode == "hardlink":
+                    os.link(src, dst)
+                else:
+                    shutil.copyfile(src, dst)
+                return mode
+            except OSError:
+                if mode == modes[-1]:
+                    raise
+        return None
+
+    @staticmethod
+    def _make_read_only(blob_path):
+        """链接之前保证blob是只读的，之前的版本加入的blob可能是可写的"""
+        if os.stat(blob_path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH):
+            os.chmod(blob_path, _READ_ONLY_FILE)
+        pass
+
+    def _record_ref(self, path, sha256):
+        signature, _ = digest_cache.file_signature(path)
+        self._execute("INSERT OR REPLACE INTO refs (path, sha256, signature) VALUES (?, ?, ?)",
+                      (os.path.abspath(path), sha256, signature))
+        self._execute("UPDATE blobs SET atime = ? WHERE sha256 = ?", (time.time_ns(), sha256))
+        pass
+
+    def lookup_alias(self, algorithm, digest):
+        """通过其他摘要查找blob
+        :return: sha256，没有的时候返回None
+        """
+        rows = self._execute("SELECT sha256 FROM aliases WHERE algorithm = ? AND digest = ?",
+                             (algorithm, digest.lower()))
+        if rows and os.path.exists(self.blob_path(rows[0][0])):
+            return rows[0][0]
+        return None
+
+    def materialize(self, sha256, path):
+        """从仓库中得到path
+        :return: 仓库中没有这个blob的时候返回False
+        """
+        blob_path = self.blob_path(sha256)
+        with self._store_lock():
+            if not os.path.exists(blob_path):
+                return False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = self._tmp_path(path)
+            try:
+                self._make_read_only(blob_path)
+                self._clone(blob_path, tmp_path)
+            except FileNotFoundError:
+                return False
+            os.replace(tmp_path, path)
+            self._record_ref(path, sha256)
+        return True
+
+    def add_file(self, path, aliases=None):
+        """把工作区中的文件加入仓库，并且让文件指向仓库中的blob
+        @param aliases: {算法: 摘要}
+        :return: sha256
+        """
+        sha256 = _sha256_for_path(path)
+        blob_path = self.blob_path(sha256)
+        with self._store_lock():
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                tmp_path = self._tmp_path(blob_path)
+                self._clone(path, tmp_path)
+                # 硬链接的时候工作区中的文件也变成只读的
+                os.chmod(tmp_path, _READ_ONLY_FILE)
+                # 内容相同，并发写入的时候谁覆盖谁都可以
+                os.replace(tmp_path, blob_path)
+                self._execute("INSERT OR REPLACE INTO blobs (sha256, size, atime) VALUES (?, ?, ?)",
+                              (sha256, os.path.getsize(blob_path), time.time_ns()))
+            elif not os.path.samefile(blob_path, path):
+                tmp_path = self._tmp_path(path)
+                self._make_read_only(blob_path)
+                self._clone(blob_path, tmp_path)
+                os.replace(tmp_path, path)
+            for algorithm, digest in (aliases or {}).items():
+                self._execute("INSERT OR REPLACE INTO aliases (algorithm, digest, sha256) VALUES (?, ?, ?)",
+                              (algorithm, digest.lower(), sha256))
+            self._record_ref(path, sha256)
+        return sha256
+
+    def _is_referenced(self, sha256, refs):
+        blob_path = self.blob_path(sha256)
+        try:
+            if os.stat(blob_path).st_nlink > 1:
+                return True
+        except FileNotFoundError:
+            return False
+        for path, signature in refs.get(sha256, []):
+            try:
+                if digest_cache.file_signature(path)[0] == signature:
+                    return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def gc(self, max_size=0, dry_run=False):
+        """删除没有被工作区引用的blob，按照最近使用时间从旧到新删除，直到仓库小于max_size
+        :return: (删除的blob个数, 释放的大小)
+        """
+        with self._store_lock(exclusive=True):
+            refs = {}
+            stale_refs = []
+            for path, sha256, signature in self._execute("SELECT path, sha256, signature FROM refs"):
+                try:
+                    if digest_cache.file_signature(path)[0] == signature:
+                        refs.setdefault(sha256, []).append((path, signature))
+                        continue
+                except FileNotFoundError:
+                    pass
+                stale_refs.append((path,))
+
+            blobs = self._execute("SELECT sha256, size FROM blobs ORDER BY atime")
+            total_size = sum(size for _, size in blobs)
+            removed = []
+            for sha256, size in blobs:
+                if total_size <= max_size:
+                    break
+                if self._is_referenced(sha256, refs):
+                    continue
+                removed.append((sha256, size))
+                total_size -= size
+
+            if not dry_run:
+                conn = self._connect()
+                with self._lock:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.executemany("DELETE FROM refs WHERE path = ?", stale_refs)
+                    conn.executemany("DELETE FROM blobs WHERE sha256 = ?", [(x,) for x, _ in removed])
+                    conn.executemany("DELETE FROM aliases WHERE sha256 = ?", [(x,) for x, _ in removed])
+                    conn.execute("COMMIT")
+                for sha256, _ in removed:
+                    if os.path.exists(self.blob_path(sha256)):
+                        # 没有其他硬链接，Windows上只读文件不能删除
+                        os.chmod(self.blob_path(sha256), stat.S_IRUSR | stat.S_IWUSR)
+                        os.remove(self.blob_path(sha256))
+        return len(removed), sum(size for _, size in removed)
+
+    def stats(self):
+        """:return: (blob个数, 总大小)
+        """
+        rows = self._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs")
+        return rows[0][0], rows[0][1]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        pass
+
+    pass
+
+
+def default_store(root=None, link_mode="auto"):
+    """root没有指定的时候使用环境变量中的路径，都没有的时候返回None
+    """
+    root = root or os.environ.get(ARTIFACT_STORE_ENV)
+    if not root:
+        return None
+    return ArtifactStore(root, link_mode=link_mode)
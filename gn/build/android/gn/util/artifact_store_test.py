@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import stat
+import tempfile
+import unittest
+
+from util import artifact_store
+from util import digest_cache
+
+# 测试不使用工作目录中的摘要缓存
+os.environ[digest_cache.DIGEST_CACHE_ENV] = ""
+
+
+class ArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        self.stores = []
+        pass
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        for root, dirs, files in os.walk(self.base_dir):
+            os.chmod(root, stat.S_IRWXU)
+            for name in files:
+                os.chmod(os.path.join(root, name), stat.S_IRUSR | stat.S_IWUSR)
+        self._temp_dir.cleanup()
+        pass
+
+    def _store(self, link_mode):
+        store = artifact_store.ArtifactStore(os.path.join(self.base_dir, "store"), link_mode=link_mode)
+        self.stores.append(store)
+        return store
+
+    def _write(self, name, data):
+        path = os.path.join(self.base_dir, "m2", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode="wb") as fp:
+            fp.write(data)
+        return path
+
+    def _writable(self, path):
+        return bool(os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_hardlink_blob_read_only(self):
+        store = self._store("hardlink")
+        path = self._write("a.jar", b"jar")
+        sha256 = store.add_file(path, aliases={"sha1": "ABC"})
+        blob_path = store.blob_path(sha256)
+        self.assertTrue(os.path.samefile(blob_path, path))
+        self.assertFalse(self._writable(blob_path))
+        self.assertEqual(store.lookup_alias("sha1", "abc"), sha256)
+
+        other = os.path.join(self.base_dir, "m2", "b.jar")
+        self.assertTrue(store.materialize(sha256, other))
+        self.assertTrue(os.path.samefile(blob_path, other))
+        self.assertFalse(self._writable(other))
+        pass
+
+    def test_writable_blob_fixed_before_link(self):
+        store = self._store("copy")
+        sha256 = store.add_file(self._write("a.jar", b"jar"))
+        blob_path = store.blob_path(sha256)
+        # 之前的版本加入的可写blob
+        os.chmod(blob_path, stat.S_IRUSR | stat.S_IWUSR)
+        store = self._store("hardlink")
+        path = os.path.join(self.base_dir, "m2", "b.jar")
+        self.assertTrue(store.materialize(sha256, path))
+        self.assertTrue(os.path.samefile(blob_path, path))
+        self.assertFalse(self._writable(blob_path))
+        pass
+
+    def test_copy_keeps_workspace_writable(self):
+        store = self._store("copy")
+        path = self._write("a.jar", b"jar")
+        sha256 = store.add_file(path)
+        self.assertFalse(os.path.samefile(store.blob_path(sha256), path))
+        self.assertFalse(self._writable(store.blob_path(sha256)))
+        self.assertTrue(self._writable(path))
+        other = os.path.join(self.base_dir, "m2", "b.jar")
+        self.assertTrue(store.materialize(sha256, other))
+        self.assertTrue(self._writable(other))
+        pass
+
+    def test_gc_removes_unreferenced(self):
+        store = self._store("copy")
+        path = self._write("a.jar", b"jar")
+        sha256 = store.add_file(path)
+        self.assertEqual(store.gc(), (0, 0))
+        os.remove(path)
+        self.assertEqual(store.gc(), (1, 3))
+        self.assertFalse(os.path.exists(store.blob_path(sha256)))
+        self.assertFalse(store.materialize(sha256, path))
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
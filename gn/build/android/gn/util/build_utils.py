@@ -2,8 +2,11 @@
 
 import argparse
 import ast
+import collections
 import contextlib
 import fnmatch
+import heapq
+import io
 import json
 import os
 import pathlib
@@ -11,10 +14,13 @@ import pipes
 import re
 import shlex
 import shutil
+import stat
+import struct
 import subprocess
 import sys
 import tempfile
 import zipfile
+import zlib
 
 from util import md5_check
 
@@ -30,6 +36,10 @@ if sys.platform == "win32":
 _HERMETIC_TIMESTAMP = (2001, 1, 1, 0, 0, 0)
 _HERMETIC_ATTR = (0o644 << 16)
 
+_ZIP_FLAG_ENCRYPTED = 0x1
+_ZIP_FLAG_DATA_DESCRIPTOR = 0x8
+_COPY_BUFFER_SIZE = 1024 * 1024
+
 
 def add_depfile_option(parser: argparse.ArgumentParser):
     """添加depfile的选项
@@ -71,37 +81,68 @@ def write_json(obj, path, only_if_change=False):
         pass
 
 
+def _find_dependency_cycle(order, deps_map, unresolved):
+    """在没有排序的依赖项中找到一个环
+    """
+    node = min(unresolved, key=lambda x: order[x])
+    path = []
+    positions = {}
+    while node not in positions:
+        positions[node] = len(path)
+        path.append(node)
+        # 没有排序的项一定还有没有排序的依赖项
+        node = min((d for d in deps_map[node] if d in unresolved),
+                   key=lambda x: order[x])
+    return path[positions[node]:] + [node]
+
+
 def get_sorted_transitive_dependencies(deps_configs, func):
-    """依赖项的顺序
+    """依赖项的顺序，被依赖的项排在前面
+    可以同时排序的项按照广度优先遍历时发现的顺序排列
     :param deps_configs:
-    :param func:
+    :param func: 返回直接依赖项
     """
-    all_deps = set(deps_configs)
-    unchecked_deps = list(deps_configs)
+    order = {}
+    deps_map = {}
+    unchecked_deps = collections.deque()
+    for dep_item in deps_configs:
+        if dep_item not in order:
+            order[dep_item] = len(order)
+            unchecked_deps.append(dep_item)
     while unchecked_deps:
-        dep_item = unchecked_deps.pop(0)
-        new_deps = func(dep_item).difference(all_deps)
-        all_deps.update(new_deps)
-        unchecked_deps.extend(new_deps)
+        dep_item = unchecked_deps.popleft()
+        dependencies = set(func(dep_item))
+        deps_map[dep_item] = dependencies
+        for dep in sorted(dependencies):
+            if dep not in order:
+                order[dep] = len(order)
+                unchecked_deps.append(dep)
         pass
 
-    unsorted_deps = dict(map(lambda dep: (dep, func(dep)), all_deps))
+    nodes = list(order)
+    remaining = {}
+    dependents = collections.defaultdict(list)
+    for dep_item, dependencies in deps_map.items():
+        remaining[dep_item] = len(dependencies)
+        for dep in dependencies:
+            dependents[dep].append(dep_item)
+
+    ready = [order[x] for x, count in remaining.items() if count == 0]
+    heapq.heapify(ready)
     results = []
-    while unsorted_deps:
-        last_n = len(unsorted_deps)
-        for config, dependencies in unsorted_deps.items():
-            if not dependencies.difference(results):
-                results.append(config)
-                del unsorted_deps[config]
-                break
-            pass
-        curr_n = len(unsorted_deps)
-        if last_n == curr_n:
-            for config, dependencies in unsorted_deps.items():
-                print("%s : " % config)
-                for item in dependencies:
-                    print("\t --> %s" % item)
-            raise Exception()
+    while ready:
+        dep_item = nodes[heapq.heappop(ready)]
+        results.append(dep_item)
+        for dependent in dependents[dep_item]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                heapq.heappush(ready, order[dependent])
+        pass
+
+    if len(results) != len(nodes):
+        unresolved = set(x for x, count in remaining.items() if count)
+        cycle = _find_dependency_cycle(order, deps_map, unresolved)
+        raise Exception("Dependency cycle found: %s" % " -> ".join(str(x) for x in cycle))
     return results
 
 
@@ -198,18 +239,57 @@ def delete_directory(directory):
     pass
 
 
-def remove_subtree(base_dir):
+# Windows上不能删除只读文件，修改权限又会影响所有的硬链接，所以不硬链接只读的缓存文件
+CAN_LINK_READ_ONLY = sys.platform != "win32"
+
+
+def link_or_copy(src, dst):
+    """把缓存中的只读文件src放到dst，能够硬链接的时候使用硬链接，否则复制为可写的文件
     """
+    if CAN_LINK_READ_ONLY:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    pass
+
+
+def _remove_error(func, path, _):
+    """rmtree的错误处理，删除文件只需要文件夹的写权限
+
+    只读文件可能是缓存中文件的硬链接，修改权限会影响所有的硬链接，所以只有没有其他硬链接的时候才修改文件的权限。
+    """
+    parent = os.path.dirname(path)
+    os.chmod(parent, stat.S_IMODE(os.stat(parent).st_mode) | stat.S_IRWXU)
+    try:
+        func(path)
+        return
+    except OSError:
+        st = os.lstat(path)
+        if stat.S_ISDIR(st.st_mode) or st.st_nlink > 1:
+            raise
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    func(path)
+    pass
+
+
+def remove_subtree(base_dir):
+    """删除base_dir中的所有内容，保留base_dir
     """
     if not os.path.isdir(base_dir):
         return
     filenames = [os.path.join(base_dir, name)
                  for name in os.listdir(base_dir)]
     for path in filenames:
-        if os.path.isdir(path):
-            shutil.rmtree(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, onerror=_remove_error)
         else:
-            os.remove(path)
+            try:
+                os.remove(path)
+            except OSError as e:
+                _remove_error(os.remove, path, e)
     pass
 
 
@@ -237,8 +317,83 @@ def matches_glob(path, filters):
                            for pat in filters)
 
 
-def merge_zips(output, inputs, exclude_patterns=None, path_transform=None):
+# 直接复制压缩后的数据依赖zipfile的内部实现，不存在的时候回退到解压后重新写入
+_ZIP_RAW_COPY_SUPPORTED = (all(hasattr(zipfile, x) for x in ("structFileHeader", "sizeFileHeader",
+                                                             "stringFileHeader", "_FH_SIGNATURE",
+                                                             "_FH_FILENAME_LENGTH",
+                                                             "_FH_EXTRA_FIELD_LENGTH", "ZIP64_LIMIT"))
+                           and hasattr(zipfile.ZipInfo, "FileHeader"))
+_ZIP_RAW_COPY_ATTRS = ("_lock", "fp", "start_dir", "filelist", "NameToInfo", "_didModify")
+
+
+def _can_copy_zip_raw(in_zip, info, out_zip):
+    if not _ZIP_RAW_COPY_SUPPORTED or info.flag_bits & _ZIP_FLAG_ENCRYPTED:
+        return False
+    if not all(hasattr(x, y) for x in (in_zip, out_zip) for y in _ZIP_RAW_COPY_ATTRS):
+        return False
+    if in_zip.fp is None or out_zip.fp is None or out_zip.mode not in ("w", "x", "a"):
+        return False
+    if getattr(out_zip, "_writing", False):
+        # out_zip.open(mode="w")还没有关闭
+        return False
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+    return not zip64 or getattr(out_zip, "_allowZip64", False)
+
+
+def copy_zip_entry_raw(in_zip: zipfile.ZipFile, info: zipfile.ZipInfo,
+                       out_zip: zipfile.ZipFile, dst_name=None):
+    """不解压直接复制压缩后的数据以及CRC，保留原来的压缩方式、时间和属性
+    :return: 不能直接复制的时候返回False
+    """
+    if not _can_copy_zip_raw(in_zip, info, out_zip):
+        return False
+
+    dst_info = zipfile.ZipInfo(dst_name or info.filename, date_time=info.date_time)
+    dst_info.compress_type = info.compress_type
+    dst_info.CRC = info.CRC
+    dst_info.compress_size = info.compress_size
+    dst_info.file_size = info.file_size
+    dst_info.create_system = info.create_system
+    dst_info.external_attr = info.external_attr
+    dst_info.internal_attr = info.internal_attr
+    # 大小直接写在文件头中，不需要data descriptor
+    dst_info.flag_bits = info.flag_bits & ~_ZIP_FLAG_DATA_DESCRIPTOR
+
+    with in_zip._lock, out_zip._lock:
+        in_fp = in_zip.fp
+        in_fp.seek(info.header_offset)
+        header = in_fp.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader:
+            return False
+        header = struct.unpack(zipfile.structFileHeader, header)
+        if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+            return False
+        in_fp.seek(header[zipfile._FH_FILENAME_LENGTH]
+                   + header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+        out_fp = out_zip.fp
+        out_fp.seek(out_zip.start_dir)
+        dst_info.header_offset = out_fp.tell()
+        out_fp.write(dst_info.FileHeader())
+        remaining = info.compress_size
+        while remaining > 0:
+            data = in_fp.read(min(remaining, _COPY_BUFFER_SIZE))
+            if not data:
+                raise Exception("Truncated zip entry %s in %s"
+                                % (info.filename, in_zip.filename))
+            out_fp.write(data)
+            remaining -= len(data)
+        out_zip.start_dir = out_fp.tell()
+        out_zip.filelist.append(dst_info)
+        out_zip.NameToInfo[dst_info.filename] = dst_info
+        out_zip._didModify = True
+    return True
+
+
+def merge_zips(output, inputs, exclude_patterns=None, path_transform=None, copy_raw=False):
     """合并多个zip文件到output_file中
+    @param copy_raw: 直接复制压缩后的数据，不重新解压和压缩；
+        文件保留原来的压缩方式、时间和属性，否则都以不压缩、当前时间写入
     """
     path_transform = path_transform or (lambda p, f: p)
     added_names = set()
@@ -252,7 +407,8 @@ def merge_zips(output, inputs, exclude_patterns=None, path_transform=None):
                         continue
                     dst_name = path_transform(info.filename, in_file)
                     if (dst_name not in added_names) and not matches_glob(dst_name, exclude_patterns):
-                        out_zip.writestr(dst_name, in_zip.read(info.filename))
+                        if not copy_raw or not copy_zip_entry_raw(in_zip, info, out_zip, dst_name):
+                            out_zip.writestr(dst_name, in_zip.read(info.filename))
                         added_names.add(dst_name)
     pass
 
@@ -341,6 +497,84 @@ def do_zip(inputs, output, base_dir=None):
     pass
 
 
+def _file_crc(path):
+    crc = 0
+    with open(path, mode="rb") as fp:
+        while True:
+            data = fp.read(_COPY_BUFFER_SIZE)
+            if not data:
+                return crc
+            crc = zlib.crc32(data, crc)
+
+
+def _update_zip(output, entries):
+    """@param entries: 按照zip路径排序的[(zip路径, 大小, 计算CRC的函数, add_to_zip_hermetic的参数)]
+    """
+    old_zip = None
+    old_infos = {}
+    if os.path.exists(output):
+        try:
+            old_zip = zipfile.ZipFile(output)
+            old_infos = {x.filename: x for x in old_zip.infolist()}
+        except zipfile.BadZipFile:
+            old_zip = None
+
+    unchanged = set()
+    for zip_path, size, get_crc, _ in entries:
+        info = old_infos.get(zip_path)
+        # 大小不同的时候不需要读取内容
+        if info and info.file_size == size and info.CRC == get_crc():
+            unchanged.add(zip_path)
+    changed = sorted(set(old_infos).union(x[0] for x in entries).difference(unchanged))
+
+    try:
+        if not changed:
+            return changed
+        tmp_output = output + ".tmp"
+        with zipfile.ZipFile(tmp_output, mode="w") as zip_file:
+            for zip_path, _, _, kwargs in entries:
+                if zip_path in unchanged and copy_zip_entry_raw(old_zip, old_infos[zip_path], zip_file):
+                    continue
+                add_to_zip_hermetic(zip_file, zip_path, **kwargs)
+    finally:
+        if old_zip:
+            old_zip.close()
+    os.replace(tmp_output, output)
+    return changed
+
+
+def update_zip_hermetic(output, inputs):
+    """按照do_zip的方式生成output，和旧的output中名称、大小、CRC都相同的文件直接复制压缩后的数据，
+    所有文件都没有变化的时候不修改output
+    @param inputs: [(zip路径, 内容)]
+    :return: 内容变化、新增或者删除的zip路径
+    """
+    entries = []
+    for zip_path, data in sorted(inputs, key=lambda x: x[0]):
+        entries.append((zip_path, len(data), lambda data=data: zlib.crc32(data), {"data": data}))
+    return _update_zip(output, entries)
+
+
+def update_zip(inputs, output, base_dir=None):
+    """增量的do_zip，输出和do_zip完全相同；文件分块读取计算CRC，没有变化的文件直接复制旧的output中的数据
+    :return: 内容变化、新增或者删除的zip路径
+    """
+    input_tuples = []
+    for item in inputs:
+        if isinstance(item, str):
+            zip_path = os.path.relpath(item, base_dir)
+            zip_path = zip_path.replace("\\", "/")
+            input_tuples.append((zip_path, item))
+        else:
+            input_tuples.append(item)
+
+    input_tuples.sort(key=lambda x: x[0])
+    entries = []
+    for zip_path, path in input_tuples:
+        entries.append((zip_path, os.path.getsize(path), lambda path=path: _file_crc(path), {"src_path": path}))
+    return _update_zip(output, entries)
+
+
 def zip_dir(output, base_dir):
     inputs = []
     for root, _, filenames in os.walk(base_dir):
@@ -387,23 +621,56 @@ def extract_all(zip_path,
 def add_to_zip_hermetic(zip_file: zipfile.ZipFile, zip_path,
                         src_path=None,
                         data=None,
-                        compress=None):
-    """添加到文件
+                        compress=None,
+                        fileobj=None,
+                        size=None):
+    """添加到文件，src_path和fileobj会分块写入，不会整个读入内存
+    @param size: fileobj的大小，不知道的时候为None
     """
-    zip_info = zipfile.ZipInfo(zip_path, date_time=_HERMETIC_TIMESTAMP)
-    zip_info.external_attr = _HERMETIC_ATTR
-
     if src_path is not None:
         with open(src_path, mode="rb") as fp:
-            data = fp.read()
+            add_to_zip_hermetic(zip_file, zip_path,
+                                compress=compress,
+                                fileobj=fp,
+                                size=os.fstat(fp.fileno()).st_size)
+        return
+
+    if fileobj is None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        fileobj = io.BytesIO(data)
+        size = len(data)
 
-    if len(data) < 16:
+    if size is not None and size < 16:
         compress = False
 
     compress_type = zip_file.compression
     if compress is not None:
         compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
-    zip_file.writestr(zip_info, data, compress_type)
+
+    zip_info = zipfile.ZipInfo(zip_path, date_time=_HERMETIC_TIMESTAMP)
+    zip_info.external_attr = _HERMETIC_ATTR
+    zip_info.compress_type = compress_type
+    if size is not None:
+        # 用于判断是否需要zip64
+        zip_info.file_size = size
+    with zip_file.open(zip_info, mode="w") as dst_fp:
+        shutil.copyfileobj(fileobj, dst_fp, _COPY_BUFFER_SIZE)
+    pass
+
+
+def add_zip_entry_hermetic(zip_file: zipfile.ZipFile, zip_path,
+                           src_zip: zipfile.ZipFile, src_info,
+                           compress=None):
+    """从另外一个zip文件中分块复制文件
+    """
+    if not isinstance(src_info, zipfile.ZipInfo):
+        src_info = src_zip.getinfo(src_info)
+    with src_zip.open(src_info) as fp:
+        add_to_zip_hermetic(zip_file, zip_path,
+                            compress=compress,
+                            fileobj=fp,
+                            size=src_info.file_size)
     pass
 
 
@@ -0,0 +1,93 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import random
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from util import build_utils
+
+# 设置为很小的值，不需要写入几个GB的文件就能得到zip64的文件
+_SMALL_ZIP64_LIMIT = 1000
+
+
+class CopyZipEntryRawTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        rand = random.Random(1)
+        self.entries = {
+            "stored.txt": (b"stored " * 50, zipfile.ZIP_STORED),
+            "res/deflated.xml": (b"<resources/>" * 100, zipfile.ZIP_DEFLATED),
+            "big.bin": (bytes(rand.getrandbits(8) for _ in range(3 * _SMALL_ZIP64_LIMIT)), zipfile.ZIP_DEFLATED),
+        }
+        self.src_path = os.path.join(self.base_dir, "src.zip")
+        with mock.patch.object(zipfile, "ZIP64_LIMIT", _SMALL_ZIP64_LIMIT):
+            with zipfile.ZipFile(self.src_path, mode="w") as zip_file:
+                for name, (data, compress_type) in sorted(self.entries.items()):
+                    info = zipfile.ZipInfo(name, date_time=(2010, 2, 3, 4, 5, 6))
+                    info.external_attr = 0o640 << 16
+                    zip_file.writestr(info, data, compress_type=compress_type)
+        pass
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        pass
+
+    def _merge(self, **kwargs):
+        output = os.path.join(self.base_dir, "out.zip")
+        with mock.patch.object(zipfile, "ZIP64_LIMIT", _SMALL_ZIP64_LIMIT):
+            build_utils.merge_zips(output, [self.src_path], **kwargs)
+        return output
+
+    def _check_contents(self, path):
+        with zipfile.ZipFile(path) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(sorted(zip_file.namelist()), sorted(self.entries))
+            for name, (data, _) in self.entries.items():
+                self.assertEqual(zip_file.read(name), data)
+            return dict((x.filename, x) for x in zip_file.infolist())
+
+    def test_round_trip(self):
+        infos = self._check_contents(self._merge(copy_raw=True))
+        with zipfile.ZipFile(self.src_path) as zip_file:
+            for src_info in zip_file.infolist():
+                info = infos[src_info.filename]
+                self.assertEqual(info.compress_type, src_info.compress_type)
+                self.assertEqual(info.compress_size, src_info.compress_size)
+                self.assertEqual(info.CRC, src_info.CRC)
+                self.assertEqual(info.date_time, (2010, 2, 3, 4, 5, 6))
+                self.assertEqual(info.external_attr, 0o640 << 16)
+        pass
+
+    def test_zip64_needs_allow_zip64(self):
+        output = os.path.join(self.base_dir, "out.zip")
+        with mock.patch.object(zipfile, "ZIP64_LIMIT", _SMALL_ZIP64_LIMIT):
+            with zipfile.ZipFile(self.src_path) as in_zip, \
+                    zipfile.ZipFile(output, mode="w", allowZip64=False) as out_zip:
+                self.assertFalse(build_utils.copy_zip_entry_raw(in_zip, in_zip.getinfo("big.bin"), out_zip))
+                self.assertTrue(build_utils.copy_zip_entry_raw(in_zip, in_zip.getinfo("stored.txt"), out_zip))
+        with zipfile.ZipFile(output) as zip_file:
+            self.assertEqual(zip_file.namelist(), ["stored.txt"])
+        pass
+
+    def test_unsupported_zipfile_falls_back(self):
+        with mock.patch.object(build_utils, "_ZIP_RAW_COPY_SUPPORTED", False):
+            infos = self._check_contents(self._merge(copy_raw=True))
+        self.assertEqual(set(x.compress_type for x in infos.values()), {zipfile.ZIP_STORED})
+        pass
+
+    def test_copy_raw_opt_in(self):
+        infos = self._check_contents(self._merge())
+        # 默认重新写入，不保留原来的压缩方式
+        self.assertEqual(infos["res/deflated.xml"].compress_type, zipfile.ZIP_STORED)
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
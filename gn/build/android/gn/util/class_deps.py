@@ -0,0 +1,328 @@
+# -*- encoding: utf-8 -*-
+
+import collections
+import hashlib
+import json
+import re
+import struct
+import zipfile
+
+_ACC_PRIVATE = 0x0002
+_ACC_STATIC = 0x0008
+_ACC_FINAL = 0x0010
+
+# 常量池中每种类型的长度，不包括tag
+_CONSTANT_SIZES = {
+    3: 4,  # Integer
+    4: 4,  # Float
+    5: 8,  # Long
+    6: 8,  # Double
+    7: 2,  # Class
+    8: 2,  # String
+    9: 4,  # Fieldref
+    10: 4,  # Methodref
+    11: 4,  # InterfaceMethodref
+    12: 4,  # NameAndType
+    15: 3,  # MethodHandle
+    16: 2,  # MethodType
+    17: 4,  # Dynamic
+    18: 4,  # InvokeDynamic
+    19: 2,  # Module
+    20: 2,  # Package
+}
+
+_DESCRIPTOR_CLASS_PATTERN = re.compile(r"L([\w/$]+)[;<]")
+
+ClassInfo = collections.namedtuple(
+    "ClassInfo",
+    "name source_file deps api constants")
+
+
+class _ClassReader:
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+        self._pool = [None]
+        pass
+
+    def u1(self):
+        value = self._data[self._offset]
+        self._offset += 1
+        return value
+
+    def u2(self):
+        value, = struct.unpack_from(">H", self._data, self._offset)
+        self._offset += 2
+        return value
+
+    def u4(self):
+        value, = struct.unpack_from(">I", self._data, self._offset)
+        self._offset += 4
+        return value
+
+    def read_bytes(self, length):
+        value = self._data[self._offset:self._offset + length]
+        self._offset += length
+        return value
+
+    def read_constant_pool(self):
+        count = self.u2()
+        while len(self._pool) < count:
+            tag = self.u1()
+            if tag == 1:
+                value = self.read_bytes(self.u2()).decode("utf-8", errors="replace")
+                self._pool.append((tag, value))
+            elif tag in _CONSTANT_SIZES:
+                value = self.read_bytes(_CONSTANT_SIZES[tag])
+                self._pool.append((tag, value))
+                if tag in (5, 6):
+                    # Long和Double占用两个位置
+                    self._pool.append(None)
+            else:
+                raise Exception("Unknown constant pool tag: %d" % tag)
+        pass
+
+    def utf8(self, index):
+        return self._pool[index][1]
+
+    def class_name(self, index):
+        if not index:
+            return None
+        name_index, = struct.unpack(">H", self._pool[index][1])
+        return self.utf8(name_index)
+
+    def constant_value(self, index):
+        tag, value = self._pool[index]
+        if tag == 8:
+            value = self.utf8(struct.unpack(">H", value)[0])
+        elif isinstance(value, bytes):
+            value = value.hex()
+        return "%d:%s" % (tag, value)
+
+    def iter_entries(self, tag):
+        for entry in self._pool:
+            if entry and entry[0] == tag:
+                yield entry[1]
+        pass
+
+    def read_attributes(self):
+        """读取属性
+        :return: [(name, data)]
+        """
+        attributes = []
+        for _ in range(self.u2()):
+            name = self.utf8(self.u2())
+            attributes.append((name, self.read_bytes(self.u4())))
+        return attributes
+
+    def read_members(self):
+        """读取字段或者方法
+        :return: [(access_flags, name, descriptor, attributes)]
+        """
+        members = []
+        for _ in range(self.u2()):
+            access_flags = self.u2()
+            name = self.utf8(self.u2())
+            descriptor = self.utf8(self.u2())
+            members.append((access_flags, name, descriptor, self.read_attributes()))
+        return members
+
+    pass
+
+
+def _descriptor_classes(descriptor):
+    return _DESCRIPTOR_CLASS_PATTERN.findall(descriptor)
+
+
+def _array_component_class(name):
+    """[Lfoo/Bar; -> foo/Bar
+    """
+    if not name.startswith("["):
+        return name
+    classes = _descriptor_classes(name)
+    return classes[0] if classes else None
+
+
+def _attribute(attributes, name):
+    for attr_name, data in attributes:
+        if attr_name == name:
+            return data
+    return None
+
+
+def _signature_of(reader, attributes):
+    data = _attribute(attributes, "Signature")
+    return reader.utf8(struct.unpack(">H", data)[0]) if data else ""
+
+
+def _exceptions_of(reader, attributes):
+    data = _attribute(attributes, "Exceptions")
+    if not data:
+        return []
+    count, = struct.unpack_from(">H", data)
+    indexes = struct.unpack_from(">%dH" % count, data, 2)
+    return sorted(reader.class_name(i) for i in indexes)
+
+
+def parse_class(data) -> ClassInfo:
+    """解析class文件，得到引用的类以及公开接口的摘要
+    """
+    reader = _ClassReader(data)
+    if reader.u4() != 0xCAFEBABE:
+        raise Exception("Not a class file")
+    reader.u2()
+    reader.u2()
+    reader.read_constant_pool()
+
+    access_flags = reader.u2()
+    name = reader.class_name(reader.u2())
+    super_name = reader.class_name(reader.u2())
+    interfaces = [reader.class_name(reader.u2()) for _ in range(reader.u2())]
+    fields = reader.read_members()
+    methods = reader.read_members()
+    attributes = reader.read_attributes()
+
+    deps = set()
+    for class_index in reader.iter_entries(7):
+        dep = _array_component_class(reader.utf8(struct.unpack(">H", class_index)[0]))
+        if dep:
+            deps.add(dep)
+    for name_and_type in reader.iter_entries(12):
+        descriptor_index = struct.unpack(">HH", name_and_type)[1]
+        deps.update(_descriptor_classes(reader.utf8(descriptor_index)))
+    for _, _, descriptor, member_attributes in fields + methods:
+        deps.update(_descriptor_classes(descriptor))
+        deps.update(_descriptor_classes(_signature_of(reader, member_attributes)))
+    deps.discard(name)
+
+    api = hashlib.md5()
+    constants = hashlib.md5()
+    api.update(("%d %s %s %s %s\n" % (access_flags, name, super_name,
+                                      ",".join(interfaces),
+                                      _signature_of(reader, attributes))).encode("utf-8"))
+    members = []
+    for kind, items in (("F", fields), ("M", methods)):
+        for flags, member_name, descriptor, member_attributes in items:
+            if flags & _ACC_PRIVATE:
+                continue
+            members.append("%s %d %s %s %s %s" % (kind, flags, member_name, descriptor,
+                                                  _signature_of(reader, member_attributes),
+                                                  ",".join(_exceptions_of(reader, member_attributes))))
+            constant = _attribute(member_attributes, "ConstantValue")
+            if kind == "F" and constant and flags & _ACC_STATIC and flags & _ACC_FINAL:
+                # 常量会被内联到使用它的类中，需要单独记录
+                value = reader.constant_value(struct.unpack(">H", constant)[0])
+                constants.update(("%s=%s\n" % (member_name, value)).encode("utf-8"))
+    for member in sorted(members):
+        api.update((member + "\n").encode("utf-8"))
+
+    source_data = _attribute(attributes, "SourceFile")
+    source_file = reader.utf8(struct.unpack(">H", source_data)[0]) if source_data else None
+    return ClassInfo(name, source_file, sorted(deps), api.hexdigest(), constants.hexdigest())
+
+
+def parse_class_file(path) -> ClassInfo:
+    with open(path, mode="rb") as fp:
+        return parse_class(fp.read())
+
+
+def interface_jar_entries(path):
+    """interface jar中每个类的CRC以及常量的摘要，只修改了方法体的时候不会变化
+    :return: {类名: [crc, constants]}
+    """
+    entries = {}
+    with zipfile.ZipFile(path) as zip_file:
+        for info in zip_file.infolist():
+            if info.filename.endswith(".class"):
+                constants = parse_class(zip_file.read(info)).constants
+                entries[info.filename[:-len(".class")]] = [info.CRC, constants]
+    return entries
+
+
+class ClassDependencyIndex:
+    """类之间的引用关系，用于找到需要重新编译的源文件
+    """
+
+    def __init__(self):
+        self._classes = {}
+        self._sources = {}
+        self._classpath = {}
+        self._dependents = None
+        pass
+
+    @classmethod
+    def from_file(cls, fp):
+        obj = json.load(fp)
+        ret = cls()
+        ret._classes = obj["classes"]
+        ret._sources = obj["sources"]
+        ret._classpath = obj["classpath"]
+        return ret
+
+    def to_file(self, fp):
+        obj = {
+            "classes": self._classes,
+            "sources": self._sources,
+            "classpath": self._classpath,
+        }
+        json.dump(obj, fp=fp, indent=2, sort_keys=True)
+        pass
+
+    def add_source(self, source, class_infos):
+        """记录源文件编译出来的类
+        """
+        self._dependents = None
+        self.remove_source(source)
+        self._sources[source] = sorted(info.name for info in class_infos)
+        for info in class_infos:
+            self._classes[info.name] = {
+                "deps": info.deps,
+                "api": info.api,
+                "constants": info.constants,
+            }
+        pass
+
+    def remove_source(self, source):
+        """删除源文件对应的记录
+        :return: 删除的类的记录
+        """
+        self._dependents = None
+        removed = {}
+        for name in self._sources.pop(source, []):
+            removed[name] = self._classes.pop(name, None)
+        return removed
+
+    def has_source(self, source):
+        return source in self._sources
+
+    def source_classes(self, source):
+        return list(self._sources.get(source, []))
+
+    def class_entry(self, name):
+        return self._classes.get(name)
+
+    def set_classpath_entries(self, jar_path, entries):
+        self._classpath[jar_path] = entries
+        pass
+
+    def classpath_entries(self, jar_path):
+        return self._classpath.get(jar_path)
+
+    def sources_depending_on(self, class_names):
+        """类的公开接口发生变化时，需要重新编译的源文件
+        """
+        if self._dependents is None:
+            class_to_source = {}
+            for source, names in self._sources.items():
+                for name in names:
+                    class_to_source[name] = source
+            self._dependents = collections.defaultdict(set)
+            for name, entry in self._classes.items():
+                for dep in entry["deps"]:
+                    self._dependents[dep].add(class_to_source[name])
+        sources = set()
+        for name in class_names:
+            sources.update(self._dependents.get(name, ()))
+        return sorted(sources)
+
+    pass
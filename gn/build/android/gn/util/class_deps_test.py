@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+
+from util import class_deps
+
+_HAS_JAVAC = shutil.which("javac") is not None
+
+_B_SOURCE = """package a;
+
+public class B {
+    public static final int K = %(k)d;
+    public static final long L = 1234567890123L;
+    public static final double D = 1.5;
+    public static final String S = "text";
+
+    public int g() {
+        return %(body)d;
+    }
+
+    private void hidden() {
+    }
+    %(extra)s
+}
+"""
+
+_A_SOURCE = """package a;
+
+import java.util.List;
+
+public class A extends Thread implements Runnable {
+    private List<String> names;
+
+    public B create(B[] items) throws java.io.IOException {
+        return items[0];
+    }
+
+    public int use(B b) {
+        return b.g();
+    }
+}
+"""
+
+
+def _b_source(k=1, body=1, extra=""):
+    return _B_SOURCE % {"k": k, "body": body, "extra": extra}
+
+
+@unittest.skipUnless(_HAS_JAVAC, "javac is not available")
+class ParseClassTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        pass
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        pass
+
+    def _compile(self, sources):
+        """编译{类名: 源代码}，返回{类名: ClassInfo}"""
+        src_dir = os.path.join(self.base_dir, "src")
+        classes_dir = os.path.join(self.base_dir, "classes")
+        shutil.rmtree(classes_dir, ignore_errors=True)
+        os.makedirs(classes_dir)
+        paths = []
+        for name, source in sources.items():
+            path = os.path.join(src_dir, "a", name + ".java")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, mode="w", encoding="utf-8") as fp:
+                fp.write(source)
+            paths.append(path)
+        subprocess.check_call(["javac", "-g", "-d", classes_dir] + paths)
+        return dict((name, class_deps.parse_class_file(os.path.join(classes_dir, "a", name + ".class")))
+                    for name in sources)
+
+    def test_parse(self):
+        infos = self._compile({"A": _A_SOURCE, "B": _b_source()})
+        a = infos["A"]
+        self.assertEqual(a.name, "a/A")
+        self.assertEqual(a.source_file, "A.java")
+        for dep in ("a/B", "java/lang/Thread", "java/lang/Runnable", "java/util/List",
+                    "java/lang/String", "java/io/IOException"):
+            self.assertIn(dep, a.deps)
+        self.assertNotIn("a/A", a.deps)
+
+        b = infos["B"]
+        self.assertEqual(b.name, "a/B")
+        self.assertNotIn("a/A", b.deps)
+        pass
+
+    def test_method_body_keeps_api(self):
+        old = self._compile({"B": _b_source()})["B"]
+        new = self._compile({"B": _b_source(body=2)})["B"]
+        self.assertEqual(new.api, old.api)
+        self.assertEqual(new.constants, old.constants)
+
+        # 私有方法不属于公开接口
+        new = self._compile({"B": _b_source(extra="private int other() { return 0; }")})["B"]
+        self.assertEqual(new.api, old.api)
+        pass
+
+    def test_public_api_change(self):
+        old = self._compile({"B": _b_source()})["B"]
+        new = self._compile({"B": _b_source(extra="public int other() { return 0; }")})["B"]
+        self.assertNotEqual(new.api, old.api)
+        self.assertEqual(new.constants, old.constants)
+        pass
+
+    def test_constant_change(self):
+        old = self._compile({"B": _b_source()})["B"]
+        new = self._compile({"B": _b_source(k=2)})["B"]
+        self.assertEqual(new.api, old.api)
+        self.assertNotEqual(new.constants, old.constants)
+        pass
+
+    def test_interface_jar_entries(self):
+        self._compile({"A": _A_SOURCE, "B": _b_source()})
+        jar_path = os.path.join(self.base_dir, "lib.interface.jar")
+        with zipfile.ZipFile(jar_path, mode="w") as zip_file:
+            for name in ("A", "B"):
+                zip_file.write(os.path.join(self.base_dir, "classes", "a", name + ".class"),
+                               "a/%s.class" % name)
+        entries = class_deps.interface_jar_entries(jar_path)
+        self.assertEqual(sorted(entries), ["a/A", "a/B"])
+        self.assertNotEqual(entries["a/A"][1], entries["a/B"][1])
+        pass
+
+    pass
+
+
+class ClassDependencyIndexTest(unittest.TestCase):
+    @staticmethod
+    def _info(name, deps, api="api", constants="constants"):
+        return class_deps.ClassInfo(name, None, deps, api, constants)
+
+    def _index(self):
+        index = class_deps.ClassDependencyIndex()
+        index.add_source("A.java", [self._info("a/A", ["a/B"]), self._info("a/A$1", ["a/C"])])
+        index.add_source("B.java", [self._info("a/B", ["a/C"])])
+        index.add_source("C.java", [self._info("a/C", [])])
+        return index
+
+    def test_sources_depending_on(self):
+        index = self._index()
+        self.assertEqual(index.sources_depending_on(["a/C"]), ["A.java", "B.java"])
+        self.assertEqual(index.sources_depending_on(["a/B"]), ["A.java"])
+        self.assertEqual(index.sources_depending_on(["a/A"]), [])
+
+        removed = index.remove_source("A.java")
+        self.assertEqual(sorted(removed), ["a/A", "a/A$1"])
+        self.assertEqual(index.sources_depending_on(["a/C"]), ["B.java"])
+        pass
+
+    def test_round_trip(self):
+        index = self._index()
+        index.set_classpath_entries("lib.jar", {"lib/L": [1, "c"]})
+        fp = io.StringIO()
+        index.to_file(fp)
+        fp.seek(0)
+        loaded = class_deps.ClassDependencyIndex.from_file(fp)
+        self.assertEqual(loaded.sources_depending_on(["a/C"]), ["A.java", "B.java"])
+        self.assertEqual(loaded.source_classes("A.java"), ["a/A", "a/A$1"])
+        self.assertEqual(loaded.classpath_entries("lib.jar"), {"lib/L": [1, "c"]})
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import stat
+import threading
+import time
+
+from util import build_utils
+from util import md5_check
+
+# 缓存的路径，设置为空字符串时禁用缓存
+CRUNCH_CACHE_ENV = "ANDROID_BUILD_CRUNCH_CACHE"
+CRUNCH_CACHE_NAME = ".crunch_cache"
+
+# 添加新内容时删除这么久没有使用过的内容
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+_DIGEST_ALGORITHM = "sha256"
+_READ_ONLY_FILE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+class CrunchCache:
+    """以png的sha256为键保存aapt crunch的结果，多个target共享
+
+    键中还包括aapt本身的摘要、资源类型以及是否是.9.png，这些都会影响crunch的结果。
+    缓存中的文件是只读的，通过硬链接放到输出文件夹中，参考build_utils.link_or_copy。
+    """
+
+    def __init__(self, root, max_age=DEFAULT_MAX_AGE):
+        self._root = os.path.abspath(root)
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._pruned = False
+        pass
+
+    def root(self):
+        return self._root
+
+    def key(self, aapt_digest, path, relpath):
+        """@param relpath: 相对资源文件夹的路径，例如drawable-hdpi/icon.png"""
+        resource_type = relpath.replace("\\", "/").split("/")[0].split("-")[0]
+        nine_patch = path.endswith(".9.png")
+        source_digest = md5_check.digest_for_path(path, _DIGEST_ALGORITHM)
+        return hashlib.sha256(("%s:%s:%d:%s" % (aapt_digest, resource_type, nine_patch,
+                                                source_digest)).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._root, key[:2], key + ".png")
+
+    def materialize(self, key, output_path):
+        """:return: 缓存中没有的时候返回False"""
+        entry_path = self._entry_path(key)
+        try:
+            # 记录最近一次使用的时间
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return False
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        try:
+            build_utils.link_or_copy(entry_path, output_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def add(self, key, path):
+        """把crunch的结果path加入缓存"""
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_path = "%s.%d.%d.tmp" % (entry_path, os.getpid(), threading.get_ident())
+        shutil.copyfile(path, tmp_path)
+        os.chmod(tmp_path, _READ_ONLY_FILE)
+        os.replace(tmp_path, entry_path)
+        with self._lock:
+            prune, self._pruned = not self._pruned, True
+        if prune:
+            self.prune()
+        pass
+
+    def prune(self, max_age=None):
+        """删除max_age秒内没有使用过的内容
+        :return: 删除的个数
+        """
+        max_age = self._max_age if max_age is None else max_age
+        deadline = time.time() - max_age
+        count = 0
+        if not os.path.isdir(self._root):
+            return count
+        for prefix in os.listdir(self._root):
+            prefix_dir = os.path.join(self._root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                entry_path = os.path.join(prefix_dir, name)
+                try:
+                    if os.stat(entry_path).st_mtime < deadline:
+                        os.remove(entry_path)
+                        count += 1
+                except OSError:
+                    pass
+        return count
+
+    pass
+
+
+def default_cache():
+    """默认的缓存在当前工作目录，也就是ninja运行action的root_build_dir中的.crunch_cache，
+    可以通过环境变量指定其他路径，在多个输出目录之间共享；环境变量设置为空字符串的时候返回None
+    """
+    root = os.environ.get(CRUNCH_CACHE_ENV, os.path.join(os.getcwd(), CRUNCH_CACHE_NAME))
+    if not root:
+        return None
+    return CrunchCache(root)
@@ -0,0 +1,154 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from util import crunch_cache
+from util import digest_cache
+
+# 测试不使用工作目录中的摘要缓存
+os.environ[digest_cache.DIGEST_CACHE_ENV] = ""
+
+import process_resources
+
+# 把-S中的png复制到-C，记录每次调用时输入的文件
+_FAKE_AAPT = """#!%(python)s
+import os, sys
+args = sys.argv[1:]
+output_dir = args[args.index("-C") + 1]
+input_dir = args[args.index("-S") + 1]
+names = []
+for root, _, files in os.walk(input_dir):
+    for name in files:
+        src = os.path.join(root, name)
+        relpath = os.path.relpath(src, input_dir)
+        dst = os.path.join(output_dir, relpath)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(src, "rb") as fp:
+            data = fp.read()
+        with open(dst, "wb") as fp:
+            fp.write(b"crunched:" + data)
+        names.append(relpath.replace(os.sep, "/"))
+with open(%(log)r, "a") as fp:
+    fp.write(" ".join(sorted(names)) + "\\n")
+"""
+
+
+class CrunchCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        self.cache = crunch_cache.CrunchCache(os.path.join(self.base_dir, "cache"))
+        self.log_path = os.path.join(self.base_dir, "aapt.log")
+        self.aapt = os.path.join(self.base_dir, "aapt")
+        with open(self.aapt, mode="w", encoding="utf-8") as fp:
+            fp.write(_FAKE_AAPT % {"python": sys.executable, "log": self.log_path})
+        os.chmod(self.aapt, stat.S_IRWXU)
+        self.res_dir = os.path.join(self.base_dir, "res")
+        pass
+
+    def tearDown(self):
+        for root, dirs, files in os.walk(self.base_dir):
+            os.chmod(root, stat.S_IRWXU)
+            for name in files:
+                os.chmod(os.path.join(root, name), stat.S_IRUSR | stat.S_IWUSR)
+        self._temp_dir.cleanup()
+        pass
+
+    def _write(self, relpath, data):
+        path = os.path.join(self.res_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode="wb") as fp:
+            fp.write(data)
+        return path
+
+    def _read(self, path):
+        with open(path, mode="rb") as fp:
+            return fp.read()
+
+    def _aapt_calls(self):
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path, mode="r", encoding="utf-8") as fp:
+            return fp.read().splitlines()
+
+    def _crunch(self, name):
+        output_dir = os.path.join(self.base_dir, name)
+        os.makedirs(output_dir)
+        process_resources.crunch_directory(self.aapt, self.res_dir, output_dir, self.cache)
+        return output_dir
+
+    def test_key(self):
+        path = self._write("drawable-hdpi/icon.png", b"png")
+        key = self.cache.key("aapt1", path, "drawable-hdpi/icon.png")
+        self.assertEqual(key, self.cache.key("aapt1", path, "drawable-hdpi/icon.png"))
+        self.assertEqual(key, self.cache.key("aapt1", path, "drawable-xhdpi/icon.png"))
+        self.assertNotEqual(key, self.cache.key("aapt2", path, "drawable-hdpi/icon.png"))
+        self.assertNotEqual(key, self.cache.key("aapt1", path, "mipmap-hdpi/icon.png"))
+        nine_patch = self._write("drawable-hdpi/icon.9.png", b"png")
+        self.assertNotEqual(key, self.cache.key("aapt1", nine_patch, "drawable-hdpi/icon.9.png"))
+        self._write("drawable-hdpi/icon.png", b"png2")
+        self.assertNotEqual(key, self.cache.key("aapt1", path, "drawable-hdpi/icon.png"))
+        pass
+
+    def test_materialize(self):
+        output_path = os.path.join(self.base_dir, "out", "drawable", "icon.png")
+        self.assertFalse(self.cache.materialize("0" * 64, output_path))
+        self.assertFalse(os.path.exists(output_path))
+
+        crunched = self._write("drawable/icon.png", b"crunched")
+        self.cache.add("0" * 64, crunched)
+        self.assertTrue(self.cache.materialize("0" * 64, output_path))
+        self.assertEqual(self._read(output_path), b"crunched")
+        self.assertEqual(os.stat(output_path).st_mode & stat.S_IWUSR, 0)
+        # 已经存在的输出被替换
+        self.assertTrue(self.cache.materialize("0" * 64, output_path))
+        pass
+
+    def test_second_build_without_aapt(self):
+        self._write("drawable/a.png", b"a")
+        self._write("drawable-hdpi/b.9.png", b"b")
+        self._write("values/strings.xml", b"<resources/>")
+        first = self._crunch("out1")
+        self.assertEqual(self._aapt_calls(), ["drawable-hdpi/b.9.png drawable/a.png"])
+        self.assertFalse(os.path.exists(first + ".staging"))
+
+        second = self._crunch("out2")
+        self.assertEqual(len(self._aapt_calls()), 1)
+        for out in (first, second):
+            self.assertEqual(self._read(os.path.join(out, "drawable", "a.png")), b"crunched:a")
+            self.assertEqual(self._read(os.path.join(out, "drawable-hdpi", "b.9.png")), b"crunched:b")
+        pass
+
+    def test_only_missing_pngs_staged(self):
+        self._write("drawable/a.png", b"a")
+        self._crunch("out1")
+        self._write("drawable/c.png", b"c")
+        output_dir = self._crunch("out2")
+        # 只有缓存中没有的png交给aapt
+        self.assertEqual(self._aapt_calls(), ["drawable/a.png", "drawable/c.png"])
+        self.assertEqual(self._read(os.path.join(output_dir, "drawable", "a.png")), b"crunched:a")
+        self.assertEqual(self._read(os.path.join(output_dir, "drawable", "c.png")), b"crunched:c")
+        pass
+
+    def test_crunch_directories(self):
+        self._write("drawable/a.png", b"a")
+        self._crunch("out")
+        output_dirs = [os.path.join(self.base_dir, "out%d" % i) for i in range(3)]
+        with mock.patch.dict(os.environ, {crunch_cache.CRUNCH_CACHE_ENV: self.cache.root()}):
+            process_resources.crunch_directories(self.aapt, [self.res_dir] * 3, output_dirs, 2)
+        self.assertEqual(len(self._aapt_calls()), 1)
+        for output_dir in output_dirs:
+            self.assertEqual(self._read(os.path.join(output_dir, "drawable", "a.png")), b"crunched:a")
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -0,0 +1,198 @@
+# -*- encoding: utf-8 -*-
+
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# 缓存数据库的路径，设置为空字符串时禁用缓存
+DIGEST_CACHE_ENV = "ANDROID_BUILD_DIGEST_CACHE"
+DIGEST_CACHE_NAME = ".digest_cache.db"
+
+_DEFAULT_MAX_ENTRIES = 200000
+# mtime离现在太近的文件不写入缓存，避免同一时间片内的修改被漏掉
+_RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+def file_signature(path):
+    """文件的stat签名
+    :return: (signature, mtime_ns)
+    """
+    stat_obj = os.stat(path)
+    signature = "%d:%d:%d:%d" % (stat_obj.st_dev, stat_obj.st_ino,
+                                 stat_obj.st_mtime_ns, stat_obj.st_size)
+    return signature, stat_obj.st_mtime_ns
+
+
+def directory_signature(dir_path):
+    """文件夹的stat签名，由所有文件的stat签名组成
+    :return: (signature, mtime_ns)
+    """
+    md5 = hashlib.md5()
+    newest_mtime_ns = 0
+    for root, _, files in os.walk(dir_path):
+        for file in files:
+            path = os.path.join(root, file)
+            signature, mtime_ns = file_signature(path)
+            md5.update(("%s=%s\n" % (os.path.relpath(path, dir_path),
+                                     signature)).encode(encoding="utf-8"))
+            newest_mtime_ns = max(newest_mtime_ns, mtime_ns)
+    return md5.hexdigest(), newest_mtime_ns
+
+
+class DigestCache:
+    """以(path, st_dev, st_ino, st_mtime_ns, st_size)为键的摘要缓存
+
+    多个ninja任务并发访问同一个sqlite数据库，写入在进程结束时批量提交，
+    条目数超过上限时按照最近使用时间淘汰。
+    """
+
+    def __init__(self, db_path, max_entries=_DEFAULT_MAX_ENTRIES):
+        self._db_path = db_path
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disabled = not db_path
+        self._pending = {}
+        self._touched = set()
+        pass
+
+    def _connect(self):
+        if self._conn is None and not self._disabled:
+            try:
+                conn = sqlite3.connect(self._db_path,
+                                       timeout=60,
+                                       isolation_level=None,
+                                       check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS digests ("
+                             "kind TEXT NOT NULL, "
+                             "path TEXT NOT NULL, "
+                             "signature TEXT NOT NULL, "
+                             "value TEXT NOT NULL, "
+                             "atime INTEGER NOT NULL, "
+                             "PRIMARY KEY (kind, path))")
+                conn.execute("CREATE INDEX IF NOT EXISTS digests_atime "
+                             "ON digests (atime)")
+                self._conn = conn
+            except sqlite3.Error:
+                self._disabled = True
+        return self._conn
+
+    def get(self, kind, path, signature):
+        """查找缓存，签名不一致时返回None
+        """
+        key = (kind, os.path.abspath(path))
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                return pending[1] if pending[0] == signature else None
+
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute("SELECT signature, value FROM digests "
+                                   "WHERE kind = ? AND path = ?", key).fetchone()
+            except sqlite3.Error:
+                return None
+            if not row or row[0] != signature:
+                return None
+            self._touched.add(key)
+            return row[1]
+
+    def put(self, kind, path, signature, value, mtime_ns):
+        """写入缓存，真正的写入在flush的时候进行
+        """
+        if self._disabled:
+            return
+        if time.time_ns() - mtime_ns < _RACY_WINDOW_NS:
+            return
+        with self._lock:
+            self._pending[(kind, os.path.abspath(path))] = (signature, value)
+        pass
+
+    def get_or_compute(self, kind, path, compute, signature=None, mtime_ns=None):
+        """优先从缓存中获取，没有的时候调用compute计算
+        """
+        if signature is None:
+            signature, mtime_ns = file_signature(path)
+        value = self.get(kind, path, signature)
+        if value is None:
+            value = compute()
+            self.put(kind, path, signature, value, mtime_ns)
+        return value
+
+    def flush(self):
+        """提交所有的修改，并且淘汰最久没有使用的条目
+        """
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            conn = self._connect()
+            if conn is None:
+                return
+            now = time.time_ns()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT OR REPLACE INTO digests "
+                                 "(kind, path, signature, value, atime) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 [(k[0], k[1], v[0], v[1], now)
+                                  for k, v in self._pending.items()])
+                conn.executemany("UPDATE digests SET atime = ? "
+                                 "WHERE kind = ? AND path = ?",
+                                 [(now, k[0], k[1]) for k in self._touched])
+                count = conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+                if count > self._max_entries:
+                    # 多淘汰一些，避免每次都触发淘汰
+                    evict_count = count - self._max_entries * 9 // 10
+                    conn.execute("DELETE FROM digests WHERE rowid IN ("
+                                 "SELECT rowid FROM digests ORDER BY atime LIMIT ?)",
+                                 (evict_count,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            self._pending.clear()
+            self._touched.clear()
+        pass
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        pass
+
+    pass
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> DigestCache:
+    """当前进程共享的缓存
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            db_path = os.environ.get(DIGEST_CACHE_ENV,
+                                     os.path.join(os.getcwd(), DIGEST_CACHE_NAME))
+            _default_cache = DigestCache(db_path)
+            atexit.register(_default_cache.close)
+    return _default_cache
+
+
+def lookup(kind, path, compute, signature=None, mtime_ns=None):
+    """带缓存的摘要计算
+    """
+    return default_cache().get_or_compute(kind, path, compute,
+                                          signature=signature,
+                                          mtime_ns=mtime_ns)
@@ -0,0 +1,174 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import threading
+import time
+import zipfile
+
+from util import build_utils
+from util import md5_check
+
+# 缓存的路径，设置为空字符串时禁用缓存
+EXTRACT_CACHE_ENV = "ANDROID_BUILD_EXTRACT_CACHE"
+EXTRACT_CACHE_NAME = ".extract_cache"
+
+# 添加新内容时删除这么久没有使用过的内容
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+_DIGEST_ALGORITHM = "sha256"
+_READ_ONLY_FILE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def _tmp_path(path):
+    return "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+
+
+class ExtractCache:
+    """以zip的sha256为键保存解压后的文件，多个target共享
+
+    缓存中的文件是只读的，通过硬链接得到工作目录中的文件，工作目录中重命名、删除文件不会影响缓存；
+    不能硬链接或者在Windows上的时候复制，参考build_utils.link_or_copy。
+    """
+
+    def __init__(self, root, max_age=DEFAULT_MAX_AGE):
+        self._root = os.path.abspath(root)
+        self._max_age = max_age
+        pass
+
+    def root(self):
+        return self._root
+
+    def _entry_path(self, digest):
+        return os.path.join(self._root, digest[:2], digest)
+
+    def _add(self, zip_path, entry_path):
+        """解压到临时文件夹，然后重命名为entry_path
+        """
+        tmp_path = _tmp_path(entry_path)
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        with zipfile.ZipFile(zip_path) as zip_file:
+            for info in zip_file.infolist():
+                if info.filename.endswith("/"):
+                    continue
+                path = zip_file.extract(info, tmp_path)
+                os.chmod(path, _READ_ONLY_FILE)
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # 其他进程已经添加了相同的内容
+            if not os.path.isdir(entry_path):
+                raise
+            shutil.rmtree(tmp_path, onerror=_remove_read_only)
+        self.prune()
+        pass
+
+    def _link_tree(self, entry_path, output_dir):
+        for root, dirs, files in os.walk(entry_path):
+            dst_root = os.path.join(output_dir, os.path.relpath(root, entry_path))
+            for name in dirs:
+                os.makedirs(os.path.join(dst_root, name), exist_ok=True)
+            for name in files:
+                src = os.path.join(root, name)
+                dst = os.path.join(dst_root, name)
+                if os.path.lexists(dst):
+                    raise Exception("%s already exists" % dst)
+                build_utils.link_or_copy(src, dst)
+        pass
+
+    def extract(self, zip_path, output_dir):
+        """把zip_path中的文件放到output_dir中，output_dir应该是空的文件夹
+        """
+        entry_path = self._entry_path(md5_check.digest_for_path(zip_path, _DIGEST_ALGORITHM))
+        os.makedirs(output_dir, exist_ok=True)
+        for _ in range(2):
+            if not os.path.isdir(entry_path):
+                os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+                self._add(zip_path, entry_path)
+            try:
+                # 记录最近一次使用的时间
+                os.utime(entry_path)
+                self._link_tree(entry_path, output_dir)
+                return
+            except FileNotFoundError:
+                # 正好被其他进程删除，清理之后重新添加
+                build_utils.remove_subtree(output_dir)
+        raise Exception("Failed to extract %s to %s" % (zip_path, output_dir))
+
+    def prune(self, max_age=None):
+        """删除max_age秒内没有使用过的内容
+        :return: 删除的个数
+        """
+        max_age = self._max_age if max_age is None else max_age
+        deadline = time.time() - max_age
+        count = 0
+        if not os.path.isdir(self._root):
+            return count
+        for prefix in os.listdir(self._root):
+            prefix_dir = os.path.join(self._root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                entry_path = os.path.join(prefix_dir, name)
+                try:
+                    if os.stat(entry_path).st_mtime >= deadline:
+                        continue
+                    if name.endswith(".tmp"):
+                        # 中断的解压
+                        shutil.rmtree(entry_path, onerror=_remove_read_only)
+                        continue
+                    # 先重命名，使用中的进程不会看到只删除了一部分的内容
+                    tmp_path = _tmp_path(entry_path)
+                    os.rename(entry_path, tmp_path)
+                except OSError:
+                    continue
+                shutil.rmtree(tmp_path, onerror=_remove_read_only)
+                count += 1
+        return count
+
+    pass
+
+
+def _remove_read_only(func, path, _):
+    """rmtree的错误处理，删除文件只需要文件夹的写权限
+
+    缓存中的文件和工作目录中的文件是同一个inode，修改文件的权限会让所有硬链接都变成可写的，
+    所以只有没有其他硬链接的时候才修改文件的权限。
+    """
+    os.chmod(os.path.dirname(path), stat.S_IRWXU)
+    try:
+        func(path)
+        return
+    except OSError:
+        pass
+    st = os.lstat(path)
+    if stat.S_ISDIR(st.st_mode) or st.st_nlink > 1:
+        # 文件还在被工作目录使用，或者文件夹中还有这样的文件，留给之后的prune删除
+        return
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    func(path)
+    pass
+
+
+def default_cache():
+    """默认的缓存在当前工作目录，也就是ninja运行action的root_build_dir中的.extract_cache，
+    可以通过环境变量指定其他路径，在多个输出目录之间共享；环境变量设置为空字符串的时候返回None
+    """
+    root = os.environ.get(EXTRACT_CACHE_ENV, os.path.join(os.getcwd(), EXTRACT_CACHE_NAME))
+    if not root:
+        return None
+    return ExtractCache(root)
+
+
+def extract_all(zip_path, output_dir):
+    """有缓存的时候通过缓存解压，否则直接解压
+    """
+    cache = default_cache()
+    if cache is None:
+        build_utils.extract_all(zip_path, base_dir=output_dir)
+        return
+    cache.extract(zip_path, output_dir)
+    pass
@@ -0,0 +1,143 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import stat
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from util import build_utils
+from util import digest_cache
+from util import extract_cache
+
+# 测试不使用工作目录中的摘要缓存
+os.environ[digest_cache.DIGEST_CACHE_ENV] = ""
+
+
+class ExtractCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        self.zip_path = os.path.join(self.base_dir, "res.zip")
+        with zipfile.ZipFile(self.zip_path, mode="w") as zip_file:
+            zip_file.writestr("values/strings.xml", "<resources/>")
+            zip_file.writestr("drawable/icon.png", b"png")
+        self.cache = extract_cache.ExtractCache(os.path.join(self.base_dir, "cache"))
+        pass
+
+    def tearDown(self):
+        for root, dirs, files in os.walk(self.base_dir):
+            os.chmod(root, stat.S_IRWXU)
+            for name in files:
+                os.chmod(os.path.join(root, name), stat.S_IRUSR | stat.S_IWUSR)
+        self._temp_dir.cleanup()
+        pass
+
+    def _mode(self, path):
+        return stat.S_IMODE(os.stat(path).st_mode)
+
+    def test_extract(self):
+        output_dir = os.path.join(self.base_dir, "out")
+        self.cache.extract(self.zip_path, output_dir)
+        path = os.path.join(output_dir, "values", "strings.xml")
+        with open(path, mode="r", encoding="utf-8") as fp:
+            self.assertEqual(fp.read(), "<resources/>")
+        self.assertEqual(self._mode(path) & stat.S_IWUSR, 0)
+        pass
+
+    def test_remove_keeps_links_read_only(self):
+        output_dir = os.path.join(self.base_dir, "out")
+        self.cache.extract(self.zip_path, output_dir)
+        path = os.path.join(output_dir, "values", "strings.xml")
+        cached_path = None
+        for root, _, files in os.walk(self.cache.root()):
+            if "strings.xml" in files:
+                cached_path = os.path.join(root, "strings.xml")
+        self.assertTrue(os.path.samefile(cached_path, path))
+
+        # 删除缓存中的文件不能修改工作目录中文件的权限
+        extract_cache._remove_read_only(os.remove, cached_path, None)
+        self.assertFalse(os.path.exists(cached_path))
+        self.assertEqual(self._mode(path) & stat.S_IWUSR, 0)
+        pass
+
+    def test_remove_failure_leaves_shared_file(self):
+        output_dir = os.path.join(self.base_dir, "out")
+        self.cache.extract(self.zip_path, output_dir)
+        path = os.path.join(output_dir, "drawable", "icon.png")
+        link_path = os.path.join(self.base_dir, "icon.png")
+        os.link(path, link_path)
+
+        def remove(_):
+            # 模拟不能删除只读文件的文件系统
+            raise PermissionError()
+
+        extract_cache._remove_read_only(remove, link_path, None)
+        self.assertTrue(os.path.exists(link_path))
+        self.assertEqual(self._mode(path) & stat.S_IWUSR, 0)
+        pass
+
+    def _cached_path(self, name):
+        for root, _, files in os.walk(self.cache.root()):
+            if name in files:
+                return os.path.join(root, name)
+        return None
+
+    def test_remove_subtree_keeps_cache_read_only(self):
+        output_dir = os.path.join(self.base_dir, "out")
+        self.cache.extract(self.zip_path, output_dir)
+        values_dir = os.path.join(output_dir, "values")
+        os.chmod(values_dir, stat.S_IRUSR | stat.S_IXUSR)
+        build_utils.remove_subtree(output_dir)
+        self.assertEqual(os.listdir(output_dir), [])
+        cached_path = self._cached_path("strings.xml")
+        self.assertEqual(self._mode(cached_path) & stat.S_IWUSR, 0)
+        pass
+
+    def test_remove_subtree_does_not_chmod_links(self):
+        output_dir = os.path.join(self.base_dir, "out")
+        self.cache.extract(self.zip_path, output_dir)
+        remove = os.remove
+
+        def remove_writable(path, **kwargs):
+            # 模拟Windows，不能删除只读文件
+            if not os.stat(path, **kwargs).st_mode & stat.S_IWUSR:
+                raise PermissionError(path)
+            remove(path, **kwargs)
+            pass
+
+        with mock.patch.object(os, "remove", side_effect=remove_writable), \
+                mock.patch.object(os, "unlink", side_effect=remove_writable):
+            with self.assertRaises(PermissionError):
+                build_utils.remove_subtree(output_dir)
+        self.assertEqual(self._mode(self._cached_path("strings.xml")) & stat.S_IWUSR, 0)
+        pass
+
+    def test_copy_without_read_only_links(self):
+        output_dir = os.path.join(self.base_dir, "out")
+        with mock.patch.object(build_utils, "CAN_LINK_READ_ONLY", False):
+            self.cache.extract(self.zip_path, output_dir)
+        path = os.path.join(output_dir, "values", "strings.xml")
+        self.assertFalse(os.path.samefile(self._cached_path("strings.xml"), path))
+        self.assertNotEqual(self._mode(path) & stat.S_IWUSR, 0)
+        build_utils.remove_subtree(output_dir)
+        self.assertEqual(os.listdir(output_dir), [])
+        pass
+
+    def test_prune(self):
+        output_dir = os.path.join(self.base_dir, "out")
+        self.cache.extract(self.zip_path, output_dir)
+        self.assertEqual(self.cache.prune(max_age=-1), 1)
+        path = os.path.join(output_dir, "values", "strings.xml")
+        self.assertEqual(self._mode(path) & stat.S_IWUSR, 0)
+        with open(path, mode="r", encoding="utf-8") as fp:
+            self.assertEqual(fp.read(), "<resources/>")
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
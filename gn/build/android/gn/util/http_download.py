@@ -0,0 +1,381 @@
+# -*- encoding: utf-8 -*-
+
+import contextlib
+import hashlib
+import http.client
+import json
+import os
+import re
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 读取的缓冲区从MIN_BUFFER_SIZE开始逐步加倍
+MIN_BUFFER_SIZE = 64 * 1024
+MAX_BUFFER_SIZE = 1024 * 1024
+# 第一个请求获取的大小，同时用来判断服务器是否支持Range
+FIRST_SEGMENT_SIZE = 1024 * 1024
+# 超过这个大小的文件分段并发下载
+PARALLEL_THRESHOLD = 8 * 1024 * 1024
+MIN_SEGMENT_SIZE = 2 * 1024 * 1024
+DEFAULT_CONNECTIONS = 4
+DEFAULT_RETRIES = 3
+# 每下载这么多数据记录一次进度，进程被杀掉之后也可以续传
+STATE_SAVE_INTERVAL = 4 * 1024 * 1024
+
+_CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+# 网络错误可以从已经下载的位置重试，HTTPError不重试
+_RETRY_ERRORS = (ConnectionError, TimeoutError, http.client.HTTPException)
+
+
+class _ResourceChanged(Exception):
+    """服务器上的文件发生变化或者不再支持Range，需要重新下载"""
+    pass
+
+
+class PartialState:
+    """记录.part文件中已经下载完成的区间，保存在.part.json中
+    """
+
+    def __init__(self, url, validator=None, size=None):
+        self.url = url
+        # ETag或者Last-Modified，用于If-Range
+        self.validator = validator
+        self.size = size
+        self._done = []
+        pass
+
+    @classmethod
+    def from_file(cls, fp):
+        obj = json.load(fp)
+        ret = cls(obj["url"], obj["validator"], obj["size"])
+        ret._done = [tuple(x) for x in obj["done"]]
+        return ret
+
+    def to_file(self, fp):
+        obj = {
+            "url": self.url,
+            "validator": self.validator,
+            "size": self.size,
+            "done": self._done,
+        }
+        json.dump(obj, fp=fp, indent=2)
+        pass
+
+    def add_done(self, start, end):
+        """合并已经完成的区间[start, end)
+        """
+        merged = []
+        for done_start, done_end in sorted(self._done + [(start, end)]):
+            if merged and done_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], done_end))
+            else:
+                merged.append((done_start, done_end))
+        self._done = merged
+        pass
+
+    def missing(self):
+        """还没有下载的区间
+        """
+        ret = []
+        offset = 0
+        for start, end in self._done:
+            if start > offset:
+                ret.append((offset, start))
+            offset = max(offset, end)
+        if offset < self.size:
+            ret.append((offset, self.size))
+        return ret
+
+    pass
+
+
+def _state_path(part_path):
+    return part_path + ".json"
+
+
+@contextlib.contextmanager
+def locked_part(path):
+    """独占path对应的.part文件，同时下载同一个文件的其他进程或者线程等待
+    :return: .part文件的路径
+
+    没有fcntl的系统上使用进程和线程独有的.part文件，不能续传。
+    """
+    if fcntl is None:
+        part_path = "%s.%d.%d.part" % (path, os.getpid(), threading.get_ident())
+        try:
+            yield part_path
+        finally:
+            remove_partial(part_path)
+        return
+
+    lock_path = path + ".part.lock"
+    while True:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # 等待的时候锁文件可能已经被删除
+            if _same_file(fd, lock_path):
+                break
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+    try:
+        yield path + ".part"
+    finally:
+        os.remove(lock_path)
+        os.close(fd)
+    pass
+
+
+def _same_file(fd, path):
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def remove_partial(part_path):
+    """删除没有完成的下载
+    """
+    for path in (part_path, _state_path(part_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    pass
+
+
+def _read_state(part_path, url):
+    state_path = _state_path(part_path)
+    if not os.path.exists(part_path) or not os.path.exists(state_path):
+        return None
+    with open(state_path, mode="r", encoding="utf-8") as fp:
+        try:
+            state = PartialState.from_file(fp)
+        except (ValueError, KeyError, TypeError):
+            return None
+    if state.url != url or state.size is None:
+        return None
+    return state
+
+
+def _response_validator(response):
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+class RangedDownload:
+    """支持断点续传以及分段并发的下载
+
+    服务器支持Range的时候，已经完成的区间记录在.part.json中，失败之后再次下载时只获取缺少的部分，
+    大文件按照区间并发获取；不支持Range的时候顺序下载整个文件。
+    """
+
+    def __init__(self, opener, url, part_path, headers=None, digest=None,
+                 connections=DEFAULT_CONNECTIONS,
+                 parallel_threshold=PARALLEL_THRESHOLD,
+                 retries=DEFAULT_RETRIES):
+        self._opener = opener
+        self._url = url
+        self._part_path = part_path
+        self._headers = dict(headers or {})
+        self._digest = digest
+        self._connections = max(1, connections)
+        self._parallel_threshold = parallel_threshold
+        self._retries = retries
+        self._lock = threading.Lock()
+        self._digest_obj = None
+        self._hashed_size = 0
+        self.request_count = 0
+        pass
+
+    def _open(self, headers):
+        request = urllib.request.Request(self._url, headers=dict(self._headers, **headers))
+        with self._lock:
+            self.request_count += 1
+        return self._opener.open(request)
+
+    def _on_data(self, offset, data):
+        """按顺序到达的数据直接计算摘要，其他的数据在最后从文件中读取
+        """
+        if self._digest_obj is not None:
+            with self._lock:
+                if offset == self._hashed_size:
+                    self._digest_obj.update(data)
+                    self._hashed_size += len(data)
+        pass
+
+    def _copy(self, response, fp, offset, state=None, end=None):
+        buffer_size = MIN_BUFFER_SIZE
+        unsaved_size = 0
+        while end is None or offset < end:
+            size = buffer_size if end is None else min(buffer_size, end - offset)
+            data = response.read(size)
+            if not data:
+                break
+            fp.write(data)
+            self._on_data(offset, data)
+            if state:
+                with self._lock:
+                    state.add_done(offset, offset + len(data))
+                unsaved_size += len(data)
+                if unsaved_size >= STATE_SAVE_INTERVAL:
+                    fp.flush()
+                    self._save_state(state)
+                    unsaved_size = 0
+            offset += len(data)
+            buffer_size = min(buffer_size * 2, MAX_BUFFER_SIZE)
+        return offset
+
+    def _save_state(self, state):
+        with self._lock:
+            state_path = _state_path(self._part_path)
+            with open(state_path + ".tmp", mode="w", encoding="utf-8") as fp:
+                state.to_file(fp)
+            os.replace(state_path + ".tmp", state_path)
+        pass
+
+    def _probe(self):
+        """获取第一段，同时得到文件大小以及服务器是否支持Range
+        :return: PartialState，服务器不支持Range的时候已经下载了整个文件，返回None
+        """
+        try:
+            response = self._open({"Range": "bytes=0-%d" % (FIRST_SEGMENT_SIZE - 1)})
+        except HTTPError as e:
+            if e.code != 416:
+                raise
+            # 空文件
+            response = self._open({})
+
+        with response:
+            match = None
+            if response.code == 206:
+                match = _CONTENT_RANGE_PATTERN.match(response.headers.get("Content-Range", ""))
+            if not match or match.group(3) == "*" or int(match.group(1)) != 0:
+                with open(self._part_path, mode="wb") as fp:
+                    self._copy(response, fp, 0)
+                return None
+
+            state = PartialState(self._url, _response_validator(response), int(match.group(3)))
+            with open(self._part_path, mode="wb") as fp:
+                self._copy(response, fp, 0, state, end=int(match.group(2)) + 1)
+        self._save_state(state)
+        return state
+
+    def _fetch_range(self, state, start, end):
+        headers = {}
+        if state.validator:
+            headers["If-Range"] = state.validator
+
+        failures = 0
+        while start < end:
+            headers["Range"] = "bytes=%d-%d" % (start, end - 1)
+            last_start = start
+            try:
+                with self._open(headers) as response:
+                    match = None
+                    if response.code == 206:
+                        match = _CONTENT_RANGE_PATTERN.match(response.headers.get("Content-Range", ""))
+                    if not match or int(match.group(1)) != start:
+                        raise _ResourceChanged()
+                    with open(self._part_path, mode="r+b") as fp:
+                        fp.seek(start)
+                        start = self._copy(response, fp, start, state, end)
+            except _RETRY_ERRORS:
+                if start == last_start:
+                    failures += 1
+                if failures > self._retries:
+                    raise
+                continue
+            if start == last_start:
+                # 服务器返回了空的内容，不能一直重试
+                failures += 1
+                if failures > self._retries:
+                    raise Exception("No data received for %s, bytes=%d-%d" % (self._url, start, end - 1))
+        pass
+
+    def _fetch_missing(self, state):
+        ranges = state.missing()
+        total = sum(end - start for start, end in ranges)
+        if not total:
+            return
+        if state.size < self._parallel_threshold or self._connections == 1:
+            for start, end in ranges:
+                self._fetch_range(state, start, end)
+            return
+
+        segment_size = max(MIN_SEGMENT_SIZE, -(-total // self._connections))
+        segments = []
+        for start, end in ranges:
+            for segment_start in range(start, end, segment_size):
+                segments.append((segment_start, min(end, segment_start + segment_size)))
+        with ThreadPoolExecutor(max_workers=self._connections) as executor:
+            futures = [executor.submit(self._fetch_range, state, start, end) for start, end in segments]
+            for future in futures:
+                future.result()
+        pass
+
+    def _run(self):
+        self._digest_obj = hashlib.new(self._digest) if self._digest else None
+        self._hashed_size = 0
+
+        state = _read_state(self._part_path, self._url)
+        if state is None:
+            remove_partial(self._part_path)
+            state = self._probe()
+            if state is None:
+                return
+        try:
+            self._fetch_missing(state)
+        finally:
+            self._save_state(state)
+
+        with open(self._part_path, mode="r+b") as fp:
+            fp.truncate(state.size)
+        pass
+
+    def run(self):
+        """下载到part_path
+        :return: 摘要的十六进制字符串，没有指定digest的时候返回None
+        """
+        for _ in range(2):
+            try:
+                self._run()
+                break
+            except _ResourceChanged:
+                # 文件已经变化，丢弃已经下载的部分
+                remove_partial(self._part_path)
+        else:
+            raise Exception("%s keeps changing during download" % self._url)
+
+        state_path = _state_path(self._part_path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+        if self._digest_obj is None:
+            return None
+        with open(self._part_path, mode="rb") as fp:
+            fp.seek(self._hashed_size)
+            while True:
+                data = fp.read(MAX_BUFFER_SIZE)
+                if not data:
+                    break
+                self._digest_obj.update(data)
+        return self._digest_obj.hexdigest()
+
+    pass
+
+
+def download(opener, url, part_path, headers=None, digest=None, **kwargs):
+    """下载url到part_path，opener可以是OpenerDirector或者HttpConnectionPool
+    :return: digest指定的摘要
+    """
+    return RangedDownload(opener, url, part_path, headers=headers, digest=digest, **kwargs).run()
@@ -0,0 +1,188 @@
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from util import http_download
+from util.http_pool import HttpConnectionPool
+from util.http_test_server import HttpTestServer
+
+_SIZE = 3 * 1024 * 1024 + 123
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def _content(seed):
+    return hashlib.sha256(seed).digest() * (_SIZE // 32) + b"x" * (_SIZE % 32)
+
+
+class RangedDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.part_path = os.path.join(self._temp_dir.name, "file.bin.part")
+        self.data = _content(b"first")
+        self.server = HttpTestServer({"/file.bin": self.data}).__enter__()
+        self.url = self.server.url("/file.bin")
+        self.pool = HttpConnectionPool()
+        pass
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.__exit__(None, None, None)
+        self._temp_dir.cleanup()
+        pass
+
+    def _download(self, **kwargs):
+        return http_download.download(self.pool, self.url, self.part_path, digest="md5", **kwargs)
+
+    def _read_part(self):
+        with open(self.part_path, mode="rb") as fp:
+            return fp.read()
+
+    def _interrupted_download(self, size):
+        """收到size字节之后中断，模拟被杀掉的进程"""
+        received = [0]
+        on_data = http_download.RangedDownload._on_data
+
+        def interrupt(download, offset, data):
+            received[0] += len(data)
+            if received[0] > size:
+                raise _Interrupted()
+            on_data(download, offset, data)
+            pass
+
+        with mock.patch.object(http_download.RangedDownload, "_on_data", interrupt):
+            with self.assertRaises(_Interrupted):
+                self._download()
+        self.assertTrue(os.path.exists(self.part_path + ".json"))
+        pass
+
+    def _range_starts(self):
+        starts = []
+        for _, _, headers in self.server.requests_of("/file.bin", "GET"):
+            if headers.get("Range"):
+                starts.append(int(headers["Range"][len("bytes="):].split("-")[0]))
+        return starts
+
+    def test_download(self):
+        self.assertEqual(self._download(), hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self._read_part(), self.data)
+        self.assertFalse(os.path.exists(self.part_path + ".json"))
+        pass
+
+    def test_parallel_download(self):
+        self.assertEqual(self._download(parallel_threshold=1024 * 1024, connections=3),
+                         hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self._read_part(), self.data)
+        pass
+
+    def test_resume_after_interruption(self):
+        self._interrupted_download(2 * 1024 * 1024)
+        self.server.requests.clear()
+
+        self.assertEqual(self._download(), hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self._read_part(), self.data)
+        # 只获取缺少的部分
+        self.assertNotIn(0, self._range_starts())
+        self.assertGreaterEqual(min(self._range_starts()), 1024 * 1024)
+        pass
+
+    def test_if_range_mismatch(self):
+        self._interrupted_download(2 * 1024 * 1024)
+        old_etag = self.server.etag("/file.bin")
+        self.server.files["/file.bin"] = new_data = _content(b"second")
+        self.server.requests.clear()
+
+        self.assertEqual(self._download(), hashlib.md5(new_data).hexdigest())
+        self.assertEqual(self._read_part(), new_data)
+        # urllib会把请求头的名称转换成If-range
+        if_ranges = [{k.lower(): v for k, v in x[2].items()}.get("if-range")
+                     for x in self.server.requests_of("/file.bin", "GET")]
+        self.assertEqual(if_ranges[0], old_etag)
+        # 文件变化之后从头开始下载
+        self.assertIn(0, self._range_starts())
+        pass
+
+    def test_empty_partial_response(self):
+        self.server.empty_ranges.add("/file.bin")
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self._run_empty()), daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), "download never finishes")
+        self.assertIn("No data received", result[0])
+        pass
+
+    def _run_empty(self):
+        try:
+            self._download(retries=2)
+        except Exception as e:
+            return str(e)
+        return "finished"
+
+    def test_dropped_connection_retried(self):
+        self.server.drop_after("/file.bin", 1000, count=2)
+        self.assertEqual(self._download(), hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self._read_part(), self.data)
+        pass
+
+    pass
+
+
+class LockedPartTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._temp_dir.name, "file.bin")
+        pass
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        pass
+
+    def test_exclusive(self):
+        events = []
+        entered = threading.Event()
+        release = threading.Event()
+
+        def first():
+            with http_download.locked_part(self.path) as part_path:
+                events.append(("first", part_path))
+                entered.set()
+                release.wait(10)
+                events.append(("first done", part_path))
+            pass
+
+        def second():
+            entered.wait(10)
+            with http_download.locked_part(self.path) as part_path:
+                events.append(("second", part_path))
+            pass
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        entered.wait(10)
+        # 第二个线程在等待锁
+        threads[1].join(0.2)
+        self.assertTrue(threads[1].is_alive())
+        release.set()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual([x[0] for x in events], ["first", "first done", "second"])
+        self.assertEqual(set(x[1] for x in events), {self.path + ".part"})
+        self.assertFalse(os.path.exists(self.path + ".part.lock"))
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -0,0 +1,251 @@
+# -*- encoding: utf-8 -*-
+
+import http.client
+import threading
+import urllib.parse
+import urllib.request
+from urllib.error import HTTPError
+from urllib.error import URLError
+
+# 每个服务器最多保留的空闲连接数
+DEFAULT_MAX_IDLE_PER_HOST = 8
+DEFAULT_TIMEOUT = 60
+
+# 关闭response时剩余内容小于这个大小就读完，让连接可以复用
+_MAX_DRAIN_SIZE = 64 * 1024
+_MAX_REDIRECTS = 10
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+# 代理地址没有端口时使用的默认端口
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+# 复用的连接可能已经被服务器关闭，这些异常出现时换一个新连接重试
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                            http.client.BadStatusLine,
+                            ConnectionResetError,
+                            BrokenPipeError)
+
+
+class PooledResponse:
+    """读取完成后把连接还给连接池的response
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.code = response.status
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        pass
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def read(self, amt=None):
+        try:
+            data = self._response.read(amt)
+        except BaseException:
+            self.close()
+            raise
+        if self._response.isclosed():
+            # 内容已经读完，不需要等到close就把连接还给连接池
+            self.close()
+        return data
+
+    def _drain(self):
+        """读完剩余的少量内容，让连接可以复用"""
+        length = self._response.length
+        if length is not None and length > _MAX_DRAIN_SIZE:
+            return
+        drained = 0
+        while not self._response.isclosed() and drained <= _MAX_DRAIN_SIZE:
+            data = self._response.read(_MAX_DRAIN_SIZE)
+            if not data:
+                break
+            drained += len(data)
+        pass
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            if not self._response.isclosed():
+                # HEAD请求或者没有读完的内容
+                self._drain()
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            if self._response.isclosed() and not self._response.will_close:
+                # 内容已经读完，连接可以继续使用
+                self._pool.release(self._key, conn)
+            else:
+                self._response.close()
+                conn.close()
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        pass
+
+    pass
+
+
+class HttpConnectionPool:
+    """按照(scheme, host, port)保持长连接的HTTP客户端
+
+    open的用法和OpenerDirector.open一样，状态码大于等于400的时候抛出HTTPError，
+    并且自动处理重定向。
+    """
+
+    def __init__(self, max_idle_per_host=DEFAULT_MAX_IDLE_PER_HOST, timeout=DEFAULT_TIMEOUT):
+        self._max_idle_per_host = max_idle_per_host
+        self._timeout = timeout
+        self._proxies = urllib.request.getproxies()
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._request_count = 0
+        self._connection_count = 0
+        pass
+
+    def _proxy_for(self, parts):
+        proxy = self._proxies.get(parts.scheme)
+        if not proxy or urllib.request.proxy_bypass(parts.hostname):
+            return None
+        return urllib.parse.urlsplit(proxy if "://" in proxy else "http://" + proxy)
+
+    def _new_connection(self, parts):
+        proxy = self._proxy_for(parts)
+        proxy_port = None
+        if proxy:
+            proxy_port = proxy.port or _DEFAULT_PORTS.get(proxy.scheme, 80)
+        if parts.scheme == "https":
+            if proxy:
+                conn = http.client.HTTPSConnection(proxy.hostname, proxy_port, timeout=self._timeout)
+                conn.set_tunnel(parts.hostname, parts.port or 443)
+            else:
+                conn = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=self._timeout)
+        elif parts.scheme == "http":
+            if proxy:
+                conn = http.client.HTTPConnection(proxy.hostname, proxy_port, timeout=self._timeout)
+            else:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=self._timeout)
+        else:
+            raise URLError("unknown url type: %s" % parts.scheme)
+        with self._lock:
+            self._connection_count += 1
+        return conn
+
+    def _acquire(self, key):
+        with self._lock:
+            idle_list = self._idle.get(key)
+            if idle_list:
+                return idle_list.pop()
+        return None
+
+    def release(self, key, conn):
+        """把空闲的连接放回连接池
+        """
+        with self._lock:
+            idle_list = self._idle.setdefault(key, [])
+            if len(idle_list) < self._max_idle_per_host:
+                idle_list.append(conn)
+                return
+        conn.close()
+        pass
+
+    def _request_path(self, parts, url):
+        if parts.scheme == "http" and self._proxy_for(parts):
+            # 通过代理访问http的时候需要发送完整的url
+            return url
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        return path
+
+    def _send(self, method, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = self._request_path(parts, url)
+        with self._lock:
+            self._request_count += 1
+
+        conn = self._acquire(key)
+        while True:
+            reused = conn is not None
+            if not reused:
+                conn = self._new_connection(parts)
+            try:
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+                return PooledResponse(self, key, conn, response, url)
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                conn = None
+            except Exception:
+                conn.close()
+                raise
+
+    def open(self, request, timeout=None):
+        """发送请求，request可以是url或者urllib.request.Request
+        """
+        if isinstance(request, str):
+            request = urllib.request.Request(request)
+        method = request.get_method()
+        url = request.full_url
+        headers = dict(request.header_items())
+
+        for _ in range(_MAX_REDIRECTS + 1):
+            response = self._send(method, url, headers)
+            if response.code in _REDIRECT_CODES and "location" in response.headers:
+                response.close()
+                url = urllib.parse.urljoin(url, response.headers["location"])
+                if response.code == 303:
+                    method = "GET"
+                continue
+            if response.code >= 400:
+                response.close()
+                raise HTTPError(url, response.code, response.reason, response.headers, None)
+            return response
+        raise HTTPError(url, response.code, "too many redirects", response.headers, None)
+
+    def stats(self):
+        """:return: (请求数, 建立的连接数)
+        """
+        with self._lock:
+            return self._request_count, self._connection_count
+
+    def reuse_rate(self):
+        """请求中复用已有连接的比例
+        """
+        request_count, connection_count = self.stats()
+        if not request_count:
+            return 0.0
+        return max(0.0, 1.0 - connection_count / request_count)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for idle_list in idle.values():
+            for conn in idle_list:
+                conn.close()
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        pass
+
+    pass
@@ -0,0 +1,110 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+import urllib.parse
+import urllib.request
+from unittest import mock
+from urllib.error import HTTPError
+
+from util.http_pool import HttpConnectionPool
+from util.http_test_server import HttpTestServer
+
+_SMALL = b"small" * 100
+_LARGE = b"large" * 100000
+
+
+class HttpConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HttpTestServer({"/small": _SMALL, "/large": _LARGE}).__enter__()
+        self.server.redirects["/moved"] = "/small"
+        self.pool = HttpConnectionPool()
+        pass
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.__exit__(None, None, None)
+        pass
+
+    def _connections(self):
+        return self.pool.stats()[1]
+
+    def test_reuse_connection(self):
+        for _ in range(3):
+            with self.pool.open(self.server.url("/small")) as response:
+                self.assertEqual(response.read(), _SMALL)
+        with self.pool.open(urllib.request.Request(self.server.url("/small"), method="HEAD")) as response:
+            self.assertEqual(response.code, 200)
+        with self.pool.open(self.server.url("/large")) as response:
+            self.assertEqual(response.read(), _LARGE)
+        self.assertEqual(self.pool.stats(), (5, 1))
+        pass
+
+    def test_close_on_exit(self):
+        with self.pool as pool:
+            with pool.open(self.server.url("/small")) as response:
+                self.assertEqual(response.read(), _SMALL)
+        # 退出之后空闲的连接已经关闭，新的请求需要新的连接
+        with self.pool.open(self.server.url("/small")) as response:
+            self.assertEqual(response.read(), _SMALL)
+        self.assertEqual(self._connections(), 2)
+        pass
+
+    def test_read_without_close(self):
+        # 读完之后没有close，连接也会还给连接池
+        response = self.pool.open(self.server.url("/large"))
+        data = b""
+        while True:
+            chunk = response.read(64 * 1024)
+            if not chunk:
+                break
+            data += chunk
+        self.assertEqual(data, _LARGE)
+        with self.pool.open(self.server.url("/small")) as response:
+            response.read()
+        self.assertEqual(self._connections(), 1)
+        pass
+
+    def test_close_without_read(self):
+        # 没有读取的小文件在close的时候读完，连接可以复用
+        self.pool.open(self.server.url("/small")).close()
+        with self.pool.open(self.server.url("/small")) as response:
+            self.assertEqual(response.read(), _SMALL)
+        self.assertEqual(self._connections(), 1)
+
+        # 没有读完的大文件关闭连接
+        with self.pool.open(self.server.url("/large")) as response:
+            response.read(10)
+        with self.pool.open(self.server.url("/small")) as response:
+            response.read()
+        self.assertEqual(self._connections(), 2)
+        pass
+
+    def test_errors_and_redirects(self):
+        with self.assertRaises(HTTPError) as context:
+            self.pool.open(self.server.url("/missing"))
+        self.assertEqual(context.exception.code, 404)
+        with self.pool.open(self.server.url("/moved")) as response:
+            self.assertEqual(response.read(), _SMALL)
+            self.assertEqual(response.geturl(), self.server.url("/small"))
+        self.assertEqual(self._connections(), 1)
+        pass
+
+    def test_proxy_default_port(self):
+        target = urllib.parse.urlsplit("https://repo.example.com/maven2/")
+        for proxy, port in (("https://proxy.example.com", 443),
+                            ("http://proxy.example.com", 80),
+                            ("proxy.example.com", 80),
+                            ("https://proxy.example.com:8443", 8443)):
+            with mock.patch.object(self.pool, "_proxies", {"https": proxy}), \
+                    mock.patch("urllib.request.proxy_bypass", return_value=False):
+                conn = self.pool._new_connection(target)
+            self.assertEqual((conn.host, conn.port), ("proxy.example.com", port), proxy)
+            conn.close()
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -0,0 +1,157 @@
+# -*- encoding: utf-8 -*-
+
+"""测试使用的本地HTTP服务器，内容保存在内存中
+
+支持Range、If-Range、ETag以及HEAD请求，记录所有请求，可以模拟中断的连接和空的206响应。
+"""
+
+import hashlib
+import re
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+_RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle(head=True)
+        pass
+
+    def do_GET(self):
+        self._handle(head=False)
+        pass
+
+    def _send_empty(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        pass
+
+    def _handle(self, head):
+        server = self.server
+        path = self.path.split("?")[0]
+        server.record(self.command, path, dict(self.headers))
+        if server.delay:
+            server.delay(path)
+
+        location = server.redirects.get(path)
+        if location:
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = server.files.get(path)
+        if data is None:
+            self._send_empty(404)
+            return
+
+        etag = server.etag(path)
+        start, end = 0, len(data)
+        partial = False
+        match = _RANGE_PATTERN.match(self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and server.ranges and (not if_range or if_range == etag):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(end, int(match.group(2)) + 1)
+            if start >= len(data):
+                self._send_empty(416)
+                return
+            partial = True
+
+        body = data[start:end]
+        if partial and path in server.empty_ranges:
+            body = b""
+        self.send_response(206 if partial else 200)
+        if partial:
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, len(data)))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if head:
+            return
+
+        limit = server.take_drop(path)
+        if limit is not None and limit < len(body):
+            # 只发送一部分内容然后断开连接
+            self.wfile.write(body[:limit])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+        pass
+
+    pass
+
+
+class HttpTestServer(ThreadingHTTPServer):
+    """@param files: {请求路径: 内容}
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files=None, ranges=True):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.files = dict(files or {})
+        self.ranges = ranges
+        # {请求路径: 重定向的地址}
+        self.redirects = {}
+        # 返回空内容的206响应的路径
+        self.empty_ranges = set()
+        # delay(path)在处理请求之前调用
+        self.delay = None
+        self.requests = []
+        self._drops = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        pass
+
+    def url(self, path=""):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+    def etag(self, path):
+        return '"%s"' % hashlib.md5(self.files[path]).hexdigest()
+
+    def record(self, method, path, headers):
+        with self._lock:
+            self.requests.append((method, path, headers))
+        pass
+
+    def requests_of(self, path, method=None):
+        with self._lock:
+            return [x for x in self.requests if x[1] == path and (method is None or x[0] == method)]
+
+    def drop_after(self, path, size, count=1):
+        """接下来count个请求只发送size字节就断开连接"""
+        with self._lock:
+            self._drops[path] = [size] * count
+        pass
+
+    def take_drop(self, path):
+        with self._lock:
+            drops = self._drops.get(path)
+            return drops.pop() if drops else None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+        pass
+
+    pass
@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+
+import contextlib
+import os
+import re
+import select
+import threading
+
+# 没有jobserver的时候最多同时执行的任务数，没有设置的时候为1，不和ninja抢CPU
+JOBS_ENV = "ANDROID_BUILD_JOBS"
+
+_JOBSERVER_PATTERN = re.compile(r"--jobserver-(?:auth|fds)=(\S+)")
+# 进程本身拥有的令牌，不需要从jobserver读取
+_IMPLICIT_TOKEN = object()
+
+
+class JobServer:
+    """GNU make jobserver风格的并发限制
+
+    MAKEFLAGS中有--jobserver-auth的时候，除了进程本身拥有的一个隐含令牌，
+    每个并发的任务都要从jobserver的管道中读取一个令牌，完成之后写回；
+    最多同时执行max_jobs个任务，没有指定的时候有jobserver为CPU个数，否则为default_jobs()。
+    """
+
+    def __init__(self, max_jobs=None, makeflags=None):
+        self._lock = threading.Lock()
+        self._implicit_free = True
+        self._read_fd = None
+        self._write_fd = None
+        self._open_jobserver(os.environ.get("MAKEFLAGS", "") if makeflags is None else makeflags)
+        if not max_jobs:
+            max_jobs = (os.cpu_count() or 1) if self.has_jobserver() else default_jobs()
+        self._max_jobs = max(1, max_jobs)
+        self._semaphore = threading.BoundedSemaphore(self._max_jobs)
+        pass
+
+    def _open_jobserver(self, makeflags):
+        match = None
+        for match in _JOBSERVER_PATTERN.finditer(makeflags):
+            pass
+        if not match:
+            return
+        auth = match.group(1)
+        try:
+            if auth.startswith("fifo:"):
+                fd = os.open(auth[len("fifo:"):], os.O_RDWR)
+                self._read_fd = self._write_fd = fd
+            else:
+                read_fd, write_fd = (int(x) for x in auth.split(","))
+                # make没有把管道传给子进程的时候fd无效
+                os.fstat(read_fd)
+                os.fstat(write_fd)
+                self._read_fd, self._write_fd = read_fd, write_fd
+        except (OSError, ValueError):
+            self._read_fd = self._write_fd = None
+        pass
+
+    def has_jobserver(self):
+        return self._read_fd is not None
+
+    def max_jobs(self):
+        return self._max_jobs
+
+    def _acquire(self):
+        """:return: 没有jobserver的时候返回None"""
+        self._semaphore.acquire()
+        if self._read_fd is None:
+            return None
+        with self._lock:
+            if self._implicit_free:
+                self._implicit_free = False
+                return _IMPLICIT_TOKEN
+        try:
+            while True:
+                try:
+                    return os.read(self._read_fd, 1)
+                except BlockingIOError:
+                    # make可能把管道设置为非阻塞
+                    select.select([self._read_fd], [], [])
+        except OSError:
+            self._semaphore.release()
+            raise
+
+    def _release(self, token):
+        if token is _IMPLICIT_TOKEN:
+            with self._lock:
+                self._implicit_free = True
+        elif token:
+            # 令牌必须原样写回
+            os.write(self._write_fd, token)
+        self._semaphore.release()
+        pass
+
+    @contextlib.contextmanager
+    def slot(self):
+        """在一个令牌的范围内执行任务"""
+        token = self._acquire()
+        try:
+            yield
+        finally:
+            self._release(token)
+        pass
+
+    pass
+
+
+def default_jobs():
+    """没有jobserver的时候ninja已经在并发执行其他action，默认只执行一个任务"""
+    if os.environ.get(JOBS_ENV):
+        return max(1, int(os.environ[JOBS_ENV]))
+    return 1
@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from util import job_server
+
+
+class JobServerTest(unittest.TestCase):
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        pass
+
+    def tearDown(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        pass
+
+    def _pending(self):
+        """读出管道中剩下的令牌"""
+        os.set_blocking(self.read_fd, False)
+        try:
+            return os.read(self.read_fd, 1024)
+        except BlockingIOError:
+            return b""
+        finally:
+            os.set_blocking(self.read_fd, True)
+
+    def _makeflags(self, option="auth"):
+        return " -j4 --jobserver-%s=%d,%d" % (option, self.read_fd, self.write_fd)
+
+    def test_implicit_token(self):
+        jobs = job_server.JobServer(4, makeflags=self._makeflags())
+        self.assertTrue(jobs.has_jobserver())
+        os.write(self.write_fd, b"+")
+        # 第一个任务使用隐含令牌，不读取管道
+        with jobs.slot():
+            self.assertEqual(self._pending(), b"+")
+        with jobs.slot():
+            pass
+        self.assertEqual(self._pending(), b"")
+        pass
+
+    def test_token_written_back(self):
+        jobs = job_server.JobServer(4, makeflags=self._makeflags())
+        os.write(self.write_fd, b"ab")
+        started = threading.Event()
+
+        def worker():
+            with jobs.slot():
+                started.set()
+            pass
+
+        with jobs.slot():
+            with jobs.slot():
+                with jobs.slot():
+                    self.assertEqual(self._pending(), b"")
+                    # 管道中没有令牌的时候阻塞
+                    thread = threading.Thread(target=worker)
+                    thread.start()
+                    self.assertFalse(started.wait(0.2))
+                thread.join()
+                self.assertTrue(started.is_set())
+        # 读出的令牌原样写回
+        self.assertEqual(sorted(self._pending()), sorted(b"ab"))
+        pass
+
+    def test_jobserver_fds(self):
+        jobs = job_server.JobServer(4, makeflags=self._makeflags("fds"))
+        self.assertTrue(jobs.has_jobserver())
+        os.write(self.write_fd, b"x")
+        with jobs.slot():
+            with jobs.slot():
+                self.assertEqual(self._pending(), b"")
+        self.assertEqual(self._pending(), b"x")
+        pass
+
+    @unittest.skipUnless(hasattr(os, "mkfifo"), "fifo is not supported")
+    def test_jobserver_fifo(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fifo = os.path.join(temp_dir, "jobserver")
+            os.mkfifo(fifo)
+            fd = os.open(fifo, os.O_RDWR)
+            try:
+                jobs = job_server.JobServer(4, makeflags="-j4 --jobserver-auth=fifo:%s" % fifo)
+                self.assertTrue(jobs.has_jobserver())
+                os.write(fd, b"y")
+                with jobs.slot():
+                    with jobs.slot():
+                        pass
+                os.set_blocking(fd, False)
+                self.assertEqual(os.read(fd, 1024), b"y")
+            finally:
+                os.close(fd)
+        pass
+
+    def test_invalid_fds_ignored(self):
+        read_fd, write_fd = os.pipe()
+        os.close(read_fd)
+        os.close(write_fd)
+        # make没有把管道传给子进程
+        jobs = job_server.JobServer(makeflags="--jobserver-auth=%d,%d" % (read_fd, write_fd))
+        self.assertFalse(jobs.has_jobserver())
+        with jobs.slot():
+            pass
+        pass
+
+    def test_default_jobs(self):
+        with mock.patch.dict(os.environ, {job_server.JOBS_ENV: ""}):
+            self.assertEqual(job_server.JobServer(makeflags="").max_jobs(), 1)
+            self.assertEqual(job_server.JobServer(3, makeflags="").max_jobs(), 3)
+            self.assertEqual(job_server.JobServer(makeflags=self._makeflags()).max_jobs(), os.cpu_count() or 1)
+        with mock.patch.dict(os.environ, {job_server.JOBS_ENV: "2"}):
+            self.assertEqual(job_server.JobServer(makeflags="").max_jobs(), 2)
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -2,7 +2,8 @@
 
 import re
 import os
-from xml.dom import minidom
+import threading
+from xml.etree import ElementTree
 
 
 class MavenArtifact(object):
@@ -68,75 +69,243 @@ class MavenArtifact(object):
     pass
 
 
-class PomParser:
-    def __init__(self, pom_path):
-        self._pom_path = pom_path
-        self._dom = minidom.parse(pom_path)
+# pom中关心的元素
+_POM_FIELDS = {
+    "groupId": "group_id",
+    "artifactId": "artifact_id",
+    "version": "version",
+    "packaging": "packaging",
+}
+_DEPENDENCY_FIELDS = {
+    "groupId": "group_id",
+    "artifactId": "artifact_id",
+    "version": "version",
+    "type": "type",
+    "classifier": "classifier",
+    "scope": "scope",
+    "optional": "optional",
+}
+
+
+class PomDependency:
+    """pom中的一个dependency，exclusions中每一项是{"groupId": ..., "artifactId": ...}"""
+    __slots__ = ("group_id", "artifact_id", "version", "type", "classifier", "scope", "optional", "exclusions")
+
+    def __init__(self, group_id=None, artifact_id=None, version=None, type=None, classifier=None,
+                 scope=None, optional=None, exclusions=None):
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.version = version
+        self.type = type
+        self.classifier = classifier
+        self.scope = scope
+        self.optional = optional
+        self.exclusions = exclusions if exclusions is not None else []
         pass
 
-    def parse(self, config):
-        """解析pom树
-        :param config:
-        :return:
-        """
-        for node in self._dom.documentElement.childNodes:
-            if node.nodeType not in (node.ELEMENT_NODE,):
-                continue
-
-            if node.tagName in ("groupId", "artifactId", "version", "packaging", "name", "description", "url"):
-                config[node.tagName] = node.firstChild.data
-            elif node.tagName == "dependencies":
-                dependencies = []
-                dependencies.extend(PomParser.parse_dependencies(node))
-                config[node.tagName] = dependencies
-            elif node.tagName == "properties":
-                config["properties"] = PomParser.parse_properties(node)
-            pass
-        if "dependencies" not in config:
-            config["dependencies"] = []
+    def replace(self, **kwargs):
+        """复制一份，并且修改kwargs中的字段"""
+        ret = PomDependency(*(getattr(self, x) for x in PomDependency.__slots__))
+        for k, v in kwargs.items():
+            setattr(ret, k, v)
+        return ret
+
+    def to_json(self):
+        obj = {}
+        for name, attr in _DEPENDENCY_FIELDS.items():
+            value = getattr(self, attr)
+            if value is not None:
+                obj[name] = value
+        if self.exclusions:
+            obj["exclusions"] = self.exclusions
+        return obj
+
+    @classmethod
+    def from_json(cls, obj):
+        ret = cls()
+        for name, attr in _DEPENDENCY_FIELDS.items():
+            setattr(ret, attr, obj.get(name))
+        ret.exclusions = list(obj.get("exclusions", []))
+        return ret
+
+    @classmethod
+    def from_legacy_config(cls, dep_item):
+        """xmltodict格式的dependency"""
+        ret = cls()
+        for name, attr in _DEPENDENCY_FIELDS.items():
+            setattr(ret, attr, dep_item.get(name))
+        for exclusion in MavenPomConfig(dep_item).get_list("exclusions.exclusion"):
+            ret.exclusions.append({k: v for k, v in exclusion.items() if k in ("groupId", "artifactId")})
+        return ret
+
+    pass
+
+
+class PomModel:
+    """pom中构建用到的部分：坐标、packaging、parent、properties、dependencies和dependencyManagement"""
+    __slots__ = ("group_id", "artifact_id", "version", "packaging", "parent", "properties",
+                 "dependencies", "managed_dependencies")
+
+    def __init__(self):
+        self.group_id = None
+        self.artifact_id = None
+        self.version = None
+        self.packaging = "jar"
+        # MavenArtifact
+        self.parent = None
+        self.properties = {}
+        self.dependencies = []
+        self.managed_dependencies = []
         pass
 
-    @staticmethod
-    def parse_dependencies(element):
-        dep_list = []
-        for node in element.childNodes:
-            if node.nodeType != node.ELEMENT_NODE:
-                continue
-            if node.tagName != "dependency":
-                continue
-            dep_list.append(PomParser.parse_dependency(node))
-            pass
-        return dep_list
+    def effective(self, properties, dependencies):
+        """使用填充完整的properties和dependencies生成effective pom，不修改self"""
+        ret = PomModel()
+        ret.group_id = self.group_id
+        ret.artifact_id = self.artifact_id
+        ret.version = self.version
+        ret.packaging = self.packaging
+        ret.parent = self.parent
+        ret.properties = properties
+        ret.dependencies = dependencies
+        ret.managed_dependencies = self.managed_dependencies
+        return ret
+
+    def to_json(self):
+        obj = {}
+        for name, attr in _POM_FIELDS.items():
+            obj[name] = getattr(self, attr)
+        if self.parent:
+            obj["parent"] = {
+                "groupId": self.parent.group_id,
+                "artifactId": self.parent.artifact_id,
+                "version": self.parent.version,
+            }
+        obj["properties"] = self.properties
+        obj["dependencies"] = [x.to_json() for x in self.dependencies]
+        obj["dependencyManagement"] = [x.to_json() for x in self.managed_dependencies]
+        return obj
+
+    @classmethod
+    def from_json(cls, obj):
+        if "project" in obj:
+            # 以前使用xmltodict生成的.pom.json
+            return cls.from_legacy_config(obj)
+
+        ret = cls()
+        for name, attr in _POM_FIELDS.items():
+            setattr(ret, attr, obj.get(name))
+        ret.packaging = ret.packaging or "jar"
+        parent = obj.get("parent")
+        if parent:
+            ret.parent = MavenArtifact(parent["groupId"], parent["artifactId"], parent["version"])
+        ret.properties = obj.get("properties", {})
+        ret.dependencies = [PomDependency.from_json(x) for x in obj.get("dependencies", [])]
+        ret.managed_dependencies = [PomDependency.from_json(x) for x in obj.get("dependencyManagement", [])]
+        return ret
+
+    @classmethod
+    def from_legacy_config(cls, pom_config):
+        project = pom_config["project"]
+        ret = cls()
+        for name, attr in _POM_FIELDS.items():
+            if project.get(name) is not None:
+                setattr(ret, attr, project[name])
+        parent = project.get("parent")
+        if parent:
+            ret.parent = MavenArtifact(parent["groupId"], parent["artifactId"], parent["version"])
+        ret.properties = {k: v or "" for k, v in (project.get("properties") or {}).items()}
+        config = MavenPomConfig(project)
+        ret.dependencies = [PomDependency.from_legacy_config(x)
+                            for x in config.get_list("dependencies.dependency")]
+        ret.managed_dependencies = [PomDependency.from_legacy_config(x)
+                                    for x in config.get_list("dependencyManagement.dependencies.dependency")]
+        return ret
 
-    @staticmethod
-    def parse_dependency(element):
-        config = {}
-        for node in element.childNodes:
-            if node.nodeType != node.ELEMENT_NODE:
-                continue
-            if node.tagName in ("groupId", "artifactId", "version", "type", "scope"):
-                config[node.tagName] = node.firstChild.data
-            pass
-        return config
+    pass
 
-    @staticmethod
-    def parse_properties(element):
-        properties = {}
-        for node in element.childNodes:
-            if node.nodeType != node.ELEMENT_NODE:
-                continue
-            if node.firstChild is not None:
-                properties[node.tagName] = node.firstChild.data
-        return properties
+
+def _local_name(tag):
+    """去掉{namespace}前缀"""
+    return tag.rpartition("}")[2]
+
+
+def _element_text(elem):
+    return (elem.text or "").strip()
+
+
+def _parse_dependencies(elem):
+    """<dependencies>元素"""
+    dep_list = []
+    for dep_elem in elem:
+        if _local_name(dep_elem.tag) != "dependency":
+            continue
+        dep = PomDependency()
+        for child in dep_elem:
+            tag = _local_name(child.tag)
+            if tag in _DEPENDENCY_FIELDS:
+                setattr(dep, _DEPENDENCY_FIELDS[tag], _element_text(child) or None)
+            elif tag == "exclusions":
+                for exclusion_elem in child:
+                    exclusion = {}
+                    for x in exclusion_elem:
+                        tag = _local_name(x.tag)
+                        if tag in ("groupId", "artifactId"):
+                            exclusion[tag] = _element_text(x)
+                    dep.exclusions.append(exclusion)
+        dep_list.append(dep)
+    return dep_list
+
+
+def parse_pom(source):
+    """使用iterparse流式解析pom，只保留PomModel中的字段
+
+    project的每个子元素解析完成之后立即处理并且释放，licenses、build等不关心的元素不会保留。
+    @param source: 文件路径或者二进制文件对象
+    """
+    model = PomModel()
+    depth = 0
+    for event, elem in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+
+        tag = _local_name(elem.tag)
+        if tag in _POM_FIELDS:
+            setattr(model, _POM_FIELDS[tag], _element_text(elem))
+        elif tag == "parent":
+            parent = {_local_name(x.tag): _element_text(x) for x in elem}
+            model.parent = MavenArtifact(parent.get("groupId"), parent.get("artifactId"), parent.get("version"))
+        elif tag == "properties":
+            for x in elem:
+                model.properties[_local_name(x.tag)] = _element_text(x)
+        elif tag == "dependencies":
+            model.dependencies = _parse_dependencies(elem)
+        elif tag == "dependencyManagement":
+            for x in elem:
+                if _local_name(x.tag) == "dependencies":
+                    model.managed_dependencies = _parse_dependencies(x)
+        elem.clear()
+
+    model.packaging = model.packaging or "jar"
+    return model
 
 
 class MavenM2:
-    def __init__(self, m2_home):
+    def __init__(self, m2_home, store=None):
         self._m2_home = os.path.abspath(os.path.normpath(m2_home))
         self._m2_files = os.path.join(self._m2_home, "files")
         self._m2_build = os.path.join(self._m2_home, "build")
+        # 多个工作区共享的ArtifactStore，m2_files中的文件链接到其中的blob
+        self._store = store
         pass
 
+    def store(self):
+        return self._store
+
     def m2_build(self):
         return self._m2_build
 
@@ -173,42 +342,48 @@ class MavenPomConfig:
 
 
 class MavenPom:
-    def __init__(self, artifact: MavenArtifact, pom_config, parent_pom=None):
+    def __init__(self, artifact: MavenArtifact, model: PomModel, parent_pom=None, managed_index=None):
         self.artifact = artifact
-        self.pom_config = pom_config
+        # effective pom
+        self.model = model
         self.parent_pom = parent_pom
+        # 合并了parent和import的BOM之后的dependencyManagement：(groupId, artifactId) -> PomDependency
+        self.managed_index = managed_index if managed_index is not None else {}
+        # 被其他pom以import方式引用时提供的dependencyManagement，版本号已经填充
+        self.imported_index = None
         pass
 
     def get_managed_depend(self, group_id, artifact_id):
-        project = self.pom_config["project"]
-        if "pom" == project.get("packaging"):
-            for dep_item in MavenPomConfig(project).get_list("dependencyManagement.dependencies.dependency"):
-                if group_id == dep_item["groupId"] and artifact_id == dep_item["artifactId"]:
-                    return dep_item
-        if self.parent_pom:
-            return self.parent_pom.get_managed_depend(group_id, artifact_id)
-        return None
+        return self.managed_index.get((group_id, artifact_id))
 
     def get_depends(self, wanted_list=("compile",)):
-        dep_list = []
-        for dep_item in MavenPomConfig(self.pom_config).get_list("project.dependencies.dependency"):
-            scope = dep_item.get("scope", "compile")
-            if scope not in wanted_list:
-                continue
-            dep_list.append(dep_item)
-        return dep_list
+        return [x for x in self.model.dependencies if (x.scope or "compile") in wanted_list]
 
 
 class MavenContext:
     def __init__(self):
         self._pom_map = {}
+        self._lock = threading.Lock()
+        self._artifact_locks = {}
         pass
 
+    def artifact_lock(self, artifact):
+        """每个构件对应的锁，保证同一个构件只被下载一次
+        """
+        with self._lock:
+            lock = self._artifact_locks.get(artifact)
+            if lock is None:
+                lock = threading.Lock()
+                self._artifact_locks[artifact] = lock
+            return lock
+
     def maven_pom(self, artifact, force=False) -> MavenPom:
-        pom = self._pom_map.get(artifact)
+        with self._lock:
+            pom = self._pom_map.get(artifact)
         if pom is None and force:
             raise Exception("pom %s can't be found" % artifact)
         return pom
 
     def add_maven_pom(self, maven_pom: MavenPom):
-        self._pom_map[maven_pom.artifact] = maven_pom
+        with self._lock:
+            self._pom_map[maven_pom.artifact] = maven_pom
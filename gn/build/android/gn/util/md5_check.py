@@ -1,11 +1,147 @@
 # -*- encoding: utf-8 -*-
 
 
+import collections
+import functools
 import hashlib
 import os
 import zipfile
+import zlib
 import json
 import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from util import digest_cache
+
+# 计算摘要的线程数
+HASH_WORKERS_ENV = "ANDROID_BUILD_HASH_WORKERS"
+# 超过这个大小的文件不预读，直接流式计算
+_READ_AHEAD_LIMIT = 4 * 1024 * 1024
+
+# stamp记录使用的摘要算法
+DIGEST_ALGORITHM_ENV = "ANDROID_BUILD_DIGEST_ALGORITHM"
+# 没有记录算法的旧stamp使用的是md5
+_LEGACY_DIGEST_ALGORITHM = "md5"
+
+_hash_workers = None
+_digest_algorithm = None
+# 标记线程池中计算标签的线程，这些线程中不再创建线程池
+_worker_state = threading.local()
+
+
+class _Crc32Digest:
+    """非加密的快速摘要
+    """
+
+    def __init__(self):
+        self._value = 0
+        pass
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+        pass
+
+    def hexdigest(self):
+        return "%08x" % self._value
+
+    pass
+
+
+_DIGEST_FACTORIES = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+    "crc32": _Crc32Digest,
+}
+
+
+def digest_algorithms():
+    """支持的摘要算法
+    """
+    return sorted(_DIGEST_FACTORIES)
+
+
+def _check_digest_algorithm(algorithm):
+    if algorithm not in _DIGEST_FACTORIES:
+        raise Exception("Unknown digest algorithm: %s, supported: %s"
+                        % (algorithm, ", ".join(digest_algorithms())))
+    return algorithm
+
+
+def set_digest_algorithm(algorithm):
+    """设置stamp记录使用的摘要算法
+    """
+    global _digest_algorithm
+    _digest_algorithm = _check_digest_algorithm(algorithm)
+    pass
+
+
+def digest_algorithm():
+    """stamp记录使用的摘要算法
+    """
+    if _digest_algorithm is not None:
+        return _digest_algorithm
+    return _check_digest_algorithm(
+        os.environ.get(DIGEST_ALGORITHM_ENV) or _LEGACY_DIGEST_ALGORITHM)
+
+
+def set_hash_workers(workers):
+    """设置计算摘要的线程数，1表示串行计算
+    """
+    global _hash_workers
+    _hash_workers = max(1, int(workers))
+    pass
+
+
+def hash_workers():
+    """计算摘要的线程数
+    """
+    if _hash_workers is not None:
+        return _hash_workers
+    if os.environ.get(HASH_WORKERS_ENV):
+        return max(1, int(os.environ[HASH_WORKERS_ENV]))
+    return min(8, os.cpu_count() or 1)
+
+
+def _input_tag(algorithm, path):
+    """计算输入文件的标签
+    """
+    if _is_zip_file(path):
+        return _extra_zip_entries(path)
+    return _digest_for_path(path, algorithm)
+
+
+def _compute_input_tags(input_paths, workers, algorithm):
+    """并发计算所有输入文件的标签，结果和input_paths的顺序一致
+    """
+    compute = functools.partial(_input_tag, algorithm)
+    if workers <= 1 or len(input_paths) <= 1:
+        return [compute(path) for path in input_paths]
+    with ThreadPoolExecutor(max_workers=workers, initializer=_mark_pool_worker) as executor:
+        return list(executor.map(compute, input_paths))
+
+
+def _mark_pool_worker():
+    _worker_state.in_pool = True
+    pass
+
+
+def _create_metadata(input_strings, input_paths, workers, algorithm):
+    """计算输入对应的记录
+    """
+    metadata = _Metadata(algorithm)
+    metadata.add_strings(input_strings)
+    input_tags = _compute_input_tags(input_paths, workers, algorithm)
+    for path, tag in zip(input_paths, input_tags):
+        if _is_zip_file(path):
+            metadata.add_zip_file(path, tag)
+            pass
+        else:
+            metadata.add_file(path, tag)
+            pass
+    return metadata
 
 
 def call_and_record_if_stale(function,
@@ -14,7 +150,8 @@ def call_and_record_if_stale(function,
                              input_strings=None,
                              output_paths=None,
                              force=False,
-                             pass_changes=False):
+                             pass_changes=False,
+                             workers=None):
     assert (record_path or output_paths)
     input_paths = input_paths or []
     input_strings = input_strings or []
@@ -24,15 +161,9 @@ def call_and_record_if_stale(function,
     if not record_path.endswith(".md5.stamp"):
         raise Exception()
 
-    new_metadata = _Metadata()
-    new_metadata.add_strings(input_strings)
-    for path in input_paths:
-        if _is_zip_file(path):
-            new_metadata.add_zip_file(path, _extra_zip_entries(path))
-            pass
-        else:
-            new_metadata.add_file(path, _md5_for_path(path))
-            pass
+    workers = workers or hash_workers()
+    new_metadata = _create_metadata(input_strings, input_paths,
+                                    workers, digest_algorithm())
 
     old_metadata = None
     missing_outputs = [
@@ -41,9 +172,22 @@ def call_and_record_if_stale(function,
     if not missing_outputs and os.path.exists(record_path):
         with open(record_path, mode="r", encoding="utf-8") as fp:
             old_metadata = _Metadata.from_file(fp)
+        if old_metadata.algorithm() not in _DIGEST_FACTORIES:
+            # 旧的记录使用了不支持的算法，当做没有记录重新执行
+            old_metadata = None
+
+    compared_metadata = new_metadata
+    if old_metadata and old_metadata.algorithm() != new_metadata.algorithm():
+        # 旧的记录使用了其他的算法，用旧算法重新计算后再比较
+        compared_metadata = _create_metadata(input_strings, input_paths,
+                                             workers, old_metadata.algorithm())
 
-    changes = Changes(old_metadata, new_metadata, force, missing_outputs)
+    changes = Changes(old_metadata, compared_metadata, force, missing_outputs)
     if not changes.has_changes():
+        if compared_metadata is not new_metadata:
+            # 输入没有变化，只把记录迁移到新的算法
+            with open(record_path, mode="w+", encoding="utf-8") as fp:
+                new_metadata.to_file(fp)
         return
 
     if pass_changes:
@@ -57,9 +201,10 @@ def call_and_record_if_stale(function,
 
 
 class _Metadata:
-    def __init__(self):
+    def __init__(self, algorithm=_LEGACY_DIGEST_ALGORITHM):
         """
         """
+        self._algorithm = algorithm
         self._strings_md5 = None
         self._files_md5 = None
         self._strings = []
@@ -71,8 +216,8 @@ class _Metadata:
     def from_file(cls, fileobj):
         """构造对象
         """
-        ret = cls()
         obj = json.load(fileobj)
+        ret = cls(obj.get("digest-algorithm", _LEGACY_DIGEST_ALGORITHM))
         ret._files_md5 = obj["files-md5"]
         ret._strings_md5 = obj["strings-md5"]
         ret._files = obj["input-files"]
@@ -83,6 +228,7 @@ class _Metadata:
         """写入文件
         """
         obj = {
+            "digest-algorithm": self._algorithm,
             "strings-md5": self.strings_md5(),
             "files-md5": self.files_md5(),
             "input-strings": self._strings,
@@ -91,6 +237,11 @@ class _Metadata:
         json.dump(obj, fp=fileobj, indent=2)
         pass
 
+    def algorithm(self):
+        """文件摘要使用的算法
+        """
+        return self._algorithm
+
     def add_strings(self, values):
         """添加字符串
         """
@@ -148,7 +299,7 @@ class _Metadata:
                     self._file_map[(
                         entry["path"], sub_entry["path"])] = sub_entry
                 pass
-        return self._file_map[(path, subpath)]
+        return self._file_map.get((path, subpath))
 
     def get_tag(self, path, subpath=None):
         """得到对应的md5
@@ -160,7 +311,7 @@ class _Metadata:
         """
         """
         if self._strings_md5 is None:
-            self._strings = _compute_inline_md5(self._strings)
+            self._strings_md5 = _compute_inline_md5(self._strings)
         return self._strings_md5
 
     def files_md5(self):
@@ -285,30 +436,86 @@ def _update_md5_for_file(md5, path, block_size=2 ** 16):
     pass
 
 
+def _read_small_file(path):
+    """预读小文件，大文件返回None
+    """
+    if os.path.getsize(path) > _READ_AHEAD_LIMIT:
+        return None
+    with open(path, mode="rb") as fp:
+        return fp.read()
+
+
 def _update_md5_for_directory(md5, dir_path):
     """计算MD5
     """
+    paths = []
     for root, _, files in os.walk(dir_path):
-        for file in files:
-            _update_md5_for_file(md5, os.path.join(root, file))
+        paths.extend(os.path.join(root, file) for file in files)
+
+    workers = hash_workers()
+    # 已经在线程池中的时候串行计算，避免线程数和预读的内存成倍增加
+    if workers <= 1 or len(paths) <= 1 or getattr(_worker_state, "in_pool", False):
+        for path in paths:
+            _update_md5_for_file(md5, path)
+        return
+
+    def consume(path, future):
+        data = future.result()
+        if data is None:
+            _update_md5_for_file(md5, path)
+        else:
+            md5.update(data)
+        pass
+
+    # 并发预读文件，按照遍历顺序更新摘要，保证结果和串行计算一致
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window = collections.deque()
+        for path in paths:
+            window.append((path, executor.submit(_read_small_file, path)))
+            if len(window) >= workers * 2:
+                consume(*window.popleft())
+        while window:
+            consume(*window.popleft())
     pass
 
 
-def _md5_for_path(path):
-    """计算路径对应的MD5
+def _compute_digest_for_path(path, algorithm):
+    """计算路径对应的摘要
     """
-    md5 = hashlib.md5()
+    digest = _DIGEST_FACTORIES[algorithm]()
     if os.path.isdir(path):
-        _update_md5_for_directory(md5, path)
+        _update_md5_for_directory(digest, path)
     else:
-        _update_md5_for_file(md5, path)
-    return md5.hexdigest()
+        _update_md5_for_file(digest, path)
+    return digest.hexdigest()
+
+
+def _digest_for_path(path, algorithm):
+    """计算路径对应的摘要，文件没有变化的时候直接使用缓存
+    """
+    signature = mtime_ns = None
+    if os.path.isdir(path):
+        signature, mtime_ns = digest_cache.directory_signature(path)
+    return digest_cache.lookup(algorithm, path,
+                               lambda: _compute_digest_for_path(path, algorithm),
+                               signature=signature,
+                               mtime_ns=mtime_ns)
+
+
+def _md5_for_path(path):
+    """计算路径对应的MD5
+    """
+    return _digest_for_path(path, "md5")
 
 
 def md5_for_path(path):
     return _md5_for_path(path)
 
 
+def digest_for_path(path, algorithm=None):
+    return _digest_for_path(path, algorithm or digest_algorithm())
+
+
 def _compute_inline_md5(iterables):
     """计算MD5
     """
@@ -330,7 +537,7 @@ def _is_zip_file(path):
     return path[-4:] in (".jar", ".zip", "apk") or path.endswith(".srcjar")
 
 
-def _extra_zip_entries(path):
+def _compute_zip_entries(path):
     """抽取内容
     """
     entries = []
@@ -338,4 +545,12 @@ def _extra_zip_entries(path):
         for info in zip_file.infolist():
             if info.CRC:
                 entries.append((info.filename, info.CRC + info.compress_type))
-    return entries
+    return json.dumps(entries)
+
+
+def _extra_zip_entries(path):
+    """抽取内容，zip文件没有变化的时候直接使用缓存
+    """
+    entries = digest_cache.lookup("zip-entries", path,
+                                  lambda: _compute_zip_entries(path))
+    return [tuple(e) for e in json.loads(entries)]
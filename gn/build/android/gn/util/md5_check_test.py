@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import os
+import tempfile
+import unittest
+from concurrent import futures
+from unittest import mock
+
+from util import digest_cache
+
+# 测试不使用工作目录中的摘要缓存
+os.environ[digest_cache.DIGEST_CACHE_ENV] = ""
+
+from util import md5_check
+
+
+class Md5CheckTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        self.input_path = os.path.join(self.base_dir, "input.txt")
+        with open(self.input_path, mode="w", encoding="utf-8") as fp:
+            fp.write("input")
+        self.record_path = os.path.join(self.base_dir, "output.md5.stamp")
+        self.calls = []
+        pass
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        pass
+
+    def _call(self, input_strings, **kwargs):
+        md5_check.call_and_record_if_stale(lambda: self.calls.append(list(input_strings)),
+                                           record_path=self.record_path,
+                                           input_paths=[self.input_path],
+                                           input_strings=input_strings,
+                                           **kwargs)
+        pass
+
+    def test_input_strings_changed(self):
+        self._call(["a"])
+        self._call(["a"])
+        self.assertEqual(self.calls, [["a"]])
+
+        self._call(["b"])
+        self.assertEqual(self.calls, [["a"], ["b"]])
+        pass
+
+    def test_strings_md5_recorded(self):
+        self._call(["a"])
+        with open(self.record_path, mode="r", encoding="utf-8") as fp:
+            metadata = md5_check._Metadata.from_file(fp)
+        self.assertIsNotNone(metadata.strings_md5())
+        self.assertEqual(metadata.strings_md5(), md5_check.compute_inline_md5(["a"]))
+        pass
+
+    def test_input_file_changed(self):
+        self._call(["a"])
+        with open(self.input_path, mode="w", encoding="utf-8") as fp:
+            fp.write("changed")
+        self._call(["a"])
+        self.assertEqual(len(self.calls), 2)
+        pass
+
+    def test_unknown_record_algorithm(self):
+        self._call(["a"])
+        with open(self.record_path, mode="r", encoding="utf-8") as fp:
+            record = json.load(fp)
+        record["digest-algorithm"] = "removed-algorithm"
+        with open(self.record_path, mode="w", encoding="utf-8") as fp:
+            json.dump(record, fp)
+
+        self._call(["a"])
+        self.assertEqual(len(self.calls), 2)
+        with open(self.record_path, mode="r", encoding="utf-8") as fp:
+            self.assertEqual(json.load(fp)["digest-algorithm"], md5_check.digest_algorithm())
+        pass
+
+    def test_directories_hashed_in_one_pool(self):
+        dirs = []
+        for i in range(3):
+            dir_path = os.path.join(self.base_dir, "dir%d" % i)
+            os.makedirs(dir_path)
+            for j in range(8):
+                with open(os.path.join(dir_path, "file%d" % j), mode="w", encoding="utf-8") as fp:
+                    fp.write("%d-%d" % (i, j))
+            dirs.append(dir_path)
+        expected = [md5_check._compute_digest_for_path(x, "md5") for x in dirs]
+
+        pools = []
+        init = futures.ThreadPoolExecutor.__init__
+
+        def counting_init(executor, *args, **kwargs):
+            pools.append(executor)
+            init(executor, *args, **kwargs)
+            pass
+
+        with mock.patch.object(md5_check, "_hash_workers", 4), \
+                mock.patch.object(futures.ThreadPoolExecutor, "__init__", counting_init):
+            tags = md5_check._compute_input_tags(dirs, 4, "md5")
+        self.assertEqual(tags, expected)
+        self.assertEqual(len(pools), 1)
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+
+import array
+import os
+import struct
+
+# R.txt旁边的二进制符号表缓存，由生成R.txt的任务写入
+SYMBOLS_SUFFIX = ".symbols"
+
+_MAGIC = b"RSYM"
+_VERSION = 2
+# magic, version, R.txt大小, R.txt的mtime_ns, 符号个数, 类型名称长度, 符号名称长度, 值的长度
+_HEADER = struct.Struct("<4sIqqIIII")
+
+_FLAG_ARRAY = 1
+
+_R_JAVA_HEADER = """/* AUTO-GENERATED FILE.  DO NOT MODIFY. */
+
+package %s;
+
+public final class R {
+"""
+
+
+class SymbolTable:
+    """R.txt中的符号表
+
+    资源类型的下标和flags保存在数组中；值保存R.txt中的原始文本，生成的R.java和R.txt完全一致。
+    """
+
+    def __init__(self):
+        self.types = []
+        self.type_ids = array.array("H")
+        self.names = []
+        self.flags = array.array("B")
+        self.values = []
+        self._type_index = {}
+        self._index = None
+        pass
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, java_type, resource_type, name, value):
+        """添加R.txt中的一行"""
+        if java_type == "int[]":
+            flags = _FLAG_ARRAY
+        elif java_type == "int":
+            flags = 0
+        else:
+            raise ValueError("unknown java type: %s" % java_type)
+
+        type_id = self._type_index.get(resource_type)
+        if type_id is None:
+            type_id = len(self.types)
+            self._type_index[resource_type] = type_id
+            self.types.append(resource_type)
+        self.type_ids.append(type_id)
+        self.names.append(name)
+        self.flags.append(flags)
+        self.values.append(value)
+        self._index = None
+        pass
+
+    def resource_type(self, i):
+        return self.types[self.type_ids[i]]
+
+    def java_type(self, i):
+        return "int[]" if self.flags[i] & _FLAG_ARRAY else "int"
+
+    def java_value(self, i):
+        """R.java中的值"""
+        return self.values[i]
+
+    def find(self, resource_type, name):
+        """:return: 符号的下标，没有的时候返回-1"""
+        if self._index is None:
+            self._index = {(self.types[t], n): i for i, (t, n) in enumerate(zip(self.type_ids, self.names))}
+        return self._index.get((resource_type, name), -1)
+
+    def to_bytes(self, size, mtime_ns):
+        types_data = "\n".join(self.types).encode("utf-8")
+        names_data = "\n".join(self.names).encode("utf-8")
+        values_data = "\n".join(self.values).encode("utf-8")
+        return b"".join([
+            _HEADER.pack(_MAGIC, _VERSION, size, mtime_ns, len(self.names),
+                         len(types_data), len(names_data), len(values_data)),
+            types_data,
+            names_data,
+            values_data,
+            self.type_ids.tobytes(),
+            self.flags.tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data, size=None, mtime_ns=None):
+        """:return: 格式或者R.txt的签名不匹配的时候返回None"""
+        if len(data) < _HEADER.size:
+            return None
+        (magic, version, data_size, data_mtime_ns, count,
+         types_size, names_size, values_size) = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            return None
+        if size is not None and (data_size, data_mtime_ns) != (size, mtime_ns):
+            return None
+
+        ret = cls()
+        offset = _HEADER.size
+        texts = []
+        for text_size in (types_size, names_size, values_size):
+            texts.append(data[offset:offset + text_size].decode("utf-8"))
+            offset += text_size
+        types_data, names_data, values_data = texts
+        ret.types = types_data.split("\n") if types_data else []
+        ret._type_index = {x: i for i, x in enumerate(ret.types)}
+        ret.names = names_data.split("\n") if count else []
+        ret.values = values_data.split("\n") if count else []
+        for name in ("type_ids", "flags"):
+            values = getattr(ret, name)
+            end = offset + values.itemsize * count
+            values.frombytes(data[offset:end])
+            offset = end
+        if len(ret.names) != count or len(ret.values) != count or len(ret.flags) != count:
+            return None
+        return ret
+
+    pass
+
+
+def parse_r_text(path):
+    """解析aapt生成的R.txt"""
+    table = SymbolTable()
+    with open(path, mode="r", encoding="utf-8") as fp:
+        for line in fp:
+            items = line.rstrip("\r\n").split(" ", 3)
+            try:
+                table.add(*items)
+            except (TypeError, ValueError):
+                raise Exception("parse R.txt exception -> %s: %s" % (path, line))
+    return table
+
+
+def write_symbol_table(r_text_path, table=None):
+    """在R.txt旁边写入二进制符号表，只由生成R.txt的任务调用"""
+    if table is None:
+        table = parse_r_text(r_text_path)
+    stat_obj = os.stat(r_text_path)
+    symbols_path = r_text_path + SYMBOLS_SUFFIX
+    tmp_path = "%s.%d.tmp" % (symbols_path, os.getpid())
+    with open(tmp_path, mode="wb") as fp:
+        fp.write(table.to_bytes(stat_obj.st_size, stat_obj.st_mtime_ns))
+    os.replace(tmp_path, symbols_path)
+    return table
+
+
+def load_symbol_table(r_text_path):
+    """读取R.txt的符号表，二进制缓存不存在或者过期的时候解析R.txt
+
+    R.txt属于其他的任务，这里只读取缓存，不写入。
+    """
+    stat_obj = os.stat(r_text_path)
+    try:
+        with open(r_text_path + SYMBOLS_SUFFIX, mode="rb") as fp:
+            table = SymbolTable.from_bytes(fp.read(), stat_obj.st_size, stat_obj.st_mtime_ns)
+        if table is not None:
+            return table
+    except OSError:
+        pass
+    return parse_r_text(r_text_path)
+
+
+def write_r_java(fp, package, entries_by_type, shared_resources=False):
+    """逐行写入R.java
+    @param entries_by_type: [(资源类型, [(SymbolTable, 下标)])]
+    """
+    modifier = "public static" if shared_resources else "public static final"
+    fp.write(_R_JAVA_HEADER % package)
+    for resource_type, entries in entries_by_type:
+        fp.write("    public static final class %s {\n" % resource_type)
+        for table, i in entries:
+            fp.write("        %s %s %s = %s;\n" % (modifier, table.java_type(i), table.names[i], table.java_value(i)))
+        fp.write("    }\n")
+    fp.write("}")
+    pass
@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from util import r_text
+
+_R_TEXT = """int attr colorAccent 0x7f010000
+int id text 0x7f020001
+int[] styleable Theme { 0x10100b3, 0x7f010000 }
+int styleable Theme_android_padding 0
+int[] styleable Empty {  }
+"""
+
+
+class RTextTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.r_text_path = os.path.join(self._temp_dir.name, "R.txt")
+        with open(self.r_text_path, mode="w", encoding="utf-8") as fp:
+            fp.write(_R_TEXT)
+        pass
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        pass
+
+    def _r_java(self, table):
+        fp = io.StringIO()
+        r_text.write_r_java(fp, "org.test", [("styleable", [(table, i) for i in range(2, 5)])])
+        return fp.getvalue()
+
+    def test_values_kept_verbatim(self):
+        table = r_text.parse_r_text(self.r_text_path)
+        self.assertEqual(table.java_value(2), "{ 0x10100b3, 0x7f010000 }")
+        self.assertEqual(table.java_value(3), "0")
+        self.assertIn("public static final int[] Theme = { 0x10100b3, 0x7f010000 };\n", self._r_java(table))
+        pass
+
+    def test_binary_round_trip(self):
+        table = r_text.parse_r_text(self.r_text_path)
+        loaded = r_text.SymbolTable.from_bytes(table.to_bytes(1, 2), 1, 2)
+        self.assertEqual(self._r_java(loaded), self._r_java(table))
+        self.assertEqual(loaded.find("id", "text"), 1)
+        self.assertEqual(loaded.java_type(4), "int[]")
+        self.assertIsNone(r_text.SymbolTable.from_bytes(table.to_bytes(1, 2), 1, 3))
+        pass
+
+    def test_load_does_not_write(self):
+        r_text.load_symbol_table(self.r_text_path)
+        self.assertFalse(os.path.exists(self.r_text_path + r_text.SYMBOLS_SUFFIX))
+        pass
+
+    def test_load_written_table(self):
+        r_text.write_symbol_table(self.r_text_path)
+        with mock.patch.object(r_text, "parse_r_text", side_effect=AssertionError):
+            table = r_text.load_symbol_table(self.r_text_path)
+        self.assertEqual(table.java_value(0), "0x7f010000")
+
+        # R.txt变化之后不使用过期的缓存
+        with open(self.r_text_path, mode="a", encoding="utf-8") as fp:
+            fp.write("int id other 0x7f020002\n")
+        self.assertEqual(len(r_text.load_symbol_table(self.r_text_path)), 6)
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -53,8 +53,11 @@ class AndroidManifest:
 
 class Deps:
     def __init__(self, direct_deps_config_paths):
+        self.deps_graph = _merge_deps_graphs(direct_deps_config_paths)
         self.all_deps_config_paths = get_all_deps_configs_in_order(
-            direct_deps_config_paths)
+            direct_deps_config_paths, self.deps_graph)
+        # remove_non_direct_dep之前的顺序，记录在.deps_graph中
+        self.sorted_deps_config_paths = list(self.all_deps_config_paths)
         self.direct_deps_configs = resolve_groups([get_dep_config(path)
                                                    for path in direct_deps_config_paths])
         self.all_deps_configs = [get_dep_config(path)
@@ -181,7 +184,11 @@ def create_parser() -> argparse.ArgumentParser:
     return parser
 
 
+# .build_config旁边记录的依赖关系：排好序的所有依赖项以及每一项的直接依赖项
+DEPS_GRAPH_SUFFIX = ".deps_graph"
+
 _dep_config_cache = dict()
+_deps_graph_cache = dict()
 
 
 def get_dep_config(path):
@@ -190,6 +197,59 @@ def get_dep_config(path):
     return _dep_config_cache[path]
 
 
+def _build_config_signature(path):
+    stat_obj = os.stat(path)
+    return [stat_obj.st_size, stat_obj.st_mtime_ns]
+
+
+def _read_deps_graph(path):
+    """读取path生成时记录的依赖关系，.build_config变化之后记录失效
+    :return: [[路径, 直接依赖项]]，没有或者过期的时候返回None
+    """
+    try:
+        data = build_utils.read_json(path + DEPS_GRAPH_SUFFIX)
+    except (OSError, ValueError):
+        return None
+    if data.get("build_config") != _build_config_signature(path):
+        return None
+    return data["graph"]
+
+
+def write_deps_graph(path, deps):
+    """在刚刚写入的.build_config旁边记录依赖关系，依赖这个目标的目标不需要再遍历上游
+    """
+    graph = [[x, deps.deps_graph[x]] for x in deps.sorted_deps_config_paths]
+    graph.append([path, deps.direct_deps_config_paths])
+    build_utils.write_json({"build_config": _build_config_signature(path), "graph": graph},
+                           path + DEPS_GRAPH_SUFFIX)
+    pass
+
+
+def _get_deps_graph(path, visiting=()):
+    """path以及它所有依赖项的直接依赖项，优先使用path生成时的记录
+    :return: {路径: 直接依赖项}
+    """
+    if path not in _deps_graph_cache:
+        graph = _read_deps_graph(path)
+        if graph is not None:
+            graph = dict(graph)
+        else:
+            if path in visiting:
+                raise Exception("Dependency cycle found: %s" % " -> ".join(list(visiting) + [path]))
+            deps_configs = get_dep_config(path)["deps_configs"]
+            graph = _merge_deps_graphs(deps_configs, tuple(visiting) + (path,))
+            graph[path] = deps_configs
+        _deps_graph_cache[path] = graph
+    return _deps_graph_cache[path]
+
+
+def _merge_deps_graphs(deps_configs, visiting=()):
+    graph = {}
+    for dep in deps_configs:
+        graph.update(_get_deps_graph(dep, visiting))
+    return graph
+
+
 def _filter_unwanted_deps_configs(config_type, configs):
     """去掉错误的依赖类型
     """
@@ -200,14 +260,13 @@ def _filter_unwanted_deps_configs(config_type, configs):
     return configs
 
 
-def get_all_deps_configs_in_order(deps_configs):
-    """得到所有的依赖项
+def get_all_deps_configs_in_order(deps_configs, deps_graph=None):
+    """得到所有的依赖项，直接依赖项的记录合并之后排序，和遍历所有.build_config的结果相同
+    @param deps_graph: 合并之后的依赖关系，没有的时候读取直接依赖项的记录
     """
-
-    def get_deps(dep):
-        return set(get_dep_config(dep)["deps_configs"])
-
-    return build_utils.get_sorted_transitive_dependencies(deps_configs, get_deps)
+    if deps_graph is None:
+        deps_graph = _merge_deps_graphs(deps_configs)
+    return build_utils.get_sorted_transitive_dependencies(deps_configs, deps_graph.__getitem__)
 
 
 def deps_of_type(wanted_type, configs):
@@ -480,6 +539,7 @@ def main():
         pass
 
     build_utils.write_json(config, args.build_config)
+    write_deps_graph(args.build_config, deps)
     if args.depfile:
         build_utils.write_dep_file(args.depfile, all_inputs)
     pass
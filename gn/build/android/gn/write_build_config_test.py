@@ -0,0 +1,127 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from util import build_utils
+
+import write_build_config
+
+
+class DepsOrderTest(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = self._temp_dir.name
+        self.deps = {}
+        pass
+
+    def tearDown(self):
+        self._clear_caches()
+        self._temp_dir.cleanup()
+        pass
+
+    @staticmethod
+    def _clear_caches():
+        # 每个write_build_config任务是单独的进程
+        write_build_config._dep_config_cache.clear()
+        write_build_config._deps_graph_cache.clear()
+        pass
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, "%s.build_config" % name)
+
+    def _build(self, name, deps, record=True):
+        """按照write_build_config.main的方式写入.build_config以及依赖关系的记录"""
+        self._clear_caches()
+        path = self._path(name)
+        deps_configs = [self._path(x) for x in deps]
+        self.deps[path] = deps_configs
+        build_utils.write_json({"deps_info": {
+            "name": name,
+            "path": path,
+            "type": "java_library",
+            "deps_configs": deps_configs,
+        }}, path)
+        if record:
+            write_build_config.write_deps_graph(path, write_build_config.Deps(deps_configs))
+        pass
+
+    def _expected(self, deps_configs):
+        return build_utils.get_sorted_transitive_dependencies(deps_configs, lambda x: self.deps[x])
+
+    def _order(self, deps_configs):
+        self._clear_caches()
+        return write_build_config.get_all_deps_configs_in_order(deps_configs)
+
+    def _names(self, paths):
+        return [os.path.basename(x)[:-len(".build_config")] for x in paths]
+
+    def _build_example(self, record=True):
+        # A -> [B, C], B -> [D]
+        for name, deps in (("D", []), ("C", []), ("B", ["D"])):
+            self._build(name, deps, record)
+        pass
+
+    def test_order_without_records(self):
+        self._build_example(record=False)
+        direct = [self._path("B"), self._path("C")]
+        self.assertEqual(self._names(self._order(direct)), ["C", "D", "B"])
+        self.assertFalse(os.path.exists(self._path("B") + write_build_config.DEPS_GRAPH_SUFFIX))
+        pass
+
+    def test_upstream_not_walked(self):
+        self._build_example()
+        direct = [self._path("B"), self._path("C")]
+        read_json = build_utils.read_json
+        read_paths = []
+
+        def record_read(path):
+            read_paths.append(path)
+            return read_json(path)
+
+        with mock.patch.object(build_utils, "read_json", side_effect=record_read):
+            order = self._order(direct)
+        self.assertEqual(self._names(order), ["C", "D", "B"])
+        # 只读取直接依赖项的记录
+        self.assertEqual(sorted(read_paths), sorted(x + write_build_config.DEPS_GRAPH_SUFFIX for x in direct))
+        pass
+
+    def test_stale_record_ignored(self):
+        self._build_example()
+        self._build("E", [])
+        # B重新生成但是没有更新记录
+        self._build("B", ["E"], record=False)
+        st = os.stat(self._path("B"))
+        os.utime(self._path("B"), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self._names(self._order([self._path("B"), self._path("C")])), ["C", "E", "B"])
+        pass
+
+    def test_cycle(self):
+        self._build("X", ["Y"], record=False)
+        self._build("Y", ["X"], record=False)
+        with self.assertRaises(Exception) as context:
+            self._order([self._path("X")])
+        self.assertIn("Dependency cycle found", str(context.exception))
+        pass
+
+    def test_random_graphs_match_full_walk(self):
+        rand = random.Random(1)
+        for graph_index in range(20):
+            names = ["n%d_%d" % (graph_index, i) for i in range(25)]
+            for i, name in enumerate(names):
+                deps = rand.sample(names[:i], min(i, rand.randint(0, 4)))
+                # 一部分目标没有记录，需要回退到遍历
+                self._build(name, deps, record=rand.random() < 0.8)
+                direct = [self._path(x) for x in deps]
+                self.assertEqual(self._order(direct), self._expected(direct), name)
+        pass
+
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
+    pass
@@ -1,14 +1,23 @@
 # -*- encoding: utf-8 -*-
 
-import urllib.request
-import io
 import argparse
+import os
+import sys
+
+# 下载的实现和android/gn中的maven_download.py共用，那里的脚本以所在目录为sys.path[0]导入util，
+# 这个脚本在//gn/build中，需要把android/gn加入sys.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "android", "gn"))
+
+from util import http_download
+from util.http_pool import HttpConnectionPool
 
 
 def create_parser():
     parser = argparse.ArgumentParser(prog="gn_download.py")
     parser.add_argument("--url")
     parser.add_argument("--output")
+    parser.add_argument("--connections", type=int, default=http_download.DEFAULT_CONNECTIONS,
+                        help="Maximum number of concurrent ranged requests for large files.")
     return parser
 
 
@@ -16,14 +25,11 @@ def main():
     parser = create_parser()
     args = parser.parse_args()
 
-    with urllib.request.urlopen(args.url) as response:
-        assert (response.code == 200)
-        with open(args.output, mode="wb") as dst_fp:
-            while True:
-                data = response.read(io.DEFAULT_BUFFER_SIZE)
-                if not data:
-                    break
-                dst_fp.write(data)
+    # 中断的下载保留在.part文件中，下次继续
+    with HttpConnectionPool(max_idle_per_host=args.connections) as opener, \
+            http_download.locked_part(args.output) as part_path:
+        http_download.download(opener, args.url, part_path, connections=args.connections)
+        os.replace(part_path, args.output)
     pass
 
 